@@ -6,7 +6,9 @@ from .models import (
     AppUsageLog, 
     BlockedApp, 
     ScreenTimeRule, 
-    ScreenTime
+    ScreenTime,
+    ScheduledJob,
+    JobRun
 )
 
 @admin.register(CustomUser)
@@ -68,3 +70,15 @@ class ScreenTimeAdmin(admin.ModelAdmin):
     search_fields = ('device__device_id', 'device__nickname')
     readonly_fields = ('created_at',)
     date_hierarchy = 'timestamp'
+
+@admin.register(ScheduledJob)
+class ScheduledJobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'last_status', 'last_duration', 'last_started_at', 'next_run_at', 'lease_owner')
+    readonly_fields = ('lease_owner', 'lease_expires_at', 'last_started_at', 'last_status', 'last_duration')
+
+@admin.register(JobRun)
+class JobRunAdmin(admin.ModelAdmin):
+    list_display = ('job', 'status', 'duration', 'started_at', 'owner')
+    list_filter = ('job', 'status', 'started_at')
+    readonly_fields = ('job', 'owner', 'status', 'started_at', 'finished_at', 'duration', 'result', 'error')
+    date_hierarchy = 'started_at'
@@ -0,0 +1,44 @@
+"""
+ASGI handler that lets long-lived async views wait without a thread.
+
+Django 4.2's ASGIHandler runs every request in its own ThreadSensitiveContext
+and sends request_started through sync_to_async inside it, so each request
+gets a thread of its own that lives exactly as long as the request. For a
+device-sync long-poll or a dashboard event stream that is a parked OS thread
+per open connection.
+
+Requests to views marked with @long_lived are handled outside such a
+context: their short synchronous steps (signals, the sync middleware hooks,
+the ORM calls the view makes through sync_to_async) run on asgiref's one
+shared thread, and while the view awaits the request holds no thread at
+all. Every other request is handled exactly as Django does it. This only
+works while every middleware in settings.MIDDLEWARE is async-capable; a
+sync-only one would run the view on that shared thread.
+"""
+from django.core.handlers.asgi import ASGIHandler as DjangoASGIHandler
+from django.urls import Resolver404, resolve
+
+
+def long_lived(view):
+    """Mark an async view that holds its connection open, see ASGIHandler"""
+    view.long_lived = True
+    return view
+
+
+class ASGIHandler(DjangoASGIHandler):
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and self.is_long_lived(scope):
+            await self.handle(scope, receive, send)
+        else:
+            await super().__call__(scope, receive, send)
+
+    def is_long_lived(self, scope):
+        path = scope['path']
+        script_name = scope.get('root_path', '')
+        if script_name and path.startswith(script_name):
+            path = path[len(script_name):]
+        try:
+            match = resolve(path)
+        except Resolver404:
+            return False
+        return getattr(match.func, 'long_lived', False)
@@ -0,0 +1,189 @@
+"""
+JWT authentication with one verification per request.
+
+CachedJWTAuthentication is the DRF authentication class and is also what
+JWTAuthMiddleware uses, so a request is authenticated once: the middleware
+stores its result on the request and DRF picks it up instead of verifying
+the token again.
+
+Across requests two per-process LRUs save the remaining work. Verified
+tokens are kept by the SHA-256 digest of the raw token, so a device polling
+with the same token skips the signature check, until the token's exp (plus
+SIMPLE_JWT's LEEWAY) passes. Users are kept by pk for JWT_USER_CACHE_TTL
+seconds and dropped when a CustomUser is saved or deleted; the change is
+published on the event bus, so with database fan-out every process drops
+it. Each request gets its own copy of the cached user, so per-request state
+such as the app name resolver never outlives the request.
+"""
+from collections import OrderedDict
+import copy
+import hashlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .event_bus import publish_on_commit, subscribe
+from .models import CustomUser
+
+logger = logging.getLogger(__name__)
+
+USER_TOPIC = 'users'
+
+
+class LRUCache:
+    """Thread-safe LRU with an optional TTL per entry"""
+
+    def __init__(self, max_size, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (entry[0] is not None and entry[0] <= now):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, expires=None):
+        """expires is a time.monotonic() deadline; defaults to now + ttl"""
+        if expires is None and self.ttl is not None:
+            expires = time.monotonic() + self.ttl
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses}
+
+
+_tokens = LRUCache(max_size=getattr(settings, 'JWT_TOKEN_CACHE_SIZE', 1000))
+_users = LRUCache(
+    max_size=getattr(settings, 'JWT_USER_CACHE_SIZE', 1000),
+    ttl=getattr(settings, 'JWT_USER_CACHE_TTL', 60),
+)
+
+
+def _token_deadline(validated_token):
+    """time.monotonic() at which the token stops being accepted"""
+    exp = validated_token.get('exp')
+    if exp is None:
+        return None
+    leeway = api_settings.LEEWAY
+    leeway = leeway.total_seconds() if hasattr(leeway, 'total_seconds') else leeway
+    return time.monotonic() + (exp + leeway - time.time())
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that verifies a request's token once and caches tokens and users"""
+
+    def authenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        # DRF wraps the Django request the middleware already authenticated
+        django_request = getattr(request, '_request', request)
+        previous = getattr(django_request, '_jwt_auth', None)
+        if previous is not None and previous[0] == raw_token:
+            return previous[1]
+
+        validated_token = self.get_validated_token(raw_token)
+        result = (self.get_user(validated_token), validated_token)
+        django_request._jwt_auth = (raw_token, result)
+        return result
+
+    def authenticate_token(self, raw_token):
+        """(user, validated token) for a token taken from elsewhere than the header"""
+        if isinstance(raw_token, str):
+            raw_token = raw_token.encode()
+        validated_token = self.get_validated_token(raw_token)
+        return self.get_user(validated_token), validated_token
+
+    def get_validated_token(self, raw_token):
+        key = hashlib.sha256(raw_token).digest()
+        validated_token = _tokens.get(key)
+        if validated_token is None:
+            validated_token = super().get_validated_token(raw_token)
+            _tokens.set(key, validated_token, expires=_token_deadline(validated_token))
+        return validated_token
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        # Claims may carry the id as a string
+        user_id = str(user_id)
+        user = _users.get(user_id)
+        if user is None:
+            try:
+                user = self.user_model.objects.get(**{api_settings.USER_ID_FIELD: user_id})
+            except self.user_model.DoesNotExist:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+            _users.set(user_id, user)
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        # A copy, so whatever a request attaches to its user stays with that request
+        return copy.copy(user)
+
+
+def clear_auth_caches():
+    _tokens.clear()
+    _users.clear()
+
+
+def auth_cache_stats():
+    return {'tokens': _tokens.stats(), 'users': _users.stats()}
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_cached_user(sender, instance, **kwargs):
+    user_id = str(getattr(instance, api_settings.USER_ID_FIELD))
+    _users.pop(user_id)
+    # Other processes, and this one again once the change is visible
+    publish_on_commit('user_changed', [USER_TOPIC], pk=user_id)
+
+
+def _on_user_changed(event):
+    _users.pop(event.data['pk'])
+
+
+subscribe([USER_TOPIC], _on_user_changed)
@@ -0,0 +1,130 @@
+"""
+Delta sync for Android devices.
+
+Everything a device enforces is split into sections, each guarded by a
+version counter on ChildDevice that the signal handlers in models.py bump on
+every change. The device keeps the opaque cursor it was last given and sends
+it back; only sections whose version moved since then are rebuilt and
+returned, so a poll with nothing new costs a single ChildDevice lookup.
+"""
+import logging
+
+from .models import BlockedApp, BlockedURL, DeviceContentFilter, ScreenTimeRule, WhitelistedURL
+
+logger = logging.getLogger(__name__)
+
+# Screen time limits a device gets before its parent has configured any
+DEFAULT_DAILY_LIMIT_MINUTES = 120
+
+
+def blocked_package_names(device):
+    """Package names of the device's active blocked apps, falling back to app_name"""
+    package_names = []
+    for package_name, app_name in BlockedApp.objects.filter(device=device, is_active=True).values_list(
+        'package_name', 'app_name'
+    ):
+        if package_name and package_name.strip():
+            package_names.append(package_name.strip())
+        else:
+            package_names.append(app_name)
+    return package_names
+
+
+def screen_time_payload(device):
+    rule = ScreenTimeRule.objects.filter(device=device).order_by('-last_updated').first()
+    if rule is None:
+        return {
+            'daily_limit_minutes': DEFAULT_DAILY_LIMIT_MINUTES,
+            'bedtime_start': None,
+            'bedtime_end': None,
+        }
+
+    # Keep the legacy get-screen-time-rules flag in step for devices that
+    # still poll it as well
+    if not rule.synced_to_device:
+        ScreenTimeRule.objects.filter(pk=rule.pk, synced_to_device=False).update(synced_to_device=True)
+    return {
+        'daily_limit_minutes': rule.daily_limit_minutes,
+        'bedtime_start': rule.bedtime_start.strftime('%H:%M:%S') if rule.bedtime_start else None,
+        'bedtime_end': rule.bedtime_end.strftime('%H:%M:%S') if rule.bedtime_end else None,
+    }
+
+
+def url_rules_payload(device):
+    blocked = BlockedURL.objects.filter(device=device, is_active=True).values(
+        'id', 'url_pattern', 'block_type', 'category'
+    )
+    whitelisted = WhitelistedURL.objects.filter(device=device).values_list('url_pattern', flat=True)
+    return {
+        'blocked': list(blocked),
+        'whitelisted': list(whitelisted),
+    }
+
+
+def content_filter_payload(device):
+    content_filter = DeviceContentFilter.objects.filter(device=device).first()
+    if content_filter is None:
+        return None
+    return {
+        'enabled': content_filter.enabled,
+        'strict_mode': content_filter.strict_mode,
+        'allow_search_engines': content_filter.allow_search_engines,
+        'allow_educational': content_filter.allow_educational,
+        'whitelist_enabled': content_filter.whitelist_enabled,
+        'blocked_categories': list(content_filter.blocked_categories.values_list('name', flat=True)),
+    }
+
+
+# (section name, ChildDevice version field, payload builder); the order is
+# also the order of the versions inside a cursor
+SYNC_SECTIONS = [
+    ('blocked_apps', 'blocked_apps_version', blocked_package_names),
+    ('screen_time', 'screen_time_version', screen_time_payload),
+    ('url_rules', 'url_rules_version', url_rules_payload),
+    ('content_filter', 'content_filter_version', content_filter_payload),
+]
+
+VERSION_FIELDS = [field for _, field, _ in SYNC_SECTIONS]
+
+
+def make_cursor(device):
+    return '-'.join(str(value) for value in [device.pk] + [getattr(device, field) for field in VERSION_FIELDS])
+
+
+def parse_cursor(device, cursor):
+    """
+    Return {version field: version} from a cursor issued for this device, or
+    None when it is missing, malformed or belongs to another device.
+    """
+    if not cursor:
+        return None
+    try:
+        values = [int(part) for part in cursor.split('-')]
+    except ValueError:
+        return None
+    if len(values) != len(VERSION_FIELDS) + 1 or values[0] != device.pk:
+        return None
+    return dict(zip(VERSION_FIELDS, values[1:]))
+
+
+def build_sync_response(device, cursor=None):
+    """
+    Build the device-sync response for a device loaded with at least pk and
+    VERSION_FIELDS. Versions are read before the sections, so a change that
+    lands in between is delivered again on the next poll rather than lost.
+    """
+    known_versions = parse_cursor(device, cursor)
+    response = {
+        'cursor': make_cursor(device),
+        'full_sync': known_versions is None,
+        'changed': [],
+    }
+    for section, field, build_payload in SYNC_SECTIONS:
+        if known_versions is not None and known_versions[field] == getattr(device, field):
+            continue
+        response['changed'].append(section)
+        response[section] = build_payload(device)
+
+    if response['changed']:
+        logger.info(f"device-sync for device {device.device_id}: sending {', '.join(response['changed'])}")
+    return response
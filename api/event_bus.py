@@ -0,0 +1,273 @@
+"""
+In-process publish/subscribe bus for change events.
+
+Producers publish an Event once their transaction commits (publish_on_commit)
+to topics such as device_topic(pk) and parent_topic(pk). Consumers either
+register a callback, which runs in the publishing thread and must be quick,
+or open a Subscription: a bounded queue that async code awaits and that drops
+its oldest events rather than grow when the consumer falls behind.
+
+With EVENT_BUS_FANOUT = 'database' every event is also written to BusMessage
+and a relay thread in each process delivers the events published by other
+processes, so all workers see every change. The default, 'local', only
+reaches subscribers in the publishing process. The relay starts with the
+process's first request (or first Subscription), so management commands
+that only publish never run one.
+
+Ids are handed out before rows commit, so the relay can read id 12 while
+id 11 is still uncommitted. Ids it skipped are remembered and asked for
+again on every read until they turn up or RELAY_GAP_TIMEOUT passes (a
+rolled-back insert never turns up).
+
+Subscribing to ALL_TOPICS receives every event regardless of its topics.
+"""
+from collections import defaultdict, deque, namedtuple
+from datetime import timedelta
+import asyncio
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Q
+from django.dispatch import receiver
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+Event = namedtuple('Event', ['kind', 'topics', 'data'])
+
+# How long BusMessage rows are kept for relays that are a little behind
+RELAY_RETENTION = timedelta(minutes=5)
+
+# How long, in seconds, an id the relay skipped is still looked for, and at
+# most how many are tracked
+RELAY_GAP_TIMEOUT = 60
+RELAY_MAX_GAPS = 500
+
+ALL_TOPICS = '*'
+
+
+def device_topic(device_pk):
+    return f'device:{device_pk}'
+
+
+def parent_topic(parent_pk):
+    return f'parent:{parent_pk}'
+
+
+class Subscription:
+    """Bounded queue of events for one consumer; use as a context manager"""
+
+    def __init__(self, bus, topics, maxsize):
+        self.bus = bus
+        self.topics = frozenset(topics)
+        self.dropped = 0
+        self._queue = deque()
+        self._maxsize = maxsize
+        self._lock = threading.Lock()
+        self._waiter = None
+
+    def deliver(self, event):
+        with self._lock:
+            if len(self._queue) >= self._maxsize:
+                self._queue.popleft()
+                self.dropped += 1
+            self._queue.append(event)
+            waiter, self._waiter = self._waiter, None
+        if waiter is not None:
+            loop, future = waiter
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:
+                # The consumer's loop already closed
+                pass
+
+    def get_nowait(self):
+        """Return and clear every queued event"""
+        with self._lock:
+            events = list(self._queue)
+            self._queue.clear()
+        return events
+
+    async def get(self, timeout=None):
+        """Wait up to timeout seconds for events; returns a possibly empty list"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._queue:
+                events = list(self._queue)
+                self._queue.clear()
+                return events
+            future = loop.create_future()
+            self._waiter = (loop, future)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._lock:
+                if self._waiter is not None and self._waiter[1] is future:
+                    self._waiter = None
+        return self.get_nowait()
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(True)
+
+
+class EventBus:
+    def __init__(self, fanout='local', relay_interval=1.0, queue_size=100):
+        self.fanout = fanout
+        self.relay_interval = relay_interval
+        self.queue_size = queue_size
+        self.origin = uuid.uuid4().hex
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+        self._relay = None
+
+    def subscribe(self, topics, callback=None, maxsize=None):
+        """
+        Subscribe to topics. With a callback, it is called with each Event in
+        the publishing thread and the callback is returned (pass it to
+        unsubscribe()); otherwise a bounded Subscription is returned.
+        """
+        subscriber = callback or Subscription(self, topics, maxsize or self.queue_size)
+        with self._lock:
+            for topic in topics:
+                self._subscribers[topic].add(subscriber)
+        if callback is None:
+            self.start_relay()
+        return subscriber
+
+    def start_relay(self):
+        """Start delivering other processes' events, with database fan-out"""
+        if self.fanout != 'database' or (self._relay is not None and self._relay.is_alive()):
+            return
+        with self._lock:
+            self._ensure_relay()
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            for topic in list(self._subscribers):
+                self._subscribers[topic].discard(subscriber)
+                if not self._subscribers[topic]:
+                    del self._subscribers[topic]
+
+    def publish(self, kind, topics, **data):
+        event = Event(kind, tuple(topics), data)
+        self._deliver(event)
+        if self.fanout == 'database':
+            from .models import BusMessage
+            try:
+                BusMessage.objects.create(topics=list(event.topics), kind=kind, data=data, origin=self.origin)
+            except Exception as e:
+                logger.error(f"Failed to relay {kind} event to other processes: {str(e)}")
+        return event
+
+    def publish_on_commit(self, kind, topics, **data):
+        """Publish once the current transaction commits (immediately outside one)"""
+        transaction.on_commit(lambda: self.publish(kind, topics, **data))
+
+    def _deliver(self, event):
+        with self._lock:
+            subscribers = set(self._subscribers.get(ALL_TOPICS, ()))
+            for topic in event.topics:
+                subscribers.update(self._subscribers.get(topic, ()))
+        for subscriber in subscribers:
+            try:
+                if isinstance(subscriber, Subscription):
+                    subscriber.deliver(event)
+                else:
+                    subscriber(event)
+            except Exception as e:
+                logger.exception(f"Event bus subscriber failed on {event.kind}: {str(e)}")
+
+    def _ensure_relay(self):
+        # Called with the lock held
+        if self._relay is None or not self._relay.is_alive():
+            self._relay = threading.Thread(target=self._relay_loop, name='event-bus-relay', daemon=True)
+            self._relay.start()
+
+    def _relay_loop(self):
+        from .models import BusMessage
+
+        stop = threading.Event()
+        last_id = None
+        # Skipped ids not seen yet -> time.monotonic() when they were skipped
+        gaps = {}
+        last_prune = timezone.now()
+        failing = False
+        try:
+            while not stop.wait(self.relay_interval):
+                close_old_connections()
+                try:
+                    if last_id is None:
+                        last_id = BusMessage.objects.order_by('-id').values_list('id', flat=True).first() or 0
+                        continue
+                    unseen = Q(id__gt=last_id)
+                    if gaps:
+                        unseen |= Q(id__in=list(gaps))
+                    messages = list(
+                        BusMessage.objects.filter(unseen).order_by('id')
+                        .values_list('id', 'topics', 'kind', 'data', 'origin')[:500]
+                    )
+                    skipped_at = time.monotonic()
+                    for message_id, topics, kind, data, origin in messages:
+                        if message_id > last_id:
+                            for missing in range(max(last_id + 1, message_id - RELAY_MAX_GAPS), message_id):
+                                gaps[missing] = skipped_at
+                            last_id = message_id
+                        else:
+                            del gaps[message_id]
+                        if origin != self.origin:
+                            self._deliver(Event(kind, tuple(topics), data))
+                    if gaps:
+                        expired = skipped_at - RELAY_GAP_TIMEOUT
+                        gaps = {message_id: at for message_id, at in gaps.items() if at > expired}
+                        if len(gaps) > RELAY_MAX_GAPS:
+                            gaps = dict(sorted(gaps.items())[-RELAY_MAX_GAPS:])
+
+                    now = timezone.now()
+                    if now - last_prune > RELAY_RETENTION:
+                        BusMessage.objects.filter(created_at__lt=now - RELAY_RETENTION).delete()
+                        last_prune = now
+                    failing = False
+                except Exception as e:
+                    # Log once per outage, e.g. before migrations have run
+                    if not failing:
+                        logger.error(f"Event bus relay failed: {str(e)}")
+                    failing = True
+        finally:
+            connection.close()
+
+
+bus = EventBus(
+    fanout=getattr(settings, 'EVENT_BUS_FANOUT', 'local'),
+    relay_interval=getattr(settings, 'EVENT_BUS_RELAY_INTERVAL', 1.0),
+    queue_size=getattr(settings, 'EVENT_BUS_QUEUE_SIZE', 100),
+)
+
+
+@receiver(request_started)
+def _start_relay_on_request(sender, **kwargs):
+    # Only processes that serve requests need other processes' events
+    bus.start_relay()
+
+
+subscribe = bus.subscribe
+unsubscribe = bus.unsubscribe
+publish = bus.publish
+publish_on_commit = bus.publish_on_commit
@@ -0,0 +1,253 @@
+"""
+Compact binary snapshots of a device's URL filter rules.
+
+Devices that enforce their URL policy offline download it as a snapshot
+instead of the url_rules JSON of device-sync. A snapshot is zlib-compressed
+and, once inflated, laid out as:
+
+    b'PCSF', format version (1 byte)
+    flags (1 byte): 1 = filter enabled, 2 = strict mode, 4 = allow search engines
+    Bloom filter: varint bit count m, hash count k (1 byte), ceil(m / 8) bytes
+    blocked domains: varint count, then per domain a varint length of the
+        prefix shared with the previous one, a varint length and the rest
+    exact URLs, keywords, regexes, whitelist: each a varint count followed by
+        varint-length-prefixed UTF-8 strings
+
+Varints are unsigned LEB128. Domains are stored with their labels reversed
+(com.example.www) and sorted, so neighbours share long prefixes. The Bloom
+filter holds the same reversed domains; bit i of a domain is
+(h1 + i * h2) mod m for i < k, where h1 and h2 are the first two big-endian
+32-bit words of its SHA-256. A device checks each suffix of a host against
+the filter and only confirms hits against the domain list. Exact URLs and
+whitelist entries are scheme-less and lowercased; whitelist entries without
+a path cover the domain and its subdomains.
+
+Snapshots are content-addressed: the SHA-256 of the compressed bytes is the
+ETag. The last FILTER_SNAPSHOT_HISTORY are kept per device, so a device
+holding one of them can fetch a diff instead of the whole snapshot.
+"""
+import hashlib
+import logging
+import math
+import struct
+import zlib
+
+from django.conf import settings
+
+from .models import BlockedURL, FilterSnapshot, WhitelistedURL
+from .url_filter import filter_options, normalize_domain, normalize_url
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'PCSF'
+FORMAT_VERSION = 1
+
+FLAG_ENABLED = 1
+FLAG_STRICT_MODE = 2
+FLAG_ALLOW_SEARCH_ENGINES = 4
+
+# Sections compared by diffs, in snapshot order after the domains
+LIST_SECTIONS = ('exact', 'keywords', 'regexes', 'whitelist')
+
+
+def reverse_domain(domain):
+    return '.'.join(reversed(domain.split('.')))
+
+
+def _write_varint(out, value):
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, offset):
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def _write_strings(out, strings):
+    _write_varint(out, len(strings))
+    for string in strings:
+        encoded = string.encode('utf-8')
+        _write_varint(out, len(encoded))
+        out.extend(encoded)
+
+
+def _read_strings(data, offset):
+    count, offset = _read_varint(data, offset)
+    strings = []
+    for _ in range(count):
+        length, offset = _read_varint(data, offset)
+        strings.append(data[offset:offset + length].decode('utf-8'))
+        offset += length
+    return strings, offset
+
+
+def _bloom_positions(item, bits, hashes):
+    h1, h2 = struct.unpack_from('>II', hashlib.sha256(item.encode('utf-8')).digest())
+    return [(h1 + i * h2) % bits for i in range(hashes)]
+
+
+def build_bloom(items, false_positive_rate):
+    """Return (bit count, hash count, bit array) sized for items"""
+    count = max(len(items), 1)
+    bits = max(64, math.ceil(-count * math.log(false_positive_rate) / math.log(2) ** 2))
+    hashes = max(1, round(bits / count * math.log(2)))
+    array = bytearray((bits + 7) // 8)
+    for item in items:
+        for position in _bloom_positions(item, bits, hashes):
+            array[position >> 3] |= 1 << (position & 7)
+    return bits, hashes, bytes(array)
+
+
+def bloom_contains(bits, hashes, array, item):
+    return all(array[position >> 3] & (1 << (position & 7)) for position in _bloom_positions(item, bits, hashes))
+
+
+def collect_rules(device):
+    """The device's filter rules in snapshot form: sorted, normalized and deduplicated"""
+    sections = {'domains': set(), 'exact': set(), 'keywords': set(), 'regexes': set(), 'whitelist': set()}
+    # The same rules and whitelist UrlMatcher enforces
+    options = filter_options(device)
+    rules = BlockedURL.objects.filter(device=device, is_active=True).values_list('url_pattern', 'block_type')
+    for pattern, block_type in rules:
+        if block_type == 'domain':
+            domain = normalize_domain(pattern)
+            if domain:
+                sections['domains'].add(reverse_domain(domain))
+        elif block_type == 'exact':
+            sections['exact'].add(normalize_url(pattern))
+        elif block_type == 'keyword':
+            keyword = pattern.strip().lower()
+            if keyword:
+                sections['keywords'].add(keyword)
+        elif block_type == 'regex':
+            sections['regexes'].add(pattern)
+    whitelist = WhitelistedURL.objects.filter(device=device).values_list('url_pattern', flat=True)
+    for pattern in (whitelist if options.get('whitelist_enabled', True) else ()):
+        entry = normalize_url(pattern)
+        if entry.startswith('*.'):
+            entry = entry[2:]
+        if entry:
+            sections['whitelist'].add(entry)
+
+    flags = (
+        (FLAG_ENABLED if options.get('enabled', True) else 0)
+        | (FLAG_STRICT_MODE if options.get('strict_mode', False) else 0)
+        | (FLAG_ALLOW_SEARCH_ENGINES if options.get('allow_search_engines', True) else 0)
+    )
+    collected = {name: sorted(values) for name, values in sections.items()}
+    collected['flags'] = flags
+    return collected
+
+
+def encode_snapshot(rules):
+    false_positive_rate = getattr(settings, 'FILTER_SNAPSHOT_BLOOM_FP_RATE', 0.01)
+    out = bytearray(MAGIC)
+    out.append(FORMAT_VERSION)
+    out.append(rules['flags'])
+
+    bits, hashes, array = build_bloom(rules['domains'], false_positive_rate)
+    _write_varint(out, bits)
+    out.append(hashes)
+    out.extend(array)
+
+    _write_varint(out, len(rules['domains']))
+    previous = b''
+    for domain in rules['domains']:
+        encoded = domain.encode('utf-8')
+        shared = 0
+        limit = min(len(previous), len(encoded))
+        while shared < limit and previous[shared] == encoded[shared]:
+            shared += 1
+        _write_varint(out, shared)
+        _write_varint(out, len(encoded) - shared)
+        out.extend(encoded[shared:])
+        previous = encoded
+
+    for name in LIST_SECTIONS:
+        _write_strings(out, rules[name])
+    return zlib.compress(bytes(out), 9)
+
+
+def decode_snapshot(data):
+    """Inverse of encode_snapshot(), apart from the Bloom filter"""
+    data = zlib.decompress(bytes(data))
+    if data[:4] != MAGIC or data[4] != FORMAT_VERSION:
+        raise ValueError("Not a filter snapshot")
+    rules = {'flags': data[5]}
+    bits, offset = _read_varint(data, 6)
+    offset += 1 + (bits + 7) // 8
+
+    count, offset = _read_varint(data, offset)
+    domains = []
+    previous = b''
+    for _ in range(count):
+        shared, offset = _read_varint(data, offset)
+        length, offset = _read_varint(data, offset)
+        encoded = previous[:shared] + data[offset:offset + length]
+        offset += length
+        domains.append(encoded.decode('utf-8'))
+        previous = encoded
+    rules['domains'] = domains
+
+    for name in LIST_SECTIONS:
+        rules[name], offset = _read_strings(data, offset)
+    return rules
+
+
+def current_snapshot(device):
+    """
+    Return the FilterSnapshot matching the device's current rule versions,
+    building and storing it first when the rules changed since the last one.
+    device needs url_rules_version and content_filter_version loaded.
+    """
+    latest = FilterSnapshot.objects.filter(device=device).first()
+    if (latest is not None and latest.url_rules_version == device.url_rules_version
+            and latest.content_filter_version == device.content_filter_version):
+        return latest
+
+    data = encode_snapshot(collect_rules(device))
+    digest = hashlib.sha256(data).hexdigest()
+    # Rules that went back to an earlier state produce the same digest; that
+    # snapshot is brought forward rather than stored twice
+    snapshot, _ = FilterSnapshot.objects.update_or_create(
+        device=device,
+        digest=digest,
+        defaults={
+            'url_rules_version': device.url_rules_version,
+            'content_filter_version': device.content_filter_version,
+            'data': data,
+        },
+    )
+
+    history = getattr(settings, 'FILTER_SNAPSHOT_HISTORY', 5)
+    stale = FilterSnapshot.objects.filter(device=device).values_list('pk', flat=True)[history:]
+    FilterSnapshot.objects.filter(pk__in=list(stale)).delete()
+    logger.info(f"Built filter snapshot {digest[:12]} for device {device.pk}: {len(data)} bytes")
+    return snapshot
+
+
+def snapshot_diff(device, base_digest, snapshot):
+    """
+    Changes from the snapshot with base_digest to snapshot, or None when the
+    base is no longer kept.
+    """
+    base = FilterSnapshot.objects.filter(device=device, digest=base_digest).only('data').first()
+    if base is None:
+        return None
+    old = decode_snapshot(base.data)
+    new = decode_snapshot(snapshot.data)
+    diff = {'base': base_digest, 'digest': snapshot.digest, 'flags': new['flags'], 'added': {}, 'removed': {}}
+    for name in ('domains',) + LIST_SECTIONS:
+        old_values, new_values = set(old[name]), set(new[name])
+        diff['added'][name] = sorted(new_values - old_values)
+        diff['removed'][name] = sorted(old_values - new_values)
+    return diff
@@ -0,0 +1,306 @@
+from datetime import datetime
+import logging
+from urllib.parse import urlsplit
+import uuid
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from parent_ui.events import record_event
+from .event_bus import device_topic, parent_topic, publish_on_commit
+from .models import AppUsageLog, URLAccessLog, UsageSyncBatch
+from .presence import record_heartbeat
+from .rollups import apply_domain_rollups, apply_usage_rollups
+from .url_filter import get_url_matcher
+
+logger = logging.getLogger(__name__)
+
+# Sessions longer than this are almost certainly clock glitches on the device
+MAX_SESSION_SECONDS = 86400  # 24 hours
+
+# Column sizes of AppUsageLog.app_name, URLAccessLog.url and URLAccessLog.domain
+MAX_APP_NAME_LENGTH = 100
+MAX_URL_LENGTH = 2048
+MAX_DOMAIN_LENGTH = 255
+
+
+def parse_device_timestamp(value):
+    """
+    Parse an ISO-8601 timestamp sent by the Android app.
+    Accepts the trailing 'Z' form that fromisoformat() rejects on older Pythons.
+    """
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    parsed = datetime.fromisoformat(value)
+    # Naive timestamps are stored in the default timezone; normalising here
+    # keeps them comparable with what comes back from the database
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def validate_usage_entries(usage_data):
+    """
+    Validate a whole usage_data payload up front without touching the database.
+
+    Returns a tuple (sessions, errors) where sessions is a list of dicts with
+    app_name, start_time, end_time and duration ready to be written, and errors
+    is the list of per-entry messages reported back to the device.
+    """
+    sessions = []
+    errors = []
+
+    for i, entry in enumerate(usage_data):
+        try:
+            if not isinstance(entry, dict):
+                errors.append(f"Entry {i}: Entry must be an object")
+                continue
+
+            # Validate required fields
+            app_name = entry.get('app_name')
+            if not app_name:
+                errors.append(f"Entry {i}: Missing app_name")
+                continue
+            if not isinstance(app_name, str):
+                errors.append(f"Entry {i}: app_name must be a string")
+                continue
+            if len(app_name) > MAX_APP_NAME_LENGTH:
+                errors.append(f"Entry {i}: app_name longer than {MAX_APP_NAME_LENGTH} characters")
+                continue
+
+            start_time_str = entry.get('start_time')
+            end_time_str = entry.get('end_time')
+            if not start_time_str or not end_time_str:
+                errors.append(f"Entry {i}: Missing start_time or end_time")
+                continue
+
+            try:
+                start_time = parse_device_timestamp(start_time_str)
+                end_time = parse_device_timestamp(end_time_str)
+            except ValueError as e:
+                errors.append(f"Entry {i}: Invalid timestamp format - {str(e)}")
+                continue
+
+            if end_time <= start_time:
+                logger.warning(f"Entry {i}: Invalid time range - end_time ({end_time}) <= start_time ({start_time}) for app '{app_name}'. Skipping.")
+                errors.append(f"Entry {i}: end_time must be after start_time")
+                continue
+
+            duration_seconds = (end_time - start_time).total_seconds()
+            if duration_seconds > MAX_SESSION_SECONDS:
+                logger.warning(f"Entry {i}: Suspiciously long duration ({duration_seconds}s) for app '{app_name}'. Skipping.")
+                errors.append(f"Entry {i}: Duration too long ({duration_seconds}s)")
+                continue
+
+            sessions.append({
+                'app_name': app_name,
+                'start_time': start_time,
+                'end_time': end_time,
+                # Same rounding as AppUsageLog.save(), which bulk_create bypasses
+                'duration': max(int(duration_seconds), 1),
+            })
+
+        except Exception as e:
+            logger.error(f"Entry {i}: Unexpected error - {str(e)}")
+            errors.append(f"Entry {i}: {str(e)}")
+
+    return sessions, errors
+
+
+def _inserted_sessions(device, sessions, token):
+    """
+    The AppUsageLog rows of sessions that the upload tagged with token really
+    inserted, leaving out the ones skipped as duplicates. One range query on
+    the (device, start_time) index.
+    """
+    if not sessions:
+        return []
+    start_times = [session['start_time'] for session in sessions]
+    return list(AppUsageLog.objects.filter(
+        device=device,
+        start_time__gte=min(start_times),
+        start_time__lte=max(start_times),
+        ingest_token=token,
+    ).only('app_name', 'start_time', 'duration'))
+
+
+def _batch_result(batch, replayed):
+    return {
+        'total_entries': batch.total_entries,
+        'valid_entries': batch.valid_entries,
+        'skipped_entries': batch.skipped_entries,
+        'duplicate_entries': 0,
+        'inserted_entries': 0,
+        'errors': [],
+        'replayed': replayed,
+    }
+
+
+def ingest_usage(device, usage_data, batch_id=None):
+    """
+    Validate and store a batch of usage sessions for a device.
+
+    All entries are validated before the transaction is opened; the valid ones
+    are then written with chunked bulk_create so a large backlog costs a handful
+    of INSERTs instead of one per session. The daily and hourly rollups are
+    updated in the same transaction.
+
+    Uploads are idempotent: sessions are keyed on (device, app_name, start_time)
+    and inserted with ignore_conflicts, so the unique constraint, under the
+    database's own collation, drops sessions that are already stored or that
+    a concurrent retry is inserting; no lock or existence check is needed.
+    Each upload tags its rows with a fresh ingest_token and reads them back,
+    so only the rows it really inserted reach the rollups and counters. When
+    the client sends a batch_id, a replay of an already processed batch is
+    answered from the stored UsageSyncBatch without re-validating or
+    re-inserting anything.
+
+    Returns a dict with the counters used to build the sync-usage response.
+    """
+    # An upload is a sign of life even when it is a replay
+    record_heartbeat(device)
+    if batch_id:
+        batch = UsageSyncBatch.objects.filter(device=device, batch_id=batch_id).first()
+        if batch:
+            logger.info(f"Replayed usage batch {batch_id} for device {device.device_id}")
+            return _batch_result(batch, replayed=True)
+
+    sessions, errors = validate_usage_entries(usage_data)
+    batch_size = getattr(settings, 'USAGE_INGEST_BATCH_SIZE', 500)
+
+    try:
+        with transaction.atomic():
+            token = uuid.uuid4()
+            if batch_id:
+                UsageSyncBatch.objects.create(
+                    device=device,
+                    batch_id=batch_id,
+                    total_entries=len(usage_data),
+                    valid_entries=len(sessions),
+                    skipped_entries=len(errors),
+                )
+            AppUsageLog.objects.bulk_create(
+                [AppUsageLog(device=device, ingest_token=token, **session) for session in sessions],
+                batch_size=batch_size,
+                ignore_conflicts=True,
+            )
+            logs = _inserted_sessions(device, sessions, token)
+            apply_usage_rollups(device, logs)
+            if logs:
+                record_event(
+                    device.parent_id,
+                    'usage_synced',
+                    device=device,
+                    sessions=len(logs),
+                    total_duration=sum(log.duration for log in logs),
+                )
+                publish_on_commit(
+                    'usage_synced',
+                    [device_topic(device.pk), parent_topic(device.parent_id)],
+                    device_pk=device.pk,
+                    sessions=len(logs),
+                )
+    except IntegrityError:
+        # The same batch_id was committed by a concurrent retry
+        batch = UsageSyncBatch.objects.filter(device=device, batch_id=batch_id).first() if batch_id else None
+        if batch is None:
+            raise
+        return _batch_result(batch, replayed=True)
+
+    return {
+        'total_entries': len(usage_data),
+        'valid_entries': len(sessions),
+        'skipped_entries': len(errors),
+        'duplicate_entries': len(sessions) - len(logs),
+        'inserted_entries': len(logs),
+        'errors': errors,
+        'replayed': False,
+    }
+
+
+def ingest_url_access(device, entries):
+    """
+    Validate and store a batch of browsing events for a device.
+
+    Each entry needs url and access_time; was_blocked and user_agent are
+    optional. Domains are parsed once here, since bulk_create bypasses
+    URLAccessLog.save(). blocked_by_rule is resolved against the device's
+    cached compiled rules, which also decide was_blocked when the device
+    didn't report it. Rows are written with chunked bulk_create in one
+    transaction, together with the domain x day rollups.
+
+    Returns a dict with the counters used to build the response.
+    """
+    record_heartbeat(device)
+    matcher = get_url_matcher(device)
+    batch_size = getattr(settings, 'URL_LOG_INGEST_BATCH_SIZE', 1000)
+    logs = []
+    errors = []
+
+    for i, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            errors.append(f"Entry {i}: Entry must be an object")
+            continue
+
+        url = entry.get('url')
+        if not url or not isinstance(url, str):
+            errors.append(f"Entry {i}: Missing url")
+            continue
+        if len(url) > MAX_URL_LENGTH:
+            errors.append(f"Entry {i}: url longer than {MAX_URL_LENGTH} characters")
+            continue
+
+        access_time = entry.get('access_time')
+        if not access_time:
+            errors.append(f"Entry {i}: Missing access_time")
+            continue
+        if not isinstance(access_time, str):
+            errors.append(f"Entry {i}: access_time must be an ISO-8601 string")
+            continue
+        try:
+            access_time = parse_device_timestamp(access_time)
+        except (TypeError, ValueError) as e:
+            errors.append(f"Entry {i}: Invalid timestamp format - {str(e)}")
+            continue
+
+        try:
+            domain = urlsplit(url if '://' in url else '//' + url).hostname or ''
+        except ValueError:
+            domain = ''
+        if not domain or len(domain) > MAX_DOMAIN_LENGTH:
+            errors.append(f"Entry {i}: Invalid url")
+            continue
+
+        was_blocked = entry.get('was_blocked')
+        if was_blocked is not None and not isinstance(was_blocked, bool):
+            errors.append(f"Entry {i}: was_blocked must be true or false")
+            continue
+
+        match = matcher.match(url)
+        if was_blocked is None:
+            was_blocked = match.blocked
+        user_agent = entry.get('user_agent')
+
+        logs.append(URLAccessLog(
+            device=device,
+            url=url,
+            domain=domain,
+            access_time=access_time,
+            was_blocked=was_blocked,
+            # Only blocks are attributed to a rule
+            blocked_by_rule_id=match.rule_id if was_blocked else None,
+            user_agent=user_agent if isinstance(user_agent, str) else None,
+        ))
+
+    with transaction.atomic():
+        URLAccessLog.objects.bulk_create(logs, batch_size=batch_size)
+        apply_domain_rollups(device, logs)
+
+    return {
+        'total_entries': len(entries),
+        'inserted_entries': len(logs),
+        'blocked_entries': sum(1 for log in logs if log.was_blocked),
+        'skipped_entries': len(errors),
+        'errors': errors,
+    }
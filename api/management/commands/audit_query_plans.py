@@ -0,0 +1,145 @@
+import json
+import re
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from api.models import (
+    AppUsageDailyRollup,
+    AppUsageLog,
+    BlockedApp,
+    ChildDevice,
+    HourlyUsageRollup,
+)
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Only scans over our own tables are interesting; SQLite also reports
+# scans of temporary b-trees and constant rows
+PROJECT_TABLE_PREFIXES = ('api_', 'parent_ui_')
+
+
+def hot_queries(device, start, end):
+    """The read paths that run on every dashboard view or device poll"""
+    logs = AppUsageLog.objects.filter(device=device, start_time__gte=start, start_time__lte=end)
+    return [
+        ('manage_device logs window', logs),
+        ('usage_by_app raw edge', logs.values('app_name').annotate(duration=Sum('duration'), sessions=Count('id'))),
+        ('usage_by_day raw edge', logs.annotate(date=TruncDate('start_time')).values('date').annotate(duration=Sum('duration'))),
+        ('single app history', logs.filter(app_name='com.example.app')),
+        ('sync_usage duplicate check', logs.values_list('app_name', 'start_time')),
+        ('daily rollup window', AppUsageDailyRollup.objects.filter(
+            device=device, date__gte=start.date(), date__lt=end.date()
+        ).values('app_name').annotate(duration=Sum('total_duration'))),
+        ('hourly rollup window', HourlyUsageRollup.objects.filter(
+            device=device, hour__gte=start, hour__lt=end
+        ).annotate(date=TruncDate('hour')).values('date').annotate(duration=Sum('total_duration'))),
+        ('get_blocked_apps', BlockedApp.objects.filter(device=device, is_active=True)),
+    ]
+
+
+def _is_project_table(table):
+    return table.startswith(PROJECT_TABLE_PREFIXES)
+
+
+def _sqlite_full_scans(plan):
+    return [table for table in re.findall(r'\bSCAN (\w+)', plan) if _is_project_table(table)]
+
+
+def _postgresql_full_scans(plan):
+    return [table for table in re.findall(r'Seq Scan on (\w+)', plan) if _is_project_table(table)]
+
+
+def _mysql_full_scans(plan):
+    tables = []
+
+    def walk(node):
+        if isinstance(node, dict):
+            if node.get('access_type') == 'ALL' and _is_project_table(node.get('table_name', '')):
+                tables.append(node['table_name'])
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+
+    walk(json.loads(plan))
+    return tables
+
+
+PLAN_CHECKS = {
+    'sqlite': ({}, _sqlite_full_scans),
+    'postgresql': ({}, _postgresql_full_scans),
+    'mysql': ({'format': 'json'}, _mysql_full_scans),
+}
+
+
+class Command(BaseCommand):
+    help = 'Run EXPLAIN against the hot AppUsageLog/rollup queries and flag full table scans'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--device',
+            type=str,
+            default=None,
+            help='device_id to build the sample queries for (default: first device)'
+        )
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=7,
+            help='Width of the sample time window in days (default: 7)'
+        )
+        parser.add_argument(
+            '--verbose-plans',
+            action='store_true',
+            help='Print the full plan of every query'
+        )
+        parser.add_argument(
+            '--warn-only',
+            action='store_true',
+            help='Report full scans without failing (planners may prefer scans on near-empty tables)'
+        )
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        if vendor not in PLAN_CHECKS:
+            raise CommandError(f"Query plan audit is not supported on the '{vendor}' backend")
+        explain_options, find_full_scans = PLAN_CHECKS[vendor]
+
+        devices = ChildDevice.objects.order_by('pk')
+        if options['device']:
+            devices = devices.filter(device_id=options['device'])
+        device = devices.first()
+        if device is None:
+            # EXPLAIN doesn't need matching rows, only a well-formed filter value
+            device = ChildDevice(pk=0)
+
+        end = timezone.now()
+        start = end - timedelta(days=options['days'])
+
+        self.stdout.write(f"Auditing query plans on {vendor} for device pk={device.pk}")
+
+        flagged = []
+        for name, queryset in hot_queries(device, start, end):
+            plan = queryset.explain(**explain_options)
+            scans = find_full_scans(plan)
+            if options['verbose_plans']:
+                self.stdout.write(f"--- {name}\n{plan}")
+            if scans:
+                flagged.append(name)
+                self.stdout.write(self.style.ERROR(f"FULL SCAN  {name}: {', '.join(sorted(set(scans)))}"))
+            else:
+                self.stdout.write(self.style.SUCCESS(f"OK         {name}"))
+
+        if flagged:
+            message = f"{len(flagged)} hot queries fall back to full table scans: {', '.join(flagged)}"
+            logger.warning(message)
+            if not options['warn_only']:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS("All hot queries use an index."))
@@ -0,0 +1,57 @@
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from api.models import ChildDevice
+from api.rollups import rebuild_domain_rollups, rebuild_usage_rollups
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Rebuild the app usage and browsing domain rollups from raw AppUsageLog and URLAccessLog rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--device',
+            action='append',
+            dest='devices',
+            default=None,
+            help='Only rebuild this device_id (can be given several times)'
+        )
+        parser.add_argument(
+            '--since',
+            type=str,
+            default=None,
+            help='Only rebuild buckets from this date onwards (YYYY-MM-DD)'
+        )
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = datetime.strptime(options['since'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError(f"Invalid --since date: {options['since']} (expected YYYY-MM-DD)")
+
+        devices = ChildDevice.objects.all().order_by('pk')
+        if options['devices']:
+            devices = devices.filter(device_id__in=options['devices'])
+
+        total_daily = 0
+        total_hourly = 0
+        total_domain = 0
+        for device in devices.iterator():
+            daily_rows, hourly_rows = rebuild_usage_rollups(device, since=since)
+            domain_rows = rebuild_domain_rollups(device, since=since)
+            total_daily += daily_rows
+            total_hourly += hourly_rows
+            total_domain += domain_rows
+            self.stdout.write(
+                f"Rebuilt rollups for {device}: {daily_rows} daily, {hourly_rows} hourly, {domain_rows} domain rows"
+            )
+
+        logger.info(f"Usage rollup backfill completed: {total_daily} daily, {total_hourly} hourly, {total_domain} domain rows")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Backfill completed. {total_daily} daily, {total_hourly} hourly and {total_domain} domain rollup rows written."
+            )
+        )
@@ -1,10 +1,15 @@
+from concurrent.futures import ThreadPoolExecutor
 from django.core.management.base import BaseCommand
 from django.utils import timezone
-from django.core.mail import send_mail
+from django.db import transaction
+from django.db.models import Q
 from django.template.loader import render_to_string
 from django.conf import settings
 from datetime import timedelta
 from api.models import ChildDevice, DeviceOfflineNotification
+from api.presence import flush_heartbeats
+from parent_ui.events import record_events
+from parent_ui.outbox import enqueue_emails
 import logging
 
 logger = logging.getLogger(__name__)
@@ -30,112 +35,141 @@ class Command(BaseCommand):
             action='store_true',
             help='Force send notifications even if already sent recently'
         )
+        parser.add_argument(
+            '--threads',
+            type=int,
+            default=None,
+            help='Threads rendering notification emails (default: OFFLINE_CHECK_THREADS)'
+        )
 
     def handle(self, *args, **options):
         days_threshold = options['days']
         minutes_threshold = options['minutes']
         force = options['force']
-        
+        self.verbosity = options['verbosity']
+        now = timezone.now()
+
         # Use minutes if specified (for testing), otherwise use days (for production)
         if minutes_threshold is not None:
             self.stdout.write(f"Using minutes threshold: {minutes_threshold} minutes (TESTING MODE)")
-            cutoff_time = timezone.now() - timedelta(minutes=minutes_threshold)
+            cutoff_time = now - timedelta(minutes=minutes_threshold)
             time_unit = "minutes"
             time_value = minutes_threshold
+            # Avoid duplicate notifications within 5 minutes when testing
+            recent_threshold = timedelta(minutes=5)
         else:
             self.stdout.write(f"Using days threshold: {days_threshold} days (PRODUCTION MODE)")
-            cutoff_time = timezone.now() - timedelta(days=days_threshold)
+            cutoff_time = now - timedelta(days=days_threshold)
             time_unit = "days"
             time_value = days_threshold
-        
+            # Avoid duplicate notifications within 24 hours
+            recent_threshold = timedelta(days=1)
+
         self.stdout.write(f"Checking for devices offline for more than {time_value} {time_unit}...")
         self.stdout.write(f"Cutoff time: {cutoff_time}")
-        
-        # Find devices that haven't synced in the specified time
-        offline_devices = ChildDevice.objects.filter(
-            last_sync__lt=cutoff_time
-        ).exclude(
-            last_sync__isnull=True  # Exclude devices that have never synced
-        )
-        
-        self.stdout.write(f"Found {offline_devices.count()} potentially offline devices")
-        
-        if not offline_devices.exists():
+
+        # last_sync is the flushed heartbeat time; write out any this process
+        # still buffers (e.g. when run inside a web worker) before reading it
+        flush_heartbeats()
+
+        # One query per batch of devices that are due: devices that never
+        # synced fall out of the last_sync comparison, recently notified ones
+        # by offline_notified_at, and the parent comes along in the same row
+        offline_devices = ChildDevice.objects.filter(last_sync__lt=cutoff_time)
+        if not force:
+            offline_devices = offline_devices.filter(
+                Q(offline_notified_at__isnull=True) | Q(offline_notified_at__lt=now - recent_threshold)
+            )
+        offline_devices = offline_devices.select_related('parent').only(
+            'device_id', 'nickname', 'last_sync', 'parent__email', 'parent__first_name', 'parent__username'
+        ).order_by('pk')
+
+        chunk_size = getattr(settings, 'OFFLINE_CHECK_CHUNK_SIZE', 1000)
+        threads = max(options['threads'] or getattr(settings, 'OFFLINE_CHECK_THREADS', 4), 1)
+        notifications_sent = 0
+        last_pk = 0
+        with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='offline-check') as pool:
+            while True:
+                with transaction.atomic():
+                    # Rows another checker has claimed are skipped rather than
+                    # waited for. A checker that reaches one after the claim
+                    # committed re-reads the row, finds offline_notified_at
+                    # set and drops it, so any number of checkers can split
+                    # the fleet without emailing a parent twice
+                    chunk = list(
+                        offline_devices.filter(pk__gt=last_pk)
+                        .select_for_update(skip_locked=True, of=('self',))[:chunk_size]
+                    )
+                    if not chunk:
+                        break
+                    last_pk = chunk[-1].pk
+                    notifications_sent += self.notify_chunk(chunk, now, time_unit, pool)
+
+        if not notifications_sent:
             self.stdout.write(
                 self.style.SUCCESS(f"No devices found offline for more than {time_value} {time_unit}.")
             )
             return
-        
-        notifications_sent = 0
-        
-        for device in offline_devices:
-            # Calculate time offline
-            time_diff = timezone.now() - device.last_sync
-            
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Process completed. {notifications_sent} notifications queued."
+            )
+        )
+
+    def notify_chunk(self, devices, now, time_unit, pool):
+        """
+        Queue the offline emails for a claimed chunk of devices, rendered on
+        the thread pool, and record the notifications and dashboard events
+        with one INSERT each. Runs inside the claiming transaction. Returns
+        the number of notifications queued.
+        """
+        offline_times = []
+        for device in devices:
+            time_diff = now - device.last_sync
             if time_unit == "days":
                 time_offline = time_diff.days
-                time_offline_display = f"{time_offline} days"
             else:
                 time_offline = int(time_diff.total_seconds() / 60)  # Convert to minutes
-                time_offline_display = f"{time_offline} minutes"
-            
-            self.stdout.write(f"Device {device} last synced: {device.last_sync} ({time_offline_display} ago)")
-            
-            # Check if we've already sent a notification for this device recently
-            if not force:
-                # For production (days), avoid duplicate notifications within 24 hours
-                # For testing (minutes), avoid duplicate notifications within 5 minutes
-                if time_unit == "days":
-                    recent_threshold = timedelta(days=1)
-                else:
-                    recent_threshold = timedelta(minutes=5)
-                    
-                recent_notification = DeviceOfflineNotification.objects.filter(
-                    device=device,
-                    notification_sent_at__gte=timezone.now() - recent_threshold
-                ).exists()
-                
-                if recent_notification:
-                    self.stdout.write(
-                        f"Skipping {device} - notification already sent recently"
-                    )
-                    continue
-            
-            # Send notification email
-            success = self.send_offline_notification(device, time_offline, time_unit)
-            
-            if success:
-                # Record that we sent the notification
-                DeviceOfflineNotification.objects.create(
-                    device=device,
-                    days_offline=time_offline if time_unit == "days" else 0,  # Keep days_offline for backward compatibility
-                    email_sent_to=device.parent.email
-                )
-                notifications_sent += 1
-                
-                self.stdout.write(
-                    self.style.SUCCESS(
-                        f"Sent notification for {device} ({time_offline_display} offline)"
-                    )
-                )
-            else:
-                self.stdout.write(
-                    self.style.ERROR(
-                        f"Failed to send notification for {device}"
-                    )
-                )
-        
-        self.stdout.write(
-            self.style.SUCCESS(
-                f"Process completed. {notifications_sent} notifications sent."
-            )
+            offline_times.append(time_offline)
+
+            if self.verbosity >= 2:
+                self.stdout.write(f"Device {device} last synced: {device.last_sync} ({time_offline} {time_unit} ago)")
+
+        rendered = pool.map(
+            lambda args: self.build_offline_notification(*args, time_unit),
+            zip(devices, offline_times),
         )
 
-    def send_offline_notification(self, device, time_offline, time_unit):
-        """Send offline notification email to the parent"""
+        emails = []
+        notifications = []
+        events = []
+        for device, time_offline, email in zip(devices, offline_times, rendered):
+            if email is None:
+                continue
+            emails.append(email)
+            notifications.append(DeviceOfflineNotification(
+                device=device,
+                days_offline=time_offline if time_unit == "days" else 0,  # Keep days_offline for backward compatibility
+                email_sent_to=device.parent.email,
+            ))
+            events.append((device.parent_id, 'device_offline', device, {
+                'last_sync': device.last_sync.isoformat(),
+                'time_offline': f"{time_offline} {time_unit}",
+            }))
+
+        # The outbox delivers the emails once this commits
+        enqueue_emails(emails)
+        DeviceOfflineNotification.objects.bulk_create(notifications)
+        ChildDevice.objects.filter(pk__in=[n.device.pk for n in notifications]).update(offline_notified_at=now)
+        record_events(events)
+        return len(notifications)
+
+    def build_offline_notification(self, device, time_offline, time_unit):
+        """Render the offline notification email for the parent, or None on failure"""
         try:
             parent = device.parent
-            
+
             # Format the offline duration display
             if time_unit == "days":
                 time_offline_display = f"{time_offline} days"
@@ -143,7 +177,7 @@ class Command(BaseCommand):
             else:
                 time_offline_display = f"{time_offline} minutes"
                 subject_time = f"{time_offline} minutes"
-            
+
             # Prepare email context
             context = {
                 'parent_name': parent.first_name or parent.username,
@@ -154,31 +188,26 @@ class Command(BaseCommand):
                 'last_sync_date': device.last_sync.strftime('%B %d, %Y at %I:%M %p') if device.last_sync else 'Never',
                 'is_test': False,
             }
-            
+
             # Render email templates
             subject = f"Device Offline Alert - {context['device_name']} has been offline for {subject_time}"
             text_content = render_to_string(
-                'parent_ui/emails/device_offline_notification.txt', 
+                'parent_ui/emails/device_offline_notification.txt',
                 context
             )
             html_content = render_to_string(
-                'parent_ui/emails/device_offline_notification.html', 
+                'parent_ui/emails/device_offline_notification.html',
                 context
             )
-            
-            # Send email
-            send_mail(
-                subject=subject,
-                message=text_content,
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[parent.email],
-                html_message=html_content,
-                fail_silently=False,
-            )
-            
-            logger.info(f"Offline notification sent for device {device.device_id} to {parent.email} ({time_offline_display} offline)")
-            return True
-            
+
+            logger.info(f"Offline notification queued for device {device.device_id} to {parent.email} ({time_offline_display} offline)")
+            return {
+                'subject': subject,
+                'body': text_content,
+                'to': [parent.email],
+                'html_body': html_content,
+            }
+
         except Exception as e:
-            logger.error(f"Failed to send offline notification for device {device.device_id}: {str(e)}")
-            return False
+            logger.error(f"Failed to render offline notification for device {device.device_id}: {str(e)}")
+            return None
@@ -0,0 +1,93 @@
+import signal
+import threading
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.utils import timezone
+from api.models import ScheduledJob
+from api.scheduler import JOBS, Scheduler
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Run periodic jobs (offline checks, email, reports, retention) in one long-running process'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tick',
+            type=float,
+            default=5.0,
+            help='Seconds between checks for due jobs (default: 5)'
+        )
+        parser.add_argument(
+            '--threads',
+            type=int,
+            default=4,
+            help='Number of jobs that may run at the same time (default: 4)'
+        )
+        parser.add_argument(
+            '--job',
+            action='append',
+            default=None,
+            help='Only run this job; may be given more than once'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Run the jobs that are due, wait for them and exit'
+        )
+        parser.add_argument(
+            '--list',
+            action='store_true',
+            help='Show each job with its last run and exit'
+        )
+
+    def handle(self, *args, **options):
+        if options['list']:
+            self.list_jobs()
+            return
+
+        jobs = JOBS
+        if options['job']:
+            unknown = set(options['job']) - set(JOBS)
+            if unknown:
+                raise CommandError(f"Unknown jobs: {', '.join(sorted(unknown))}. Known jobs: {', '.join(JOBS)}")
+            jobs = {name: JOBS[name] for name in options['job']}
+
+        scheduler = Scheduler(jobs.items(), threads=options['threads'])
+        self.stdout.write(f"Scheduler {scheduler.owner} started with jobs: {', '.join(jobs)}")
+
+        stop = threading.Event()
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda *args: stop.set())
+        try:
+            while True:
+                try:
+                    scheduler.tick()
+                except Exception as e:
+                    logger.exception(f"Scheduler tick failed: {str(e)}")
+                    close_old_connections()
+                if options['once'] or stop.wait(options['tick']):
+                    break
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stdout.write("Waiting for running jobs to finish...")
+            scheduler.shutdown()
+        self.stdout.write(self.style.SUCCESS("Scheduler stopped"))
+
+    def list_jobs(self):
+        rows = {job.name: job for job in ScheduledJob.objects.filter(name__in=list(JOBS))}
+        now = timezone.now()
+        for name, job in JOBS.items():
+            row = rows.get(name)
+            if row is None or row.last_started_at is None:
+                self.stdout.write(f"{name}: every {job.interval}s, never run")
+                continue
+            line = (
+                f"{name}: every {job.interval}s, last run {row.last_started_at:%Y-%m-%d %H:%M:%S} "
+                f"{row.last_status} in {row.last_duration:.2f}s"
+            )
+            if row.lease_expires_at and row.lease_expires_at > now:
+                line += f", running on {row.lease_owner}"
+            self.stdout.write(line)
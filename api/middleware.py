@@ -1,57 +1,91 @@
 # api/middleware.py
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.http import JsonResponse
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken, TokenError
+from whitenoise.middleware import WhiteNoiseMiddleware
+from .authentication import CachedJWTAuthentication
+
+
 class JWTAuthMiddleware:
+    """
+    Authenticates the request's JWT, from the Authorization header or the
+    access_token cookie, and sets request.user. This is the only JWT check
+    of a request: DRF's CachedJWTAuthentication reuses the result.
+
+    Works in both sync and async middleware chains, so under ASGI an async
+    view such as the device-sync long-poll is awaited on the event loop and
+    does not hold a thread while it waits.
+    """
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        self.jwt_auth = CachedJWTAuthentication()
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
-        response = self.get_response(request)
-        return response
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.authenticate(request)
+        return response or self.get_response(request)
 
-    def process_view(self, request, view_func, view_args, view_kwargs):
+    async def __acall__(self, request):
+        # Loading the user may query the database, so it runs in a thread;
+        # the view itself is awaited here
+        response = await sync_to_async(self.authenticate)(request)
+        return response or await self.get_response(request)
+
+    def authenticate(self, request):
+        """Set request.user from the request's JWT; returns a response to send instead, if any"""
         # Skip for login and other auth views
         if request.path.startswith('/api/token/') or request.path.startswith('/admin/'):
             return None
-            
-        # Check for token in cookies or headers
-        token = request.COOKIES.get('access_token') or request.headers.get('Authorization', '').split(' ')[-1]
-        
-        if token:
+
+        result = None
+        try:
+            result = self.jwt_auth.authenticate(request)
+        except (AuthenticationFailed, InvalidToken, TokenError):
+            # API views answer a bad header with their own 401
+            pass
+
+        token = request.COOKIES.get('access_token')
+        if result is None and token:
             try:
-                from rest_framework_simplejwt.authentication import JWTAuthentication
-                jwt_auth = JWTAuthentication()
-                validated_token = jwt_auth.get_validated_token(token)
-                request.user = jwt_auth.get_user(validated_token)
-            except Exception as e:
-                pass
-                
+                result = self.jwt_auth.authenticate_token(token)
+            except (AuthenticationFailed, InvalidToken, TokenError):
+                return JsonResponse({'error': 'Invalid token'}, status=401)
+
+        if result is not None:
+            request.user = result[0]
         return None
-    
 
-# api/middleware.py
-from rest_framework_simplejwt.authentication import JWTAuthentication
-from rest_framework_simplejwt.exceptions import InvalidToken
-from django.http import JsonResponse
 
-class JWTMiddleware:
-    def __init__(self, get_response):
-        self.get_response = get_response
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoiseMiddleware that also works in async middleware chains. Static
+    files are served from a thread; every other request is passed on
+    without one.
+    """
+    sync_capable = True
+    async_capable = True
 
-    def __call__(self, request):
-        # Skip for auth endpoints
-        if request.path.startswith('/api/token/'):
-            return self.get_response(request)
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
-        # Check for token in cookies
-        token = request.COOKIES.get('access_token')
-        if token:
-            try:
-                jwt_auth = JWTAuthentication()
-                validated_token = jwt_auth.get_validated_token(token)
-                request.user = jwt_auth.get_user(validated_token)
-                print(f"Authenticated user: {request.user}")
-            except InvalidToken as e:
-                print(f"Invalid token: {str(e)}")
-                return JsonResponse({'error': 'Invalid token'}, status=401)
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
 
-        return self.get_response(request)
-    
\ No newline at end of file
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve)(static_file, request)
+        return await self.get_response(request)
@@ -0,0 +1,55 @@
+# Generated by Django 4.2 on 2026-10-18 08:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def remove_duplicate_usage_logs(apps, schema_editor):
+    """Keep the oldest row for each (device, app_name, start_time) before adding the unique constraint"""
+    AppUsageLog = apps.get_model('api', 'AppUsageLog')
+    duplicates = (
+        AppUsageLog.objects.values('device_id', 'app_name', 'start_time')
+        .annotate(keep_id=models.Min('id'), rows=models.Count('id'))
+        .filter(rows__gt=1)
+    )
+    for dup in duplicates.iterator():
+        AppUsageLog.objects.filter(
+            device_id=dup['device_id'],
+            app_name=dup['app_name'],
+            start_time=dup['start_time'],
+        ).exclude(id=dup['keep_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_screentimerule_synced_to_device'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UsageSyncBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('batch_id', models.CharField(max_length=64)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('total_entries', models.PositiveIntegerField(default=0)),
+                ('valid_entries', models.PositiveIntegerField(default=0)),
+                ('skipped_entries', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(remove_duplicate_usage_logs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='appusagelog',
+            constraint=models.UniqueConstraint(fields=('device', 'app_name', 'start_time'), name='unique_usage_session'),
+        ),
+        migrations.AddField(
+            model_name='usagesyncbatch',
+            name='device',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage_sync_batches', to='api.childdevice'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='usagesyncbatch',
+            unique_together={('device', 'batch_id')},
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2 on 2026-10-18 08:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_appusagelog_unique_session_usagesyncbatch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AppUsageDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('app_name', models.CharField(max_length=100)),
+                ('date', models.DateField()),
+                ('total_duration', models.PositiveBigIntegerField(default=0, help_text='Duration in seconds')),
+                ('session_count', models.PositiveIntegerField(default=0)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_usage_rollups', to='api.childdevice')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='HourlyUsageRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField(help_text='Start of the hour')),
+                ('total_duration', models.PositiveBigIntegerField(default=0, help_text='Duration in seconds')),
+                ('session_count', models.PositiveIntegerField(default=0)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hourly_usage_rollups', to='api.childdevice')),
+            ],
+            options={
+                'unique_together': {('device', 'hour')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='appusagedailyrollup',
+            index=models.Index(fields=['device', 'date'], name='api_appusag_device__2a2a45_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='appusagedailyrollup',
+            unique_together={('device', 'app_name', 'date')},
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-10-18 08:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_usage_rollups'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appusagelog',
+            index=models.Index(fields=['device', 'start_time'], name='usage_device_start_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 08:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_appusagelog_device_start_time_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='childdevice',
+            name='blocked_apps_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
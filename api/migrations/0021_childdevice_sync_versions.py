@@ -0,0 +1,28 @@
+# Generated by Django 4.2 on 2026-10-18 08:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_childdevice_blocked_apps_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='childdevice',
+            name='content_filter_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='childdevice',
+            name='screen_time_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='childdevice',
+            name='url_rules_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
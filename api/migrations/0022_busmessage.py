@@ -0,0 +1,24 @@
+# Generated by Django 4.2 on 2026-10-18 08:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_childdevice_sync_versions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BusMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('topics', models.JSONField(default=list)),
+                ('kind', models.CharField(max_length=50)),
+                ('data', models.JSONField(blank=True, default=dict)),
+                ('origin', models.CharField(help_text='Process that published the event', max_length=32)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+    ]
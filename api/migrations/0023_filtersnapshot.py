@@ -0,0 +1,30 @@
+# Generated by Django 4.2 on 2026-10-18 08:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0022_busmessage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FilterSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(help_text='SHA-256 of data; served as the ETag', max_length=64)),
+                ('url_rules_version', models.PositiveIntegerField()),
+                ('content_filter_version', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+                ('built_at', models.DateTimeField(auto_now=True, help_text="Last time the device's rules compiled to this snapshot")),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='filter_snapshots', to='api.childdevice')),
+            ],
+            options={
+                'ordering': ['-built_at', '-id'],
+                'unique_together': {('device', 'digest')},
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2 on 2026-10-18 08:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0023_filtersnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DomainDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('domain', models.CharField(max_length=255)),
+                ('date', models.DateField()),
+                ('visit_count', models.PositiveIntegerField(default=0)),
+                ('blocked_count', models.PositiveIntegerField(default=0)),
+                ('first_seen', models.DateTimeField(blank=True, null=True)),
+                ('last_seen', models.DateTimeField(blank=True, null=True)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='domain_rollups', to='api.childdevice')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='domaindailyrollup',
+            index=models.Index(fields=['device', 'date'], name='api_domaind_device__757587_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='domaindailyrollup',
+            unique_together={('device', 'domain', 'date')},
+        ),
+    ]
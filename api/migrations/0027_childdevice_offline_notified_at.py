@@ -0,0 +1,30 @@
+# Generated by Django 4.2 on 2026-10-18 09:00
+
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+
+
+def copy_latest_notification(apps, schema_editor):
+    """Carry each device's latest offline notification over to offline_notified_at"""
+    ChildDevice = apps.get_model('api', 'ChildDevice')
+    DeviceOfflineNotification = apps.get_model('api', 'DeviceOfflineNotification')
+    latest = DeviceOfflineNotification.objects.filter(device=OuterRef('pk')).values('device').annotate(
+        latest=Max('notification_sent_at')
+    ).values('latest')
+    ChildDevice.objects.filter(offline_notifications__isnull=False).update(offline_notified_at=Subquery(latest))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0026_scheduledjob_jobrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='childdevice',
+            name='offline_notified_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(copy_latest_notification, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 09:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0027_childdevice_offline_notified_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appusagelog',
+            name='ingest_token',
+            field=models.UUIDField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -24,6 +24,17 @@ class ChildDevice(models.Model):
     nickname = models.CharField(max_length=100, blank=True, null=True)
     last_sync = models.DateTimeField(null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Per-section change counters, bumped by the signal handlers at the end of
+    # this module. blocked_apps_version is the ETag of get_blocked_apps and
+    # together they form the cursor of the device-sync endpoint
+    blocked_apps_version = models.PositiveIntegerField(default=0)
+    screen_time_version = models.PositiveIntegerField(default=0)
+    url_rules_version = models.PositiveIntegerField(default=0)
+    content_filter_version = models.PositiveIntegerField(default=0)
+    # Time of the latest DeviceOfflineNotification. check_offline_devices
+    # sets it in the transaction that claims the device, so a concurrent
+    # checker re-checking the locked row sees it and skips the device
+    offline_notified_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         unique_together = ('parent', 'device_id')  # Ensures a parent can't add same device twice
@@ -37,6 +48,9 @@ class AppUsageLog(models.Model):
     start_time = models.DateTimeField()
     end_time = models.DateTimeField()
     duration = models.PositiveIntegerField(help_text="Duration in seconds")
+    # Set by the upload that inserted the row, so it can tell its own rows
+    # from the ones a concurrent retry of the same sessions inserted
+    ingest_token = models.UUIDField(null=True, blank=True, editable=False)
     
     def clean(self):
         """Validate that end_time is after start_time"""
@@ -65,8 +79,85 @@ class AppUsageLog(models.Model):
             models.CheckConstraint(
                 check=models.Q(end_time__gt=models.F('start_time')),
                 name='end_time_after_start_time'
-            )
+            ),
+            # Natural key: a device can't report the same app session twice.
+            # Its index also serves (device, app_name, start_time) range filters.
+            models.UniqueConstraint(
+                fields=['device', 'app_name', 'start_time'],
+                name='unique_usage_session'
+            ),
         ]
+        indexes = [
+            # Every read path filters on device plus a start_time window
+            models.Index(fields=['device', 'start_time'], name='usage_device_start_idx'),
+        ]
+
+
+class UsageSyncBatch(models.Model):
+    """Record of a processed sync-usage upload, keyed by the client's batch id"""
+    device = models.ForeignKey(ChildDevice, on_delete=models.CASCADE, related_name='usage_sync_batches')
+    batch_id = models.CharField(max_length=64)
+    received_at = models.DateTimeField(auto_now_add=True)
+    total_entries = models.PositiveIntegerField(default=0)
+    valid_entries = models.PositiveIntegerField(default=0)
+    skipped_entries = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('device', 'batch_id')
+
+    def __str__(self):
+        return f"Batch {self.batch_id} for {self.device}"
+
+class AppUsageDailyRollup(models.Model):
+    """Per device x app x day usage totals, maintained incrementally at ingest"""
+    device = models.ForeignKey(ChildDevice, on_delete=models.CASCADE, related_name='daily_usage_rollups')
+    app_name = models.CharField(max_length=100)
+    date = models.DateField()
+    total_duration = models.PositiveBigIntegerField(default=0, help_text="Duration in seconds")
+    session_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('device', 'app_name', 'date')
+        indexes = [
+            models.Index(fields=['device', 'date']),
+        ]
+
+    def __str__(self):
+        return f"{self.device} - {self.app_name} on {self.date}: {self.total_duration}s"
+
+
+class HourlyUsageRollup(models.Model):
+    """Per device x hour usage totals across all apps, maintained incrementally at ingest"""
+    device = models.ForeignKey(ChildDevice, on_delete=models.CASCADE, related_name='hourly_usage_rollups')
+    hour = models.DateTimeField(help_text="Start of the hour")
+    total_duration = models.PositiveBigIntegerField(default=0, help_text="Duration in seconds")
+    session_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('device', 'hour')
+
+    def __str__(self):
+        return f"{self.device} - {self.hour:%Y-%m-%d %H}:00: {self.total_duration}s"
+
+
+class DomainDailyRollup(models.Model):
+    """Per device x domain x day browsing totals, maintained incrementally at ingest"""
+    device = models.ForeignKey(ChildDevice, on_delete=models.CASCADE, related_name='domain_rollups')
+    domain = models.CharField(max_length=255)
+    date = models.DateField()
+    visit_count = models.PositiveIntegerField(default=0)
+    blocked_count = models.PositiveIntegerField(default=0)
+    first_seen = models.DateTimeField(null=True, blank=True)
+    last_seen = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('device', 'domain', 'date')
+        indexes = [
+            models.Index(fields=['device', 'date']),
+        ]
+
+    def __str__(self):
+        return f"{self.device} - {self.domain} on {self.date}: {self.visit_count} visits"
 
 from django.db import models
 from django.utils import timezone
@@ -143,7 +234,8 @@ class ScreenTimeRule(models.Model):
         self.save(update_fields=['synced_to_device'])
     
 
-from django.db.models.signals import post_save, pre_save
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
 from django.dispatch import receiver
 import logging
 
@@ -340,3 +432,191 @@ class WhitelistedURL(models.Model):
     
     def __str__(self):
         return f"Whitelisted: {self.url_pattern} for {self.device}"
+
+
+class DeviceOfflineNotification(models.Model):
+    """Offline alerts emailed to parents, so a device is not reported again too soon"""
+    device = models.ForeignKey(ChildDevice, on_delete=models.CASCADE, related_name='offline_notifications')
+    notification_sent_at = models.DateTimeField(auto_now_add=True)
+    days_offline = models.PositiveIntegerField()
+    email_sent_to = models.EmailField()
+
+    class Meta:
+        ordering = ['-notification_sent_at']
+        indexes = [
+            # A device's notification history, newest first
+            models.Index(fields=['device', 'notification_sent_at']),
+        ]
+
+    def __str__(self):
+        return f"Offline notification for {self.device} at {self.notification_sent_at}"
+
+
+class FilterSnapshot(models.Model):
+    """
+    A compiled binary snapshot of a device's URL filter rules (see
+    api.filter_snapshot). The last few are kept so devices can fetch a diff
+    from the one they hold.
+    """
+    device = models.ForeignKey(ChildDevice, on_delete=models.CASCADE, related_name='filter_snapshots')
+    digest = models.CharField(max_length=64, help_text="SHA-256 of data; served as the ETag")
+    url_rules_version = models.PositiveIntegerField()
+    content_filter_version = models.PositiveIntegerField()
+    data = models.BinaryField()
+    built_at = models.DateTimeField(auto_now=True, help_text="Last time the device's rules compiled to this snapshot")
+
+    class Meta:
+        unique_together = ('device', 'digest')
+        ordering = ['-built_at', '-id']
+
+    def __str__(self):
+        return f"Filter snapshot {self.digest[:12]} for {self.device}"
+
+
+class BusMessage(models.Model):
+    """
+    An event_bus event relayed to other processes when EVENT_BUS_FANOUT is
+    'database'. Rows are short-lived; relays delete them after a few minutes.
+    """
+    topics = models.JSONField(default=list)
+    kind = models.CharField(max_length=50)
+    data = models.JSONField(default=dict, blank=True)
+    origin = models.CharField(max_length=32, help_text="Process that published the event")
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.kind} -> {', '.join(self.topics)}"
+
+
+class ScheduledJob(models.Model):
+    """
+    Schedule and lease of one run_scheduler job. A scheduler instance runs
+    the job only while it holds the lease, so several instances can run
+    side by side without running the same job twice.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    next_run_at = models.DateTimeField(null=True, blank=True, help_text="Empty means run as soon as possible")
+    lease_owner = models.CharField(max_length=64, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    last_started_at = models.DateTimeField(null=True, blank=True)
+    last_status = models.CharField(max_length=10, blank=True)
+    last_duration = models.FloatField(null=True, blank=True, help_text="Seconds")
+
+    def __str__(self):
+        return self.name
+
+
+class JobRun(models.Model):
+    """One run of a ScheduledJob, kept for SCHEDULER_RUN_RETENTION_DAYS"""
+    STATUS_CHOICES = [
+        ('running', 'Running'),
+        ('success', 'Success'),
+        ('failed', 'Failed'),
+    ]
+
+    job = models.ForeignKey(ScheduledJob, on_delete=models.CASCADE, related_name='runs')
+    owner = models.CharField(max_length=64, help_text="Scheduler instance that ran the job")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='running')
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField(null=True, blank=True)
+    duration = models.FloatField(null=True, blank=True, help_text="Seconds")
+    result = models.TextField(blank=True)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['-started_at']
+        indexes = [
+            models.Index(fields=['job', 'started_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.job} at {self.started_at}: {self.status}"
+
+
+# Device sync versions
+# Any change to what a device enforces bumps the matching counter on
+# ChildDevice, so polls can tell "nothing changed" from a single row.
+
+def bump_device_version(device_id, field):
+    from .event_bus import device_topic, parent_topic, publish_on_commit
+
+    ChildDevice.objects.filter(pk=device_id).update(**{field: F(field) + 1})
+    # Tell long-polls and other listeners once the change is visible
+    parent_id = ChildDevice.objects.filter(pk=device_id).values_list('parent_id', flat=True).first()
+    if parent_id is not None:
+        publish_on_commit(
+            'rules_changed',
+            [device_topic(device_id), parent_topic(parent_id)],
+            device_pk=device_id,
+            section=field[:-len('_version')],
+        )
+
+
+def _only_updates(update_fields, bookkeeping_fields):
+    return bool(update_fields) and frozenset(update_fields) <= bookkeeping_fields
+
+
+@receiver(post_save, sender=BlockedApp)
+@receiver(post_delete, sender=BlockedApp)
+def bump_blocked_apps_version(sender, instance, update_fields=None, **kwargs):
+    # Saves that only record sync bookkeeping don't change what the device gets
+    if _only_updates(update_fields, frozenset(['last_synced'])):
+        return
+    bump_device_version(instance.device_id, 'blocked_apps_version')
+
+
+@receiver(post_save, sender=ScreenTimeRule)
+@receiver(post_delete, sender=ScreenTimeRule)
+def bump_screen_time_version(sender, instance, update_fields=None, **kwargs):
+    # mark_as_synced() is bookkeeping, mark_as_changed() asks for a resend
+    if _only_updates(update_fields, frozenset(['synced_to_device'])) and instance.synced_to_device:
+        return
+    bump_device_version(instance.device_id, 'screen_time_version')
+
+
+@receiver(post_save, sender=BlockedURL)
+@receiver(post_delete, sender=BlockedURL)
+@receiver(post_save, sender=WhitelistedURL)
+@receiver(post_delete, sender=WhitelistedURL)
+def bump_url_rules_version(sender, instance, update_fields=None, **kwargs):
+    if _only_updates(update_fields, frozenset(['last_synced'])):
+        return
+    bump_device_version(instance.device_id, 'url_rules_version')
+
+
+@receiver(post_save, sender=DeviceContentFilter)
+@receiver(post_delete, sender=DeviceContentFilter)
+def bump_content_filter_version(sender, instance, **kwargs):
+    bump_device_version(instance.device_id, 'content_filter_version')
+
+
+@receiver(m2m_changed, sender=DeviceContentFilter.blocked_categories.through)
+def bump_content_filter_categories_version(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith('post_'):
+            bump_device_version(instance.device_id, 'content_filter_version')
+    elif action in ('post_add', 'post_remove'):
+        # Changed from the category side; instance is a SafeBrowsingCategory
+        ChildDevice.objects.filter(content_filter__in=pk_set).update(
+            content_filter_version=F('content_filter_version') + 1
+        )
+    elif action == 'pre_clear':
+        _bump_category_devices(instance)
+
+
+def _bump_category_devices(category):
+    ChildDevice.objects.filter(content_filter__blocked_categories=category).update(
+        content_filter_version=F('content_filter_version') + 1
+    )
+
+
+@receiver(post_save, sender=SafeBrowsingCategory)
+def bump_category_devices_version(sender, instance, created, **kwargs):
+    # Category names are part of the content filter payload
+    if not created:
+        _bump_category_devices(instance)
+
+
+@receiver(pre_delete, sender=SafeBrowsingCategory)
+def bump_deleted_category_devices_version(sender, instance, **kwargs):
+    _bump_category_devices(instance)
@@ -0,0 +1,198 @@
+"""
+Write-behind buffer of device heartbeats and the presence derived from them.
+
+Every request a device makes (usage and browsing uploads, rule polls,
+device-status pings) is a sign of life. Rather than UPDATE the device's row
+each time, record_heartbeat() notes the time in a per-process buffer and a
+flusher thread writes everything collected every HEARTBEAT_FLUSH_SECONDS
+with one UPDATE ... SET last_sync = CASE ... per batch of devices. A device
+pinging many times between flushes costs one write, and ChildDevice rows are
+never locked on the request path.
+
+ChildDevice.last_sync stays the stored last-seen time and is at most a
+flush interval behind. Presence is derived from it (plus whatever this
+process still has buffered): online when seen within PRESENCE_ONLINE_SECONDS,
+idle within PRESENCE_IDLE_SECONDS, offline otherwise.
+"""
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .event_bus import device_topic, parent_topic, publish
+from .models import ChildDevice
+
+logger = logging.getLogger(__name__)
+
+ONLINE = 'online'
+IDLE = 'idle'
+OFFLINE = 'offline'
+
+
+class HeartbeatBuffer:
+    def __init__(self, flush_interval=5.0, batch_size=500):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flusher = None
+        self.recorded = 0
+        self.written = 0
+        self.flushes = 0
+
+    def record(self, device_pk, seen_at):
+        with self._lock:
+            previous = self._pending.get(device_pk)
+            if previous is None or seen_at > previous:
+                self._pending[device_pk] = seen_at
+            self.recorded += 1
+            self._ensure_flusher()
+
+    def pending(self, device_pk):
+        """Buffered last-seen time of device_pk not yet written, or None"""
+        with self._lock:
+            return self._pending.get(device_pk)
+
+    def flush(self):
+        """Write every buffered heartbeat; returns the number of devices updated"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        items = sorted(pending.items())
+        try:
+            for start in range(0, len(items), self.batch_size):
+                batch = items[start:start + self.batch_size]
+                # Greatest() keeps a newer time another process already wrote
+                ChildDevice.objects.filter(pk__in=[pk for pk, _ in batch]).update(last_sync=Case(
+                    *[
+                        When(pk=pk, then=Greatest(Coalesce(F('last_sync'), Value(seen_at)), Value(seen_at)))
+                        for pk, seen_at in batch
+                    ],
+                    default=F('last_sync'),
+                ))
+                # Dropped from the retry set only once written
+                for pk, _ in batch:
+                    del pending[pk]
+        except Exception:
+            with self._lock:
+                for pk, seen_at in pending.items():
+                    if pk not in self._pending or seen_at > self._pending[pk]:
+                        self._pending[pk] = seen_at
+            raise
+        with self._lock:
+            self.written += len(items)
+            self.flushes += 1
+        return len(items)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'recorded': self.recorded,
+                'written': self.written,
+                'flushes': self.flushes,
+            }
+
+    def _ensure_flusher(self):
+        # Called with the lock held
+        if self._flusher is None or not self._flusher.is_alive():
+            self._flusher = threading.Thread(target=self._flush_loop, name='heartbeat-flusher', daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self):
+        stop = threading.Event()
+        failing = False
+        try:
+            while not stop.wait(self.flush_interval):
+                close_old_connections()
+                try:
+                    self.flush()
+                    failing = False
+                except Exception as e:
+                    # Log once per outage; the heartbeats are kept for the next try
+                    if not failing:
+                        logger.error(f"Heartbeat flush failed: {str(e)}")
+                    failing = True
+        finally:
+            connection.close()
+
+
+_buffer = HeartbeatBuffer(
+    flush_interval=getattr(settings, 'HEARTBEAT_FLUSH_SECONDS', 5.0),
+    batch_size=getattr(settings, 'HEARTBEAT_FLUSH_BATCH_SIZE', 500),
+)
+
+
+def _flush_at_exit():
+    try:
+        _buffer.flush()
+    except Exception as e:
+        logger.error(f"Heartbeat flush at exit failed: {str(e)}")
+
+
+atexit.register(_flush_at_exit)
+
+
+def presence(last_seen_at, now=None):
+    """online, idle or offline for a device last seen at last_seen_at"""
+    if last_seen_at is None:
+        return OFFLINE
+    age = ((now or timezone.now()) - last_seen_at).total_seconds()
+    if age <= getattr(settings, 'PRESENCE_ONLINE_SECONDS', 120):
+        return ONLINE
+    if age <= getattr(settings, 'PRESENCE_IDLE_SECONDS', 900):
+        return IDLE
+    return OFFLINE
+
+
+def last_seen(device):
+    """The device's last_sync, or the newer heartbeat this process has buffered"""
+    pending = _buffer.pending(device.pk)
+    if pending is None or (device.last_sync is not None and device.last_sync >= pending):
+        return device.last_sync
+    return pending
+
+
+def device_presence(device, now=None):
+    return presence(last_seen(device), now)
+
+
+def annotate_presence(devices, now=None):
+    """Set last_seen and presence on each device; no queries beyond loading them"""
+    now = now or timezone.now()
+    devices = list(devices)
+    for device in devices:
+        device.last_seen = last_seen(device)
+        device.presence = presence(device.last_seen, now)
+    return devices
+
+
+def record_heartbeat(device, seen_at=None):
+    """
+    Note that device was seen. device needs pk, parent_id and last_sync
+    loaded. Listeners hear about it only when the device comes back online.
+    """
+    seen_at = seen_at or timezone.now()
+    was = device_presence(device, seen_at)
+    _buffer.record(device.pk, seen_at)
+    if was != ONLINE:
+        publish(
+            'presence_changed',
+            [device_topic(device.pk), parent_topic(device.parent_id)],
+            device_pk=device.pk,
+            presence=ONLINE,
+        )
+
+
+def flush_heartbeats():
+    return _buffer.flush()
+
+
+def heartbeat_stats():
+    return _buffer.stats()
@@ -0,0 +1,442 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, F, Max, Min, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest, Least, TruncDate, TruncHour
+from django.utils import timezone
+
+from .models import AppUsageDailyRollup, AppUsageLog, DomainDailyRollup, HourlyUsageRollup, URLAccessLog
+
+logger = logging.getLogger(__name__)
+
+
+# ---------------------------------------------------------------------------
+# Maintenance
+# ---------------------------------------------------------------------------
+
+def _day_bucket(moment):
+    return timezone.localtime(moment).date()
+
+
+def _hour_bucket(moment):
+    return timezone.localtime(moment).replace(minute=0, second=0, microsecond=0)
+
+
+def _increment_rollups(model, device, key_fields, totals):
+    """
+    Add the (duration, sessions) deltas in totals to the rollup rows identified
+    by key_fields, creating missing rows first.
+
+    Costs one INSERT for the missing rows, one SELECT for their ids and one
+    UPDATE ... CASE per chunk, however many buckets the upload touched.
+    """
+    if not totals:
+        return
+
+    model.objects.bulk_create(
+        [model(device=device, **dict(zip(key_fields, key))) for key in totals],
+        ignore_conflicts=True,
+    )
+
+    # The last key field is the time bucket, which bounds the lookup
+    time_field = key_fields[-1]
+    buckets = [key[-1] for key in totals]
+    rows = model.objects.filter(
+        device=device,
+        **{f'{time_field}__gte': min(buckets), f'{time_field}__lte': max(buckets)}
+    ).values_list('id', *key_fields)
+    ids = {tuple(row[1:]): row[0] for row in rows}
+
+    deltas = [(ids[key], duration, sessions) for key, (duration, sessions) in totals.items()]
+    duration_field = model._meta.get_field('total_duration')
+    sessions_field = model._meta.get_field('session_count')
+    batch_size = getattr(settings, 'USAGE_INGEST_BATCH_SIZE', 500)
+    for i in range(0, len(deltas), batch_size):
+        chunk = deltas[i:i + batch_size]
+        model.objects.filter(id__in=[row_id for row_id, _, _ in chunk]).update(
+            total_duration=Case(
+                *[When(id=row_id, then=F('total_duration') + Value(duration)) for row_id, duration, _ in chunk],
+                default=F('total_duration'),
+                output_field=duration_field,
+            ),
+            session_count=Case(
+                *[When(id=row_id, then=F('session_count') + Value(sessions)) for row_id, _, sessions in chunk],
+                default=F('session_count'),
+                output_field=sessions_field,
+            ),
+        )
+
+
+def apply_usage_rollups(device, logs):
+    """
+    Fold newly stored AppUsageLog instances into the daily and hourly rollups.
+    Must be called inside the transaction that inserted the logs.
+    """
+    daily = defaultdict(lambda: [0, 0])
+    hourly = defaultdict(lambda: [0, 0])
+    for log in logs:
+        day_totals = daily[(log.app_name, _day_bucket(log.start_time))]
+        day_totals[0] += log.duration
+        day_totals[1] += 1
+        hour_totals = hourly[(_hour_bucket(log.start_time),)]
+        hour_totals[0] += log.duration
+        hour_totals[1] += 1
+
+    _increment_rollups(AppUsageDailyRollup, device, ('app_name', 'date'), daily)
+    _increment_rollups(HourlyUsageRollup, device, ('hour',), hourly)
+
+
+def apply_domain_rollups(device, logs):
+    """
+    Fold newly stored URLAccessLog instances into DomainDailyRollup.
+    Must be called inside the transaction that inserted the logs.
+
+    Like _increment_rollups(): one INSERT for missing rows, one SELECT for
+    their ids and one UPDATE ... CASE per chunk.
+    """
+    totals = {}
+    for log in logs:
+        key = (log.domain, _day_bucket(log.access_time))
+        entry = totals.get(key)
+        if entry is None:
+            totals[key] = [1, int(log.was_blocked), log.access_time, log.access_time]
+        else:
+            entry[0] += 1
+            entry[1] += int(log.was_blocked)
+            entry[2] = min(entry[2], log.access_time)
+            entry[3] = max(entry[3], log.access_time)
+    if not totals:
+        return
+
+    DomainDailyRollup.objects.bulk_create(
+        [DomainDailyRollup(device=device, domain=domain, date=date) for domain, date in totals],
+        ignore_conflicts=True,
+    )
+    dates = [date for _, date in totals]
+    rows = DomainDailyRollup.objects.filter(
+        device=device, date__gte=min(dates), date__lte=max(dates)
+    ).values_list('id', 'domain', 'date')
+    ids = {(domain, date): row_id for row_id, domain, date in rows}
+
+    deltas = [(ids[key], *values) for key, values in totals.items()]
+    fields = {
+        name: DomainDailyRollup._meta.get_field(name)
+        for name in ('visit_count', 'blocked_count', 'first_seen', 'last_seen')
+    }
+    batch_size = getattr(settings, 'URL_LOG_INGEST_BATCH_SIZE', 1000)
+    for i in range(0, len(deltas), batch_size):
+        chunk = deltas[i:i + batch_size]
+        DomainDailyRollup.objects.filter(id__in=[row[0] for row in chunk]).update(
+            visit_count=Case(
+                *[When(id=row_id, then=F('visit_count') + Value(visits)) for row_id, visits, _, _, _ in chunk],
+                default=F('visit_count'),
+                output_field=fields['visit_count'],
+            ),
+            blocked_count=Case(
+                *[When(id=row_id, then=F('blocked_count') + Value(blocked)) for row_id, _, blocked, _, _ in chunk],
+                default=F('blocked_count'),
+                output_field=fields['blocked_count'],
+            ),
+            # New rows start out NULL, which LEAST/GREATEST don't skip everywhere
+            first_seen=Case(
+                *[
+                    When(id=row_id, then=Least(Coalesce(F('first_seen'), Value(first)), Value(first)))
+                    for row_id, _, _, first, _ in chunk
+                ],
+                default=F('first_seen'),
+                output_field=fields['first_seen'],
+            ),
+            last_seen=Case(
+                *[
+                    When(id=row_id, then=Greatest(Coalesce(F('last_seen'), Value(last)), Value(last)))
+                    for row_id, _, _, _, last in chunk
+                ],
+                default=F('last_seen'),
+                output_field=fields['last_seen'],
+            ),
+        )
+
+
+def rebuild_usage_rollups(device, since=None):
+    """
+    Recompute the rollups of one device from its raw AppUsageLog rows.
+    When since is given only buckets from that date onwards are rebuilt.
+    Returns a tuple (daily_rows, hourly_rows) with the number of rows written.
+    """
+    logs = AppUsageLog.objects.filter(device=device)
+    daily_rollups = AppUsageDailyRollup.objects.filter(device=device)
+    hourly_rollups = HourlyUsageRollup.objects.filter(device=device)
+    if since is not None:
+        since_start = timezone.make_aware(datetime.combine(since, time.min))
+        logs = logs.filter(start_time__gte=since_start)
+        daily_rollups = daily_rollups.filter(date__gte=since)
+        hourly_rollups = hourly_rollups.filter(hour__gte=since_start)
+
+    daily = (
+        logs.annotate(date=TruncDate('start_time'))
+        .values('app_name', 'date')
+        .annotate(total_duration=Sum('duration'), session_count=Count('id'))
+    )
+    hourly = (
+        logs.annotate(hour=TruncHour('start_time'))
+        .values('hour')
+        .annotate(total_duration=Sum('duration'), session_count=Count('id'))
+    )
+    batch_size = getattr(settings, 'USAGE_INGEST_BATCH_SIZE', 500)
+
+    with transaction.atomic():
+        daily_rollups.delete()
+        hourly_rollups.delete()
+        daily_rows = AppUsageDailyRollup.objects.bulk_create(
+            [AppUsageDailyRollup(device=device, **row) for row in daily.iterator()],
+            batch_size=batch_size,
+        )
+        hourly_rows = HourlyUsageRollup.objects.bulk_create(
+            [HourlyUsageRollup(device=device, **row) for row in hourly.iterator()],
+            batch_size=batch_size,
+        )
+
+    return len(daily_rows), len(hourly_rows)
+
+
+def rebuild_domain_rollups(device, since=None):
+    """
+    Recompute DomainDailyRollup for one device from its raw URLAccessLog rows,
+    optionally only from the date since onwards. Returns the number of rows written.
+    """
+    logs = URLAccessLog.objects.filter(device=device)
+    rollups = DomainDailyRollup.objects.filter(device=device)
+    if since is not None:
+        logs = logs.filter(access_time__gte=timezone.make_aware(datetime.combine(since, time.min)))
+        rollups = rollups.filter(date__gte=since)
+
+    rows = (
+        logs.annotate(date=TruncDate('access_time'))
+        .values('domain', 'date')
+        .annotate(
+            visit_count=Count('id'),
+            blocked_count=Count('id', filter=Q(was_blocked=True)),
+            first_seen=Min('access_time'),
+            last_seen=Max('access_time'),
+        )
+    )
+    batch_size = getattr(settings, 'URL_LOG_INGEST_BATCH_SIZE', 1000)
+
+    with transaction.atomic():
+        rollups.delete()
+        created = DomainDailyRollup.objects.bulk_create(
+            [DomainDailyRollup(device=device, **row) for row in rows.iterator()],
+            batch_size=batch_size,
+        )
+    return len(created)
+
+
+# ---------------------------------------------------------------------------
+# Queries
+# ---------------------------------------------------------------------------
+
+def _floor(moment, unit):
+    local = timezone.localtime(moment)
+    if unit == 'day':
+        return local.replace(hour=0, minute=0, second=0, microsecond=0)
+    return local.replace(minute=0, second=0, microsecond=0)
+
+
+def _next_boundary(moment, unit):
+    if unit == 'day':
+        next_day = timezone.localtime(moment).date() + timedelta(days=1)
+        return timezone.make_aware(datetime.combine(next_day, time.min))
+    return moment + timedelta(hours=1)
+
+
+def _split_window(start, end, unit):
+    """
+    Split the inclusive window [start, end] into the part covered by whole
+    rollup buckets and the partial buckets at the edges.
+
+    Returns (bucket_start, bucket_end, edges): whole buckets lie in
+    [bucket_start, bucket_end) (None meaning unbounded) and edges is a list of
+    (from, to, inclusive_end) ranges that must be read from raw logs.
+    """
+    bucket_start = None
+    if start is not None:
+        bucket_start = _floor(start, unit)
+        if bucket_start != start:
+            bucket_start = _next_boundary(bucket_start, unit)
+    bucket_end = _floor(end, unit) if end is not None else None
+
+    if bucket_start is not None and bucket_end is not None and bucket_start >= bucket_end:
+        # Window is shorter than one whole bucket
+        return None, None, [(start, end, True)]
+
+    edges = []
+    if start is not None and start < bucket_start:
+        edges.append((start, bucket_start, False))
+    if end is not None:
+        edges.append((bucket_end, end, True))
+    return bucket_start, bucket_end, edges
+
+
+def _raw_logs(device, edge):
+    edge_start, edge_end, inclusive_end = edge
+    end_lookup = 'start_time__lte' if inclusive_end else 'start_time__lt'
+    return AppUsageLog.objects.filter(device=device, start_time__gte=edge_start, **{end_lookup: edge_end})
+
+
+def usage_by_app(device, start=None, end=None):
+    """
+    Total usage per app for a device between start and end (inclusive, either
+    may be None for an open window), ordered by total_duration descending.
+
+    Whole days come from AppUsageDailyRollup; only the partial days at the
+    edges of the window touch raw AppUsageLog rows.
+    Returns a list of dicts with app_name, total_duration and session_count.
+    """
+    bucket_start, bucket_end, edges = _split_window(start, end, 'day')
+    totals = defaultdict(lambda: {'total_duration': 0, 'session_count': 0})
+
+    if bucket_start is not None or bucket_end is not None or not edges:
+        rollups = AppUsageDailyRollup.objects.filter(device=device)
+        if bucket_start is not None:
+            rollups = rollups.filter(date__gte=timezone.localtime(bucket_start).date())
+        if bucket_end is not None:
+            rollups = rollups.filter(date__lt=timezone.localtime(bucket_end).date())
+        rows = rollups.values('app_name').annotate(
+            duration=Sum('total_duration'), sessions=Sum('session_count')
+        )
+        for row in rows:
+            totals[row['app_name']]['total_duration'] += row['duration']
+            totals[row['app_name']]['session_count'] += row['sessions']
+
+    for edge in edges:
+        rows = _raw_logs(device, edge).values('app_name').annotate(
+            duration=Sum('duration'), sessions=Count('id')
+        )
+        for row in rows:
+            totals[row['app_name']]['total_duration'] += row['duration']
+            totals[row['app_name']]['session_count'] += row['sessions']
+
+    result = [{'app_name': app_name, **values} for app_name, values in totals.items()]
+    result.sort(key=lambda row: row['total_duration'], reverse=True)
+    return result
+
+
+def usage_by_day(device, start=None, end=None):
+    """
+    Total usage per calendar day for a device between start and end
+    (inclusive, either may be None), ordered by date.
+
+    Whole hours come from HourlyUsageRollup; only the partial hours at the
+    edges of the window touch raw AppUsageLog rows.
+    Returns a list of dicts with date and total_duration.
+    """
+    bucket_start, bucket_end, edges = _split_window(start, end, 'hour')
+    totals = defaultdict(int)
+
+    if bucket_start is not None or bucket_end is not None or not edges:
+        rollups = HourlyUsageRollup.objects.filter(device=device)
+        if bucket_start is not None:
+            rollups = rollups.filter(hour__gte=bucket_start)
+        if bucket_end is not None:
+            rollups = rollups.filter(hour__lt=bucket_end)
+        rows = rollups.annotate(date=TruncDate('hour')).values('date').annotate(
+            duration=Sum('total_duration')
+        )
+        for row in rows:
+            totals[row['date']] += row['duration']
+
+    for edge in edges:
+        rows = _raw_logs(device, edge).annotate(date=TruncDate('start_time')).values('date').annotate(
+            duration=Sum('duration')
+        )
+        for row in rows:
+            totals[row['date']] += row['duration']
+
+    return [{'date': date, 'total_duration': duration} for date, duration in sorted(totals.items())]
+
+
+def usage_summary(device, start=None, end=None):
+    """
+    Per-app and per-day usage for a device between start and end (inclusive,
+    either may be None) from a single grouped query over AppUsageDailyRollup,
+    plus raw AppUsageLog rows for the partial days at the edges of the window.
+
+    Returns a tuple (by_app, by_day) shaped like usage_by_app() and
+    usage_by_day().
+    """
+    bucket_start, bucket_end, edges = _split_window(start, end, 'day')
+    rows = []
+
+    if bucket_start is not None or bucket_end is not None or not edges:
+        rollups = AppUsageDailyRollup.objects.filter(device=device)
+        if bucket_start is not None:
+            rollups = rollups.filter(date__gte=timezone.localtime(bucket_start).date())
+        if bucket_end is not None:
+            rollups = rollups.filter(date__lt=timezone.localtime(bucket_end).date())
+        rows.extend(rollups.values_list('app_name', 'date', 'total_duration', 'session_count'))
+
+    for edge in edges:
+        rows.extend(
+            _raw_logs(device, edge).annotate(date=TruncDate('start_time'))
+            .values('app_name', 'date')
+            .annotate(duration=Sum('duration'), sessions=Count('id'))
+            .values_list('app_name', 'date', 'duration', 'sessions')
+        )
+
+    apps = defaultdict(lambda: {'total_duration': 0, 'session_count': 0})
+    days = defaultdict(int)
+    for app_name, date, duration, sessions in rows:
+        apps[app_name]['total_duration'] += duration
+        apps[app_name]['session_count'] += sessions
+        days[date] += duration
+
+    by_app = [{'app_name': app_name, **values} for app_name, values in apps.items()]
+    by_app.sort(key=lambda row: row['total_duration'], reverse=True)
+    by_day = [{'date': date, 'total_duration': duration} for date, duration in sorted(days.items())]
+    return by_app, by_day
+
+
+def _domain_rollups(device, start_date=None, end_date=None):
+    rollups = DomainDailyRollup.objects.filter(device=device)
+    if start_date is not None:
+        rollups = rollups.filter(date__gte=start_date)
+    if end_date is not None:
+        rollups = rollups.filter(date__lte=end_date)
+    return rollups
+
+
+def top_domains(device, start_date=None, end_date=None, limit=10, blocked=False):
+    """
+    The most visited domains of a device between two dates (inclusive, either
+    may be None), or with blocked=True the most blocked ones. Reads only
+    DomainDailyRollup. Returns dicts with domain, visit_count, blocked_count,
+    first_seen and last_seen.
+    """
+    rollups = _domain_rollups(device, start_date, end_date)
+    order = 'blocked_count' if blocked else 'visit_count'
+    if blocked:
+        rollups = rollups.filter(blocked_count__gt=0)
+    rows = (
+        rollups.values('domain')
+        .annotate(
+            visit_count=Sum('visit_count'),
+            blocked_count=Sum('blocked_count'),
+            first_seen=Min('first_seen'),
+            last_seen=Max('last_seen'),
+        )
+        .order_by(f'-{order}', 'domain')[:limit]
+    )
+    return list(rows)
+
+
+def browsing_by_day(device, start_date=None, end_date=None):
+    """Visits and blocks per day between two dates (inclusive), ordered by date"""
+    return list(
+        _domain_rollups(device, start_date, end_date)
+        .values('date')
+        .annotate(visit_count=Sum('visit_count'), blocked_count=Sum('blocked_count'))
+        .order_by('date')
+    )
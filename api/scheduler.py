@@ -0,0 +1,172 @@
+"""
+Periodic jobs run by `manage.py run_scheduler`.
+
+Each job has a ScheduledJob row holding its next run time and a lease. A
+scheduler instance claims a due job by taking the lease with a conditional
+UPDATE, which only one instance can win, renews the lease while the job
+runs and hands it back with the next run time when it finishes. If an
+instance dies mid-run its lease expires after SCHEDULER_LEASE_SECONDS and
+another one picks the job up, so any number of schedulers can run for
+redundancy.
+
+Every run is recorded as a JobRun with its duration and outcome.
+"""
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import io
+import logging
+import os
+import socket
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import JobRun, ScheduledJob
+
+logger = logging.getLogger(__name__)
+
+# func takes no arguments; what it returns is stored as the run's result
+Job = namedtuple('Job', ['name', 'interval', 'func'])
+
+JOBS = {}
+
+
+def register_job(name, interval, func):
+    """Run func every interval seconds in the scheduler"""
+    JOBS[name] = Job(name, interval, func)
+
+
+def _lease_duration():
+    return timedelta(seconds=getattr(settings, 'SCHEDULER_LEASE_SECONDS', 60))
+
+
+class Scheduler:
+    def __init__(self, jobs, threads=4):
+        self.jobs = dict(jobs)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"[:64]
+        self._pool = ThreadPoolExecutor(max_workers=max(threads, 1), thread_name_prefix='scheduler')
+        self._running = {}
+        for name in self.jobs:
+            ScheduledJob.objects.get_or_create(name=name)
+
+    def tick(self):
+        """Renew the leases of running jobs and start every due job this instance can claim"""
+        self._running = {name: future for name, future in self._running.items() if not future.done()}
+        now = timezone.now()
+        if self._running:
+            ScheduledJob.objects.filter(name__in=list(self._running), lease_owner=self.owner).update(
+                lease_expires_at=now + _lease_duration()
+            )
+        for name, job in self.jobs.items():
+            if name not in self._running and self.claim(job, now):
+                self._running[name] = self._pool.submit(self.run, job)
+        return len(self._running)
+
+    def claim(self, job, now):
+        claimed = ScheduledJob.objects.filter(name=job.name).filter(
+            Q(next_run_at__isnull=True) | Q(next_run_at__lte=now)
+        ).filter(
+            Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lt=now)
+        ).update(lease_owner=self.owner, lease_expires_at=now + _lease_duration())
+        if claimed:
+            # A run left 'running' belongs to an instance whose lease expired
+            JobRun.objects.filter(job__name=job.name, status='running').update(
+                status='failed', finished_at=now, error="Scheduler stopped while running"
+            )
+        return bool(claimed)
+
+    def run(self, job):
+        close_old_connections()
+        try:
+            return self._run(job)
+        except Exception as e:
+            logger.exception(f"Scheduler failed to record job {job.name}: {str(e)}")
+        finally:
+            close_old_connections()
+
+    def _run(self, job):
+        started_at = timezone.now()
+        scheduled = ScheduledJob.objects.get(name=job.name)
+        run = JobRun.objects.create(job=scheduled, owner=self.owner, started_at=started_at)
+        start = time.monotonic()
+        status = 'success'
+        result = error = ''
+        try:
+            outcome = job.func()
+            result = '' if outcome is None else str(outcome)
+        except Exception as e:
+            status = 'failed'
+            error = str(e)
+            logger.exception(f"Scheduled job {job.name} failed: {str(e)}")
+        duration = time.monotonic() - start
+
+        finished_at = timezone.now()
+        JobRun.objects.filter(pk=run.pk).update(
+            status=status, finished_at=finished_at, duration=duration, result=result[:1000], error=error
+        )
+        ScheduledJob.objects.filter(pk=scheduled.pk, lease_owner=self.owner).update(
+            next_run_at=max(started_at + timedelta(seconds=job.interval), finished_at),
+            lease_owner='',
+            lease_expires_at=None,
+            last_started_at=started_at,
+            last_status=status,
+            last_duration=duration,
+        )
+        logger.info(f"Scheduled job {job.name} finished in {duration:.2f}s: {status}")
+        return status
+
+    def shutdown(self):
+        """Wait for running jobs, then release this instance's leases"""
+        self._pool.shutdown(wait=True)
+        ScheduledJob.objects.filter(lease_owner=self.owner).update(lease_owner='', lease_expires_at=None)
+
+
+def prune_job_runs(older_than=None):
+    """Delete finished runs past SCHEDULER_RUN_RETENTION_DAYS; returns the number deleted"""
+    if older_than is None:
+        older_than = timezone.now() - timedelta(days=getattr(settings, 'SCHEDULER_RUN_RETENTION_DAYS', 14))
+    deleted, _ = JobRun.objects.filter(started_at__lt=older_than).exclude(status='running').delete()
+    return deleted
+
+
+# Jobs
+
+def check_offline_devices():
+    out = io.StringIO()
+    call_command('check_offline_devices', days=getattr(settings, 'OFFLINE_CHECK_DAYS', 2), stdout=out)
+    lines = out.getvalue().strip().splitlines()
+    return lines[-1] if lines else ''
+
+
+def send_queued_email():
+    # Also covers retries, which the web process only drains when new mail is queued
+    from parent_ui.outbox import run_outbox
+    return f"{run_outbox()} sent"
+
+
+def run_report_jobs():
+    # Picks up jobs whose worker died or that were queued without an in-process worker
+    from parent_ui.reports import run_pending_jobs
+    return f"{run_pending_jobs()} rendered"
+
+
+def prune_old_records():
+    from parent_ui.events import prune_dashboard_events
+    from parent_ui.outbox import prune_outbox
+    from parent_ui.reports import prune_report_jobs
+    return (
+        f"{prune_dashboard_events()} dashboard events, {prune_outbox()} sent emails, "
+        f"{prune_report_jobs()} report jobs, {prune_job_runs()} job runs deleted"
+    )
+
+
+register_job('check_offline_devices', getattr(settings, 'OFFLINE_CHECK_INTERVAL_SECONDS', 3600), check_offline_devices)
+register_job('send_queued_email', getattr(settings, 'SCHEDULER_EMAIL_INTERVAL_SECONDS', 30), send_queued_email)
+register_job('run_report_jobs', getattr(settings, 'SCHEDULER_REPORT_INTERVAL_SECONDS', 60), run_report_jobs)
+register_job('prune_old_records', getattr(settings, 'SCHEDULER_PRUNE_INTERVAL_SECONDS', 86400), prune_old_records)
@@ -0,0 +1,141 @@
+"""
+Wake-ups for devices parked on the device-sync long-poll.
+
+Waiters register the versions from their cursor with the process-wide hub
+and sleep on an asyncio future. They are woken in two ways:
+
+* rules_changed and sync_requested events on the event bus wake the
+  device's waiters immediately (from other processes too when the bus fans
+  out through the database);
+* a single background thread re-reads the version counters of every parked
+  device in one query each DEVICE_SYNC_POLL_INTERVAL seconds, which picks up
+  changes the bus didn't deliver.
+"""
+from collections import defaultdict
+import asyncio
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+from . import event_bus
+from .device_sync import VERSION_FIELDS
+from .models import ChildDevice
+
+logger = logging.getLogger(__name__)
+
+# Event bus events that should wake a parked device
+WAKE_EVENTS = frozenset(['rules_changed', 'sync_requested'])
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(True)
+
+
+class _Waiter:
+    __slots__ = ('loop', 'future', 'versions')
+
+    def __init__(self, loop, future, versions):
+        self.loop = loop
+        self.future = future
+        self.versions = versions
+
+    def wake(self):
+        # Futures may only be touched from their own event loop
+        try:
+            self.loop.call_soon_threadsafe(_wake, self.future)
+        except RuntimeError:
+            # The loop already closed; the request is gone
+            pass
+
+
+class DeviceSyncHub:
+    def __init__(self, poll_interval):
+        self.poll_interval = poll_interval
+        self._waiters = defaultdict(set)
+        self._lock = threading.Lock()
+        self._poller = None
+        self._subscribed = False
+
+    async def wait(self, device_pk, versions, timeout):
+        """
+        Park until the device's versions differ from versions (a tuple in
+        VERSION_FIELDS order) or notify_device() is called for it.
+        Returns False when timeout seconds pass without either.
+        """
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(loop, loop.create_future(), versions)
+        with self._lock:
+            self._waiters[device_pk].add(waiter)
+            self._ensure_poller()
+        try:
+            await asyncio.wait_for(waiter.future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(device_pk)
+                if waiters is not None:
+                    waiters.discard(waiter)
+                    if not waiters:
+                        del self._waiters[device_pk]
+
+    def notify(self, device_pk):
+        """Wake every waiter of the device in this process; safe from any thread"""
+        with self._lock:
+            waiters = list(self._waiters.get(device_pk, ()))
+        for waiter in waiters:
+            waiter.wake()
+        return len(waiters)
+
+    def parked_count(self):
+        with self._lock:
+            return sum(len(waiters) for waiters in self._waiters.values())
+
+    def _on_event(self, event):
+        if event.kind in WAKE_EVENTS:
+            self.notify(event.data['device_pk'])
+
+    def _ensure_poller(self):
+        # Called with the lock held
+        if not self._subscribed:
+            event_bus.subscribe([event_bus.ALL_TOPICS], self._on_event)
+            self._subscribed = True
+        if self._poller is None or not self._poller.is_alive():
+            self._poller = threading.Thread(target=self._poll_loop, name='device-sync-poller', daemon=True)
+            self._poller.start()
+
+    def _poll_loop(self):
+        stop = threading.Event()
+        try:
+            while not stop.wait(self.poll_interval):
+                with self._lock:
+                    if not self._waiters:
+                        self._poller = None
+                        return
+                    parked = {pk: list(waiters) for pk, waiters in self._waiters.items()}
+                close_old_connections()
+                try:
+                    current = {
+                        row[0]: tuple(row[1:])
+                        for row in ChildDevice.objects.filter(pk__in=parked).values_list('pk', *VERSION_FIELDS)
+                    }
+                except Exception as e:
+                    logger.error(f"Device sync poller failed to read versions: {str(e)}")
+                    continue
+                for pk, waiters in parked.items():
+                    for waiter in waiters:
+                        if current.get(pk) != waiter.versions:
+                            waiter.wake()
+        finally:
+            connection.close()
+
+
+hub = DeviceSyncHub(poll_interval=getattr(settings, 'DEVICE_SYNC_POLL_INTERVAL', 1.0))
+
+
+def notify_device(device_pk):
+    return hub.notify(device_pk)
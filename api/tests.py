@@ -1,3 +1,509 @@
-from django.test import TestCase
+import asyncio
+from collections import defaultdict
+from datetime import datetime, timedelta
+from io import StringIO
+import json
+import random
+import re
+import threading
+import time
+import zlib
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from parent_ui.models import OutboxEmail
+from parental_control_system.asgi import application
+
+from .device_sync import make_cursor
+from .event_bus import EventBus
+from .filter_snapshot import (
+    _read_varint, bloom_contains, collect_rules, current_snapshot, decode_snapshot, snapshot_diff,
+)
+from .ingest import ingest_usage
+from .models import (
+    AppUsageDailyRollup, AppUsageLog, BlockedApp, BlockedURL, BusMessage, ChildDevice, CustomUser,
+    DeviceContentFilter, DeviceOfflineNotification, HourlyUsageRollup, WhitelistedURL,
+)
+from .presence import flush_heartbeats
+from .rollups import rebuild_usage_rollups, usage_by_app, usage_by_day
+from .url_filter import UrlMatcher, normalize_domain, normalize_url
+
+
+def make_parent(username='parent'):
+    user = CustomUser.objects.create_user(
+        username=username, password='x', email=f'{username}@example.com', is_parent=True, is_email_verified=True
+    )
+    user.is_active = True
+    user.save()
+    return user
+
+
+async def asgi_get(path, query='', token=None):
+    """GET path through the project's ASGI application; returns (status, body)"""
+    headers = [(b'host', b'testserver')]
+    if token:
+        headers.append((b'authorization', f'Bearer {token}'.encode()))
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'root_path': '', 'query_string': query.encode(), 'headers': headers,
+        'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+    }
+    received = False
+    messages = []
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # The client stays connected
+        await asyncio.Event().wait()
+
+    async def send(message):
+        messages.append(message)
+
+    await application(scope, receive, send)
+    status = next(message['status'] for message in messages if message['type'] == 'http.response.start')
+    body = b''.join(message.get('body', b'') for message in messages if message['type'] == 'http.response.body')
+    return status, body
+
+
+def usage_entry(app_name, start_time, seconds):
+    return {
+        'app_name': app_name,
+        'start_time': start_time.isoformat(),
+        'end_time': (start_time + timedelta(seconds=seconds)).isoformat(),
+    }
+
+
+def naive_match(rules, whitelist, url):
+    """
+    Reference for UrlMatcher.match(): try every pattern against url in turn.
+    Returns (blocked, reason, block_type).
+    """
+    key, host = normalize_url(url), normalize_domain(url)
+    for pattern in whitelist:
+        entry = normalize_url(pattern)
+        if entry.startswith('*.'):
+            entry = entry[2:]
+        if '/' in entry or '?' in entry:
+            if key == entry:
+                return False, 'whitelist', None
+        elif entry and (host == entry or host.endswith('.' + entry)):
+            return False, 'whitelist', None
+
+    checks = {
+        'exact': lambda pattern: key == normalize_url(pattern),
+        'domain': lambda pattern: bool(normalize_domain(pattern)) and (
+            host == normalize_domain(pattern) or host.endswith('.' + normalize_domain(pattern))
+        ),
+        'keyword': lambda pattern: bool(pattern.strip()) and pattern.strip().lower() in url.lower(),
+        'regex': lambda pattern: re.search(pattern, url, re.IGNORECASE) is not None,
+    }
+    # UrlMatcher's precedence between rule types
+    for block_type in ('exact', 'domain', 'keyword', 'regex'):
+        for _, pattern, rule_type, _ in rules:
+            if rule_type == block_type and checks[block_type](pattern):
+                return True, 'rule', block_type
+    return False, None, None
+
+
+class UrlMatcherTests(SimpleTestCase):
+    # Labels and paths in which the keywords overlap
+    LABELS = ('a', 'b', 'ab', 'ba', 'www', 'm', 'aab', 'babab', 'aabab')
+    KEYWORDS = ('ab', 'ba', 'bab', 'abab', 'aab', 'b/a', 'x?q', ' AB ')
+    REGEXES = (r'b+a\.', r'\.org/x', r'^https://', r'(a)b\1', r'm\.[ab]+\.com', r'q=\d')
+    PATHS = ('', '/', '/x', '/ab', '/a/b', '/X/', '?q=1', '/x?q=ab', '/abaab', '/bb/a')
+
+    def random_host(self, rng):
+        labels = [rng.choice(self.LABELS) for _ in range(rng.randint(1, 3))]
+        return '.'.join(labels + [rng.choice(('com', 'org'))])
+
+    def random_url(self, rng):
+        scheme = rng.choice(('', 'http://', 'https://', 'HTTPS://'))
+        return scheme + self.random_host(rng) + rng.choice(self.PATHS)
+
+    def random_rules(self, rng):
+        rules = []
+        for rule_id in range(rng.randint(0, 12)):
+            block_type = rng.choice(('exact', 'domain', 'keyword', 'regex'))
+            if block_type == 'exact':
+                pattern = self.random_url(rng)
+            elif block_type == 'domain':
+                pattern = rng.choice(('', '*.', 'https://')) + self.random_host(rng)
+            elif block_type == 'keyword':
+                pattern = rng.choice(self.KEYWORDS)
+            else:
+                pattern = rng.choice(self.REGEXES)
+            rules.append((rule_id, pattern, block_type, 'other'))
+        return rules
+
+    def test_matches_naive_reference(self):
+        rng = random.Random(2024)
+        for _ in range(200):
+            rules = self.random_rules(rng)
+            whitelist = [rng.choice((self.random_host(rng), self.random_url(rng))) for _ in range(rng.randint(0, 2))]
+            matcher = UrlMatcher(rules, whitelist)
+            for _ in range(50):
+                url = self.random_url(rng)
+                result = matcher.match(url)
+                self.assertEqual(
+                    (result.blocked, result.reason, result.block_type), naive_match(rules, whitelist, url),
+                    f"{url} against {rules}, whitelist {whitelist}",
+                )
+
+    def test_filter_settings(self):
+        rules = [(1, 'ab.com', 'domain', 'social')]
+        self.assertEqual(UrlMatcher(rules, enabled=False).match('ab.com').reason, 'filter_disabled')
+        strict = UrlMatcher(rules, strict_mode=True)
+        self.assertEqual(strict.match('ba.org').reason, 'strict_mode')
+        self.assertEqual(strict.match('www.google.com').reason, None)
+        self.assertEqual(strict.match('ab.com').reason, 'rule')
+        self.assertEqual(UrlMatcher(rules, strict_mode=True, allow_search_engines=False).match('google.com').reason,
+                         'strict_mode')
+
+
+class FilterSnapshotTests(TestCase):
+    def setUp(self):
+        self.device = ChildDevice.objects.create(parent=make_parent(), device_id='dev1')
+        for pattern, block_type in [
+            ('https://www.Facebook.com/', 'domain'), ('*.tiktok.com', 'domain'), ('facebook.com', 'domain'),
+            ('twitter.com', 'domain'), ('Example.com/Page?x=1', 'exact'), (' Casino ', 'keyword'),
+            (r'bet\d+', 'regex'),
+        ]:
+            BlockedURL.objects.create(device=self.device, url_pattern=pattern, block_type=block_type)
+        BlockedURL.objects.create(device=self.device, url_pattern='off.com', block_type='domain', is_active=False)
+        WhitelistedURL.objects.create(device=self.device, url_pattern='*.help.facebook.com')
+
+    def snapshot(self):
+        self.device.refresh_from_db()
+        return current_snapshot(self.device)
+
+    def test_round_trip(self):
+        rules = collect_rules(self.device)
+        self.assertEqual(rules['domains'], ['com.facebook', 'com.facebook.www', 'com.tiktok', 'com.twitter'])
+        self.assertEqual(rules['exact'], ['example.com/page?x=1'])
+        self.assertEqual(rules['keywords'], ['casino'])
+        self.assertEqual(rules['whitelist'], ['help.facebook.com'])
+
+        snapshot = self.snapshot()
+        self.assertEqual(decode_snapshot(snapshot.data), rules)
+        # Unchanged rules reuse the stored snapshot
+        self.assertEqual(self.snapshot().pk, snapshot.pk)
+
+    def test_bloom_filter_holds_every_domain(self):
+        data = zlib.decompress(self.snapshot().data)
+        bits, offset = _read_varint(data, 6)
+        hashes = data[offset]
+        array = data[offset + 1:offset + 1 + (bits + 7) // 8]
+        for domain in collect_rules(self.device)['domains']:
+            self.assertTrue(bloom_contains(bits, hashes, array, domain))
+        misses = sum(bloom_contains(bits, hashes, array, f'com.unknown{i}') for i in range(1000))
+        self.assertLess(misses, 50)
+
+    def test_diff_applied_to_base_gives_current_rules(self):
+        base = self.snapshot()
+        BlockedURL.objects.filter(url_pattern='twitter.com').delete()
+        BlockedURL.objects.create(device=self.device, url_pattern='reddit.com', block_type='domain')
+        BlockedURL.objects.create(device=self.device, url_pattern='poker', block_type='keyword')
+        rule = BlockedURL.objects.get(url_pattern='off.com')
+        rule.is_active = True
+        rule.save()
+        DeviceContentFilter.objects.create(device=self.device, strict_mode=True, whitelist_enabled=True)
+        current = self.snapshot()
+        self.assertNotEqual(current.digest, base.digest)
+
+        diff = snapshot_diff(self.device, base.digest, current)
+        self.assertEqual(diff['added']['domains'], ['com.off', 'com.reddit'])
+        self.assertEqual(diff['removed']['domains'], ['com.twitter'])
+        self.assertEqual(diff['added']['keywords'], ['poker'])
+
+        applied = decode_snapshot(base.data)
+        for name, added in diff['added'].items():
+            applied[name] = sorted(set(applied[name]) - set(diff['removed'][name]) | set(added))
+        applied['flags'] = diff['flags']
+        self.assertEqual(applied, decode_snapshot(current.data))
+
+    def test_diff_from_unknown_base(self):
+        self.assertIsNone(snapshot_diff(self.device, 'f' * 64, self.snapshot()))
+
+    def test_rules_changed_back_bring_the_old_snapshot_forward(self):
+        base = self.snapshot()
+        rule = BlockedURL.objects.create(device=self.device, url_pattern='reddit.com', block_type='domain')
+        self.assertNotEqual(self.snapshot().digest, base.digest)
+        rule.delete()
+        self.assertEqual(self.snapshot().pk, base.pk)
+
+
+class UsageIngestTests(TestCase):
+    def setUp(self):
+        self.device = ChildDevice.objects.create(parent=make_parent(), device_id='dev1')
+        self.start = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=3)
+
+    def rollup_total(self):
+        return sum(AppUsageDailyRollup.objects.filter(device=self.device).values_list('total_duration', flat=True))
+
+    def test_session_inserted_concurrently_is_not_counted_twice(self):
+        # A concurrent retry inserted this session between our validation and insert
+        AppUsageLog.objects.bulk_create([AppUsageLog(
+            device=self.device, app_name='Chrome', start_time=self.start,
+            end_time=self.start + timedelta(seconds=600), duration=600,
+        )])
+        result = ingest_usage(self.device, [
+            usage_entry('Chrome', self.start, 600),
+            usage_entry('Maps', self.start, 300),
+        ])
+        self.assertEqual((result['inserted_entries'], result['duplicate_entries']), (1, 1))
+        self.assertEqual(self.rollup_total(), 300)
+        self.assertEqual(AppUsageLog.objects.filter(device=self.device).count(), 2)
+
+    def test_repeated_session_in_one_upload_is_stored_once(self):
+        entry = usage_entry('Chrome', self.start, 600)
+        result = ingest_usage(self.device, [entry, entry])
+        self.assertEqual((result['inserted_entries'], result['duplicate_entries']), (1, 1))
+        self.assertEqual(self.rollup_total(), 600)
+
+    def test_repeated_upload_changes_nothing(self):
+        entries = [usage_entry('Chrome', self.start, 600), usage_entry('Maps', self.start, 300), {'app_name': 'X'}]
+        first = ingest_usage(self.device, entries)
+        self.assertEqual((first['inserted_entries'], first['skipped_entries']), (2, 1))
+
+        second = ingest_usage(self.device, entries)
+        self.assertEqual((second['inserted_entries'], second['duplicate_entries']), (0, 2))
+        self.assertFalse(second['replayed'])
+        self.assertEqual(self.rollup_total(), 900)
+        self.assertEqual(AppUsageLog.objects.filter(device=self.device).count(), 2)
+
+    def test_batch_replay_is_answered_from_the_first_upload(self):
+        entries = [usage_entry('Chrome', self.start, 600), {'app_name': 'X'}]
+        first = ingest_usage(self.device, entries, batch_id='batch-1')
+        # A replay carrying different entries is not looked at again
+        replay = ingest_usage(self.device, entries + [usage_entry('Maps', self.start, 300)], batch_id='batch-1')
+        self.assertTrue(replay['replayed'])
+        self.assertEqual(
+            (replay['total_entries'], replay['valid_entries'], replay['skipped_entries'], replay['inserted_entries']),
+            (first['total_entries'], first['valid_entries'], first['skipped_entries'], 0),
+        )
+        self.assertEqual(self.rollup_total(), 600)
+        self.assertEqual(AppUsageLog.objects.filter(device=self.device).count(), 1)
+
+
+@override_settings(TIME_ZONE='America/New_York')
+class UsageRollupTests(TestCase):
+    """Rollup-backed queries must agree with aggregating the raw logs"""
+
+    def setUp(self):
+        self.device = ChildDevice.objects.create(parent=make_parent(), device_id='dev1')
+        # Around local midnights, on and just off hour boundaries; the
+        # clocks go forward on the second day
+        midnight = timezone.make_aware(datetime(2024, 3, 9))
+        rng = random.Random(7)
+        entries = []
+        for day in range(3):
+            for offset in (-3600, -61, -1, 0, 1, 59 * 60, 3600, 3601, 5 * 3600 + 1799):
+                start = midnight + timedelta(days=day, seconds=offset)
+                for app in rng.sample(['Chrome', 'Maps', 'YouTube'], rng.randint(1, 3)):
+                    entries.append(usage_entry(app, start, rng.randint(1, 3000)))
+        # Several uploads, the last one repeating part of the first
+        ingest_usage(self.device, entries[:30])
+        ingest_usage(self.device, entries[20:])
+        self.midnight = midnight
+
+    def naive_by_app(self, start, end):
+        totals = defaultdict(lambda: {'total_duration': 0, 'session_count': 0})
+        for log in self.raw_logs(start, end):
+            totals[log.app_name]['total_duration'] += log.duration
+            totals[log.app_name]['session_count'] += 1
+        return {app_name: dict(values) for app_name, values in totals.items()}
+
+    def naive_by_day(self, start, end):
+        totals = defaultdict(int)
+        for log in self.raw_logs(start, end):
+            totals[timezone.localtime(log.start_time).date()] += log.duration
+        return dict(totals)
+
+    def raw_logs(self, start, end):
+        logs = AppUsageLog.objects.filter(device=self.device)
+        if start is not None:
+            logs = logs.filter(start_time__gte=start)
+        if end is not None:
+            logs = logs.filter(start_time__lte=end)
+        return logs
+
+    def windows(self):
+        midnight = self.midnight
+        yield None, None
+        yield midnight, None
+        yield None, midnight
+        yield midnight, midnight + timedelta(days=1)
+        yield midnight - timedelta(seconds=1), midnight + timedelta(days=1, seconds=1)
+        yield midnight + timedelta(minutes=30), midnight + timedelta(days=1, hours=1)
+        yield midnight + timedelta(hours=1), midnight + timedelta(hours=1, seconds=1)
+        yield midnight + timedelta(seconds=1), midnight + timedelta(minutes=59)
+        yield midnight - timedelta(hours=2, minutes=15), midnight + timedelta(days=2, hours=5, minutes=30)
+
+    def assert_totals_match(self):
+        for start, end in self.windows():
+            with self.subTest(start=start, end=end):
+                by_app = {
+                    row['app_name']: {'total_duration': row['total_duration'], 'session_count': row['session_count']}
+                    for row in usage_by_app(self.device, start, end)
+                }
+                self.assertEqual(by_app, self.naive_by_app(start, end))
+                by_day = {row['date']: row['total_duration'] for row in usage_by_day(self.device, start, end)}
+                self.assertEqual(by_day, self.naive_by_day(start, end))
+
+    def test_rollups_match_raw_logs(self):
+        self.assert_totals_match()
+
+    def test_rebuilt_rollups_match_incremental_ones(self):
+        daily = set(AppUsageDailyRollup.objects.filter(device=self.device).values_list(
+            'app_name', 'date', 'total_duration', 'session_count'
+        ))
+        hourly = set(HourlyUsageRollup.objects.filter(device=self.device).values_list(
+            'hour', 'total_duration', 'session_count'
+        ))
+        rebuild_usage_rollups(self.device)
+        self.assertEqual(set(AppUsageDailyRollup.objects.filter(device=self.device).values_list(
+            'app_name', 'date', 'total_duration', 'session_count'
+        )), daily)
+        self.assertEqual(set(HourlyUsageRollup.objects.filter(device=self.device).values_list(
+            'hour', 'total_duration', 'session_count'
+        )), hourly)
+        self.assert_totals_match()
+
+
+class OfflineNotificationTests(TestCase):
+    def setUp(self):
+        # Heartbeats buffered by earlier tests must not land on this device
+        flush_heartbeats()
+        self.device = ChildDevice.objects.create(parent=make_parent(), device_id='dev1')
+        ChildDevice.objects.filter(pk=self.device.pk).update(last_sync=timezone.now() - timedelta(days=3))
+        online = ChildDevice.objects.create(parent=make_parent('other'), device_id='dev2')
+        ChildDevice.objects.filter(pk=online.pk).update(last_sync=timezone.now())
+
+    def check(self, *args):
+        call_command('check_offline_devices', *args, stdout=StringIO())
+
+    def test_device_is_reported_once(self):
+        self.check()
+        self.check()
+        self.assertEqual(DeviceOfflineNotification.objects.filter(device=self.device).count(), 1)
+        self.assertEqual(DeviceOfflineNotification.objects.count(), 1)
+        self.assertEqual(list(OutboxEmail.objects.values_list('to', flat=True)), [['parent@example.com']])
+        self.device.refresh_from_db()
+        self.assertIsNotNone(self.device.offline_notified_at)
+
+    def test_device_is_reported_again_a_day_later(self):
+        self.check()
+        ChildDevice.objects.filter(pk=self.device.pk).update(
+            offline_notified_at=timezone.now() - timedelta(days=1, minutes=1)
+        )
+        self.check()
+        self.assertEqual(OutboxEmail.objects.count(), 2)
+
+    def test_force_reports_again(self):
+        self.check()
+        self.check('--force')
+        self.assertEqual(DeviceOfflineNotification.objects.filter(device=self.device).count(), 2)
+
+
+class ContentFilterSettingsTests(TestCase):
+    def setUp(self):
+        self.device = ChildDevice.objects.create(parent=make_parent(), device_id='dev1')
+        BlockedURL.objects.create(device=self.device, url_pattern='facebook.com', block_type='domain', category='social')
+        WhitelistedURL.objects.create(device=self.device, url_pattern='help.facebook.com')
+
+    def test_rules_apply_whatever_the_blocked_categories(self):
+        # A filter with no categories selected must not switch the parent's own rules off
+        DeviceContentFilter.objects.create(device=self.device)
+        self.assertTrue(UrlMatcher.for_device(self.device).match('https://www.facebook.com/').blocked)
+        self.assertEqual(collect_rules(self.device)['domains'], ['com.facebook'])
+
+    def test_whitelist_follows_whitelist_enabled(self):
+        self.assertEqual(UrlMatcher.for_device(self.device).match('help.facebook.com').reason, 'whitelist')
+
+        content_filter = DeviceContentFilter.objects.create(device=self.device)
+        self.assertEqual(UrlMatcher.for_device(self.device).match('help.facebook.com').reason, 'rule')
+        self.assertEqual(collect_rules(self.device)['whitelist'], [])
+
+        content_filter.whitelist_enabled = True
+        content_filter.save()
+        self.assertEqual(UrlMatcher.for_device(self.device).match('help.facebook.com').reason, 'whitelist')
+        self.assertEqual(collect_rules(self.device)['whitelist'], ['help.facebook.com'])
+
+
+class DeviceSyncWaitThreadTests(TransactionTestCase):
+    """Parked long-polls must not hold a thread each under ASGI"""
+
+    def setUp(self):
+        self.user = make_parent()
+        self.device = ChildDevice.objects.create(parent=self.user, device_id='dev1')
+        self.device.refresh_from_db()
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+        self.path = f'/api/device-sync/{self.device.device_id}/wait/'
+
+    def test_parked_polls_hold_no_threads(self):
+        polls = 30
+
+        async def scenario():
+            cursor = make_cursor(self.device)
+            # Starts the shared sync thread and the hub's poller
+            await asgi_get(self.path, f'cursor={cursor}&timeout=0', self.token)
+            baseline = threading.active_count()
+
+            tasks = [
+                asyncio.create_task(asgi_get(self.path, f'cursor={cursor}&timeout=10', self.token))
+                for _ in range(polls)
+            ]
+            await asyncio.sleep(1)
+            parked = threading.active_count()
+            self.assertTrue(all(not task.done() for task in tasks))
+
+            await sync_to_async(BlockedApp.objects.create)(device=self.device, app_name='Game', package_name='com.game')
+            results = await asyncio.wait_for(asyncio.gather(*tasks), 10)
+            return baseline, parked, results
+
+        baseline, parked, results = asyncio.run(scenario())
+        self.assertLessEqual(parked, baseline + 1)
+        for status, body in results:
+            self.assertEqual(status, 200)
+            self.assertIn('blocked_apps', json.loads(body)['changed'])
+
+
+class EventBusRelayTests(TransactionTestCase):
+    def setUp(self):
+        self.bus = EventBus(fanout='database', relay_interval=0.05)
+        self.received = []
+        self.bus.subscribe(['topic'], self.received.append)
+
+    def wait_for(self, count):
+        deadline = time.monotonic() + 5
+        while len(self.received) < count and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return sorted(event.data['n'] for event in self.received)
+
+    def test_relay_starts_lazily(self):
+        # A process that only publishes, like a management command, runs no relay
+        self.assertIsNone(self.bus._relay)
+        self.bus.start_relay()
+        self.assertTrue(self.bus._relay.is_alive())
+
+    def test_message_committed_after_a_higher_id_is_delivered(self):
+        self.bus.start_relay()
+        time.sleep(0.3)
+        first = BusMessage.objects.create(topics=['topic'], kind='changed', data={'n': 1}, origin='other')
+        self.assertEqual(self.wait_for(1), [1])
+
+        # Id first.pk + 1 is handed out but commits only after first.pk + 2 was read
+        BusMessage.objects.create(id=first.pk + 2, topics=['topic'], kind='changed', data={'n': 3}, origin='other')
+        self.assertEqual(self.wait_for(2), [1, 3])
+        BusMessage.objects.create(id=first.pk + 1, topics=['topic'], kind='changed', data={'n': 2}, origin='other')
+        self.assertEqual(self.wait_for(3), [1, 2, 3])
+
+        time.sleep(0.3)
+        self.assertEqual(len(self.received), 3)
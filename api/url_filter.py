@@ -0,0 +1,379 @@
+"""
+Compiled URL filtering rules per device.
+
+A device's active BlockedURL rows and its WhitelistedURL overrides are
+compiled once into a UrlMatcher:
+
+* exact rules go into a set of normalized URLs;
+* domain rules into a trie keyed on reversed host labels, so example.com
+  also covers www.example.com;
+* keyword rules into one Aho-Corasick automaton;
+* regex rules into one combined pattern.
+
+Checking a URL walks each structure once, so apart from the regex rules the
+cost depends on the length of the URL and not on how many rules the device
+has. Whitelist entries win over every block rule. The device's
+DeviceContentFilter settings are compiled in as well: a disabled filter
+allows everything, strict mode blocks URLs no rule knows about and the
+whitelist only applies when whitelist_enabled is set (a device without a
+DeviceContentFilter gets its whitelist). Every active rule is enforced
+whatever its category; blocked_categories select category lists, which the
+server has none of, so they are left to the device.
+
+Matchers are cached per process and rebuilt when the device's
+url_rules_version or content_filter_version moves on, which every change to
+its rules or filter settings bumps.
+"""
+from collections import OrderedDict, deque, namedtuple
+import logging
+import re
+import threading
+from urllib.parse import urlsplit
+
+from django.conf import settings
+
+from .models import BlockedURL, DeviceContentFilter, WhitelistedURL
+
+logger = logging.getLogger(__name__)
+
+# reason is 'rule', 'whitelist', 'strict_mode', 'filter_disabled' or None
+# when nothing applied
+UrlMatch = namedtuple('UrlMatch', ['blocked', 'reason', 'rule_id', 'block_type', 'category'])
+
+ALLOWED = UrlMatch(False, None, None, None, None)
+WHITELISTED = UrlMatch(False, 'whitelist', None, None, None)
+FILTER_DISABLED = UrlMatch(False, 'filter_disabled', None, None, None)
+STRICT_MODE_BLOCKED = UrlMatch(True, 'strict_mode', None, None, None)
+
+# Still reachable in strict mode when allow_search_engines is set
+SEARCH_ENGINE_DOMAINS = (
+    'google.com', 'bing.com', 'duckduckgo.com', 'yahoo.com', 'ecosia.org', 'kiddle.co',
+)
+
+# Marks the end of a domain in a trie node; the value is what matched
+_END = ''
+
+
+def _split_url(url):
+    """Return (host, rest) of a URL, with or without a scheme, lowercased"""
+    url = url.strip()
+    if '://' not in url:
+        url = '//' + url
+    try:
+        parts = urlsplit(url)
+        host = (parts.hostname or '').rstrip('.')
+    except ValueError:
+        return '', ''
+    rest = parts.path.rstrip('/')
+    if parts.query:
+        rest += '?' + parts.query
+    return host, rest.lower()
+
+
+def normalize_url(url):
+    """Scheme-less, lowercased form of a URL used for exact matching"""
+    host, rest = _split_url(url)
+    return host + rest
+
+
+def normalize_domain(pattern):
+    """Bare host of a domain rule: no scheme, path, port or leading '*.'"""
+    host, _ = _split_url(pattern)
+    if host.startswith('*.'):
+        host = host[2:]
+    return host
+
+
+class DomainTrie:
+    """Host suffix lookup: a domain matches itself and all its subdomains"""
+
+    def __init__(self):
+        self._root = {}
+
+    def add(self, domain, value):
+        node = self._root
+        for label in reversed(domain.split('.')):
+            node = node.setdefault(label, {})
+        # The first rule for a domain keeps the attribution
+        node.setdefault(_END, value)
+
+    def match(self, host):
+        node = self._root
+        for label in reversed(host.split('.')):
+            node = node.get(label)
+            if node is None:
+                return None
+            if _END in node:
+                return node[_END]
+        return None
+
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton finding the first of many keywords in a text"""
+
+    def __init__(self, keywords):
+        # keywords: iterable of (keyword, value); states are list indexes
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [None]
+        for keyword, value in keywords:
+            state = 0
+            for char in keyword:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(None)
+                    self._goto[state][char] = next_state
+                state = next_state
+            if self._output[state] is None:
+                self._output[state] = value
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                fail = self._goto[fallback].get(char, 0)
+                self._fail[next_state] = fail if fail != next_state else 0
+                # A state also ends every keyword that ends at its fail state
+                if self._output[next_state] is None:
+                    self._output[next_state] = self._output[self._fail[next_state]]
+
+    def __bool__(self):
+        return len(self._goto) > 1
+
+    def search(self, text):
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state] is not None:
+                return output[state]
+        return None
+
+
+_search_engines = DomainTrie()
+for _domain in SEARCH_ENGINE_DOMAINS:
+    _search_engines.add(_domain, True)
+
+
+def filter_options(device):
+    """UrlMatcher keyword arguments from the device's DeviceContentFilter"""
+    # Without a DeviceContentFilter only the device's own rules apply
+    return DeviceContentFilter.objects.filter(device=device).values(
+        'enabled', 'strict_mode', 'allow_search_engines', 'whitelist_enabled'
+    ).first() or {}
+
+
+class UrlMatcher:
+    def __init__(self, rules, whitelist=(), enabled=True, strict_mode=False, allow_search_engines=True,
+                 whitelist_enabled=True):
+        """
+        rules: iterable of (id, url_pattern, block_type, category) for active
+        BlockedURL rows; whitelist: iterable of WhitelistedURL patterns. The
+        keyword arguments mirror DeviceContentFilter.
+        """
+        self.enabled = enabled
+        self.strict_mode = strict_mode
+        self.allow_search_engines = allow_search_engines
+        self.rule_count = 0
+        self._exact = {}
+        self._domains = DomainTrie()
+        self._regexes = []
+        self._combined_regex = None
+        self._regex_groups = {}
+        keywords = []
+
+        for rule_id, pattern, block_type, category in rules:
+            rule = UrlMatch(True, 'rule', rule_id, block_type, category)
+            if block_type == 'exact':
+                self._exact.setdefault(normalize_url(pattern), rule)
+            elif block_type == 'domain':
+                domain = normalize_domain(pattern)
+                if not domain:
+                    continue
+                self._domains.add(domain, rule)
+            elif block_type == 'keyword':
+                keyword = pattern.strip().lower()
+                if not keyword:
+                    continue
+                keywords.append((keyword, rule))
+            elif block_type == 'regex':
+                try:
+                    self._regexes.append((re.compile(pattern, re.IGNORECASE), rule))
+                except re.error:
+                    logger.warning(f"Skipping invalid regex rule {rule_id}: {pattern}")
+                    continue
+            else:
+                continue
+            self.rule_count += 1
+
+        self._keywords = KeywordAutomaton(keywords)
+        self._compile_regexes()
+
+        # Whitelist entries with a path only cover that URL; bare hosts cover
+        # the domain and its subdomains
+        self._whitelist_urls = set()
+        self._whitelist_domains = DomainTrie()
+        for pattern in (whitelist if whitelist_enabled else ()):
+            host, rest = _split_url(pattern)
+            if host.startswith('*.'):
+                host = host[2:]
+            if not host:
+                continue
+            if rest:
+                self._whitelist_urls.add(host + rest)
+            else:
+                self._whitelist_domains.add(host, True)
+
+    def _compile_regexes(self):
+        if len(self._regexes) < 2:
+            return
+        # One alternation, with a named group per rule to tell which matched.
+        # Patterns using their own groups or backreferences can't be merged,
+        # so those keep being tried one at a time.
+        alternatives = []
+        for index, (compiled, rule) in enumerate(self._regexes):
+            if compiled.groups:
+                continue
+            name = f'r{index}'
+            alternatives.append(f'(?P<{name}>{compiled.pattern})')
+            self._regex_groups[name] = rule
+        if len(alternatives) < 2:
+            self._regex_groups = {}
+            return
+        try:
+            self._combined_regex = re.compile('|'.join(alternatives), re.IGNORECASE)
+        except re.error:
+            self._regex_groups = {}
+            return
+        merged = set(self._regex_groups.values())
+        self._regexes = [(compiled, rule) for compiled, rule in self._regexes if rule not in merged]
+
+    def match(self, url):
+        """Return the UrlMatch deciding url under the device's filter settings"""
+        if not self.enabled:
+            return FILTER_DISABLED
+        host, rest = _split_url(url)
+        key = host + rest
+        if key in self._whitelist_urls or (host and self._whitelist_domains.match(host)):
+            return WHITELISTED
+
+        rule = self._exact.get(key)
+        if rule is None and host:
+            rule = self._domains.match(host)
+        if rule is None and self._keywords:
+            rule = self._keywords.search(url.lower())
+        if rule is None and self._combined_regex is not None:
+            found = self._combined_regex.search(url)
+            if found:
+                rule = self._regex_groups[found.lastgroup]
+        if rule is None:
+            for compiled, regex_rule in self._regexes:
+                if compiled.search(url):
+                    rule = regex_rule
+                    break
+        if rule is not None:
+            return rule
+        if self.strict_mode and not (self.allow_search_engines and host and _search_engines.match(host)):
+            return STRICT_MODE_BLOCKED
+        return ALLOWED
+
+    @classmethod
+    def for_device(cls, device):
+        rules = BlockedURL.objects.filter(device=device, is_active=True).order_by('id').values_list(
+            'id', 'url_pattern', 'block_type', 'category'
+        )
+        whitelist = WhitelistedURL.objects.filter(device=device).values_list('url_pattern', flat=True)
+        return cls(rules, whitelist, **filter_options(device))
+
+
+class UrlMatcherCache:
+    """Per-process LRU of compiled matchers keyed by device pk and rule versions"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.builds = 0
+
+    def get(self, device):
+        version = (device.url_rules_version, device.content_filter_version)
+        with self._lock:
+            entry = self._entries.get(device.pk)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(device.pk)
+                self.hits += 1
+                return entry[1]
+
+        # Built outside the lock; two requests racing on the same device
+        # both build it and the last one is kept
+        matcher = UrlMatcher.for_device(device)
+        with self._lock:
+            self.builds += 1
+            self._entries[device.pk] = (version, matcher)
+            self._entries.move_to_end(device.pk)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        logger.debug(f"Compiled {matcher.rule_count} URL rules for device {device.pk} at versions {version}")
+        return matcher
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'builds': self.builds,
+            }
+
+
+_cache = UrlMatcherCache(max_size=getattr(settings, 'URL_MATCHER_CACHE_SIZE', 1000))
+
+
+def get_url_matcher(device):
+    """
+    Return the compiled matcher for device. The device's url_rules_version
+    and content_filter_version decide whether the cached one is still
+    current, so pass a freshly loaded device.
+    """
+    return _cache.get(device)
+
+
+def match_url(device, url):
+    return get_url_matcher(device).match(url)
+
+
+def classify_urls(device, urls):
+    """Return one decision dict per URL, in order; repeated URLs are matched once"""
+    matcher = get_url_matcher(device)
+    matches = {}
+    results = []
+    for url in urls:
+        result = matches.get(url)
+        if result is None:
+            result = matches[url] = matcher.match(url)
+        results.append({
+            'url': url,
+            'action': 'block' if result.blocked else 'allow',
+            'reason': result.reason,
+            'rule_id': result.rule_id,
+            'category': result.category,
+        })
+    return results
+
+
+def url_matcher_cache_stats():
+    return _cache.stats()
@@ -4,6 +4,7 @@ from . import views
 urlpatterns = [
     path('register-device/', views.register_device),
     path('sync-usage/', views.sync_usage),
+    path('sync-url-access/', views.sync_url_access, name='sync_url_access'),
     path('set-screen-time/', views.set_screen_time),
     path('report/<str:device_id>/', views.get_usage_report),
     path('block-app/', views.block_app),
@@ -15,8 +16,14 @@ urlpatterns = [
     path('register/', views.register, name='register'),
 
     path('usage-data/<str:device_id>/', views.UsageDataAPI.as_view(), name='usage_data_api'),
+    path('browsing-data/<str:device_id>/', views.BrowsingDataAPI.as_view(), name='browsing_data_api'),
     path('get-screen-time-rules/<str:device_id>/', views.get_screen_time_rules, name='get_screen_time_rules'),
     path('get_blocked_apps/<str:device_id>/', views.get_blocked_apps, name='get_blocked_apps_api'),
     path('force_sync_blocked_apps/<str:device_id>/', views.force_sync_blocked_apps, name='force_sync_blocked_apps'),
+    path('device-sync/<str:device_id>/', views.device_sync, name='device_sync'),
+    path('device-sync/<str:device_id>/wait/', views.device_sync_wait, name='device_sync_wait'),
+    path('filter-snapshot/<str:device_id>/', views.filter_snapshot, name='filter_snapshot'),
+    path('check-urls/', views.check_urls, name='check_urls'),
+    path('device-status/<str:device_id>/', views.device_status, name='device_status'),
     path('trigger_immediate_sync/<str:device_id>/', views.trigger_immediate_sync, name='trigger_immediate_sync'),
 ]
\ No newline at end of file
@@ -1,62 +1,81 @@
 from datetime import datetime
 import logging
 import requests
+from asgiref.sync import sync_to_async
 from django.core.exceptions import ObjectDoesNotExist
 from django.shortcuts import get_object_or_404, redirect
 from django.contrib import messages
 from django.conf import settings
 from django.utils import timezone
+from django.utils.http import parse_etags, quote_etag
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import AnonymousUser
 from django.db import transaction, DatabaseError
+from django.http import HttpResponse, JsonResponse
 from rest_framework.decorators import api_view, permission_classes, authentication_classes
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework import status
-from rest_framework_simplejwt.authentication import JWTAuthentication
-from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
-from rest_framework_simplejwt.tokens import AccessToken
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken, TokenError
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
     TokenVerifyView
 )
+from . import event_bus
+from .asgi import long_lived
+from .authentication import CachedJWTAuthentication
 from .models import ChildDevice, AppUsageLog, ScreenTimeRule, BlockedApp
 from .serializers import DeviceSerializer, AppUsageSerializer, UserSerializer
+from .device_sync import VERSION_FIELDS, blocked_package_names, build_sync_response, parse_cursor
+from .sync_hub import hub as sync_hub
+from .url_filter import classify_urls
+from .filter_snapshot import current_snapshot, snapshot_diff
+from .ingest import ingest_url_access, ingest_usage
+from .presence import device_presence, last_seen, record_heartbeat
+from .rollups import browsing_by_day, top_domains, usage_summary
 
 logger = logging.getLogger(__name__)
 
-from collections import defaultdict
-from django.db.models import Sum
-from django.db.models.functions import TruncDate
 
 class UsageDataAPI(APIView):
-    authentication_classes = [JWTAuthentication]
+    """
+    Usage chart data for a device.
+
+    Optional query parameters:
+    - from / to: inclusive date window (YYYY-MM-DD); unbounded when omitted
+    - top: only return the N most used apps, the rest is summed as "Other"
+    """
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
 
     def get(self, request, device_id):
         try:
             device = ChildDevice.objects.get(device_id=device_id, parent=request.user)
-            
-            apps = {}
-            logs = AppUsageLog.objects.filter(device=device)
-            
-            for log in logs:
-                apps[log.app_name] = apps.get(log.app_name, 0) + log.duration
-
-            # Now compute screen time per day
-            daily_logs = logs.annotate(date=TruncDate('start_time')) \
-                             .values('date') \
-                             .annotate(total_duration=Sum('duration')) \
-                             .order_by('date')
-            
+
+            try:
+                start, end = parse_date_window(request.query_params.get('from'), request.query_params.get('to'))
+                top = request.query_params.get('top')
+                top = int(top) if top else None
+                if top is not None and top < 1:
+                    raise ValueError("top must be a positive integer")
+            except ValueError as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+            # Both series come from one grouped query over the daily rollups
+            apps, daily_logs = usage_summary(device, start, end)
+
+            if top is not None and len(apps) > top:
+                other = sum(app['total_duration'] for app in apps[top:])
+                apps = apps[:top] + [{'app_name': 'Other', 'total_duration': other}]
+
             daily_labels = [str(entry['date']) for entry in daily_logs]
             daily_data = [round(entry['total_duration'] / 3600, 2) for entry in daily_logs]
 
             return Response({
-                'labels': list(apps.keys()),         # for pie chart
-                'data': [round(v/3600, 2) for v in apps.values()],  # for pie chart
+                'labels': [app['app_name'] for app in apps],         # for pie chart
+                'data': [round(app['total_duration']/3600, 2) for app in apps],  # for pie chart
                 'daily_labels': daily_labels,        # for line chart
                 'daily_data': daily_data,            # for line chart
                 'device': device.device_id
@@ -74,6 +93,65 @@ class UsageDataAPI(APIView):
             )
 
 
+class BrowsingDataAPI(APIView):
+    """
+    Browsing summary for a device, read only from the domain x day rollups.
+
+    Optional query parameters:
+    - from / to: inclusive date window (YYYY-MM-DD); unbounded when omitted
+    - top: how many domains to list (default 10)
+    """
+    authentication_classes = [CachedJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, device_id):
+        try:
+            device = ChildDevice.objects.get(device_id=device_id, parent=request.user)
+        except ChildDevice.DoesNotExist:
+            return Response(
+                {"error": "Device not found or access denied"},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        try:
+            start, end = parse_date_window(request.query_params.get('from'), request.query_params.get('to'))
+            top = int(request.query_params.get('top') or 10)
+            if top < 1:
+                raise ValueError("top must be a positive integer")
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        start_date = timezone.localtime(start).date() if start else None
+        end_date = timezone.localtime(end).date() if end else None
+        return Response({
+            'device': device.device_id,
+            'top_domains': top_domains(device, start_date, end_date, limit=top),
+            'top_blocked_domains': top_domains(device, start_date, end_date, limit=top, blocked=True),
+            'daily': browsing_by_day(device, start_date, end_date),
+        })
+
+
+def parse_date_window(from_value, to_value):
+    """
+    Turn optional 'YYYY-MM-DD' from/to strings into an inclusive (start, end)
+    datetime window. Missing bounds are returned as None.
+    """
+    start = end = None
+    if from_value:
+        try:
+            start = timezone.make_aware(datetime.strptime(from_value, '%Y-%m-%d'))
+        except ValueError:
+            raise ValueError(f"Invalid from date: {from_value} (expected YYYY-MM-DD)")
+    if to_value:
+        try:
+            end = timezone.make_aware(datetime.strptime(to_value, '%Y-%m-%d').replace(hour=23, minute=59, second=59, microsecond=999999))
+        except ValueError:
+            raise ValueError(f"Invalid to date: {to_value} (expected YYYY-MM-DD)")
+    if start and end and start > end:
+        raise ValueError("from date must not be after to date")
+    return start, end
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def register_device(request):
@@ -96,130 +174,51 @@ def register_device(request):
     
 
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def sync_usage(request):
     try:
-        # Log the Authorization header
-        auth_header = request.headers.get('Authorization', '')
-        logger.debug(f"Authorization header: {auth_header}")
-        print(f"Authorization header: {auth_header}")
+        device_id = request.data.get('device_id')
 
-        if auth_header.startswith("Bearer "):
-            token_str = auth_header.split(' ')[1]
-            try:
-                token = AccessToken(token_str)
-                logger.debug(f"Token payload: {token.payload}")
-                print(f"Token payload: {token.payload}")
-            except TokenError as e:
-                logger.error(f"Invalid token format or error: {str(e)}")
-                print(f"Invalid token format or error: {str(e)}")
+        try:
+            device = ChildDevice.objects.get(device_id=device_id, parent=request.user)
+        except ChildDevice.DoesNotExist:
+            return Response({"error": "Device not found"}, status=404)
+
+        usage_data = request.data.get('usage_data', [])
+        if not isinstance(usage_data, list):
+            return Response({"error": "usage_data should be a list"}, status=400)
+
+        batch_id = request.data.get('batch_id')
+        if batch_id is not None:
+            batch_id = str(batch_id).strip()[:64]
+
+        # Validation happens up front; valid sessions are bulk inserted
+        result = ingest_usage(device, usage_data, batch_id=batch_id)
+        error_entries = result['errors']
+
+        response_data = {
+            "status": "synced",
+            "total_entries": result['total_entries'],
+            "valid_entries": result['valid_entries'],
+            "skipped_entries": result['skipped_entries'],
+            "duplicate_entries": result['duplicate_entries'],
+        }
+
+        if result['replayed']:
+            response_data["replayed"] = True
+
+        if error_entries:
+            response_data["errors"] = error_entries[:10]  # Limit to first 10 errors
+            if len(error_entries) > 10:
+                response_data["additional_errors"] = len(error_entries) - 10
+
+        logger.info(f"Sync completed for device {device_id}: {result['inserted_entries']} inserted, "
+                    f"{result['duplicate_entries']} duplicates, {result['skipped_entries']} skipped "
+                    f"out of {result['total_entries']} total entries")
+
+        return Response(response_data)
 
-        device_id = request.data.get('device_id')
-        
-        # Use database transaction for consistency
-        with transaction.atomic():
-            try:
-                device = ChildDevice.objects.select_for_update().get(device_id=device_id, parent=request.user)
-            except ChildDevice.DoesNotExist:
-                return Response({"error": "Device not found"}, status=404)
-
-            usage_data = request.data.get('usage_data', [])
-            if not isinstance(usage_data, list):
-                return Response({"error": "usage_data should be a list"}, status=400)
-
-            valid_entries = 0
-            skipped_entries = 0
-            error_entries = []
-
-            for i, entry in enumerate(usage_data):
-                try:
-                    # Validate required fields
-                    if not entry.get('app_name'):
-                        error_entries.append(f"Entry {i}: Missing app_name")
-                        skipped_entries += 1
-                        continue
-                        
-                    if not entry.get('start_time') or not entry.get('end_time'):
-                        error_entries.append(f"Entry {i}: Missing start_time or end_time")
-                        skipped_entries += 1
-                        continue
-
-                    # Parse timestamps with better error handling
-                    try:
-                        start_time_str = entry.get('start_time')
-                        end_time_str = entry.get('end_time')
-                        
-                        # Handle different timestamp formats
-                        if start_time_str.endswith('Z'):
-                            start_time_str = start_time_str.replace('Z', '+00:00')
-                        if end_time_str.endswith('Z'):
-                            end_time_str = end_time_str.replace('Z', '+00:00')
-                        
-                        start_time = datetime.fromisoformat(start_time_str)
-                        end_time = datetime.fromisoformat(end_time_str)
-                        
-                    except ValueError as e:
-                        error_entries.append(f"Entry {i}: Invalid timestamp format - {str(e)}")
-                        skipped_entries += 1
-                        continue
-                    
-                    # Validate time range with detailed logging
-                    if end_time <= start_time:
-                        logger.warning(f"Entry {i}: Invalid time range - end_time ({end_time}) <= start_time ({start_time}) for app '{entry.get('app_name')}'. Skipping.")
-                        error_entries.append(f"Entry {i}: end_time must be after start_time")
-                        skipped_entries += 1
-                        continue
-                    
-                    # Calculate and validate duration
-                    duration_seconds = (end_time - start_time).total_seconds()
-                    if duration_seconds <= 0:
-                        logger.warning(f"Entry {i}: Invalid duration ({duration_seconds}s) for app '{entry.get('app_name')}'. Skipping.")
-                        error_entries.append(f"Entry {i}: Invalid duration ({duration_seconds}s)")
-                        skipped_entries += 1
-                        continue
-                    
-                    # Additional validation: check for reasonable duration (not more than 24 hours)
-                    if duration_seconds > 86400:  # 24 hours in seconds
-                        logger.warning(f"Entry {i}: Suspiciously long duration ({duration_seconds}s) for app '{entry.get('app_name')}'. Skipping.")
-                        error_entries.append(f"Entry {i}: Duration too long ({duration_seconds}s)")
-                        skipped_entries += 1
-                        continue
-                    
-                    # Create the AppUsageLog instance
-                    app_log = AppUsageLog(
-                        device=device,
-                        app_name=entry.get('app_name'),
-                        start_time=start_time,
-                        end_time=end_time
-                    )
-                    app_log.save()
-                    valid_entries += 1
-                    
-                except Exception as e:
-                    logger.error(f"Entry {i}: Unexpected error - {str(e)}")
-                    error_entries.append(f"Entry {i}: {str(e)}")
-                    skipped_entries += 1
-
-            device.last_sync = datetime.now(timezone.utc)
-            device.save()
-
-            response_data = {
-                "status": "synced",
-                "total_entries": len(usage_data),
-                "valid_entries": valid_entries,
-                "skipped_entries": skipped_entries
-            }
-            
-            if error_entries:
-                response_data["errors"] = error_entries[:10]  # Limit to first 10 errors
-                if len(error_entries) > 10:
-                    response_data["additional_errors"] = len(error_entries) - 10
-            
-            logger.info(f"Sync completed for device {device_id}: {valid_entries} valid, {skipped_entries} skipped out of {len(usage_data)} total entries")
-            
-            return Response(response_data)
-            
     except DatabaseError as e:
         logger.error(f"Database error during sync for device {device_id}: {str(e)}")
         return Response({"error": "Database error occurred"}, status=500)
@@ -228,6 +227,51 @@ def sync_usage(request):
         return Response({"error": str(e)}, status=400)
 
 
+@api_view(['POST'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def sync_url_access(request):
+    """
+    Batched upload of browsing events (URLAccessLog) from a device or proxy.
+    """
+    device_id = request.data.get('device_id')
+    entries = request.data.get('entries', [])
+    if not isinstance(entries, list):
+        return Response({"error": "entries should be a list"}, status=400)
+    max_entries = getattr(settings, 'URL_LOG_MAX_ENTRIES', 5000)
+    if len(entries) > max_entries:
+        return Response({"error": f"At most {max_entries} entries per request"}, status=400)
+
+    try:
+        device = ChildDevice.objects.only(
+            'pk', 'device_id', 'parent', 'last_sync', 'url_rules_version', 'content_filter_version'
+        ).get(device_id=device_id, parent=request.user)
+    except ChildDevice.DoesNotExist:
+        return Response({"error": "Device not found"}, status=404)
+
+    try:
+        result = ingest_url_access(device, entries)
+    except DatabaseError as e:
+        logger.error(f"Database error storing URL access logs for device {device_id}: {str(e)}")
+        return Response({"error": "Database error occurred"}, status=500)
+
+    response_data = {
+        "status": "logged",
+        "total_entries": result['total_entries'],
+        "inserted_entries": result['inserted_entries'],
+        "blocked_entries": result['blocked_entries'],
+        "skipped_entries": result['skipped_entries'],
+    }
+    if result['errors']:
+        response_data["errors"] = result['errors'][:10]  # Limit to first 10 errors
+        if len(result['errors']) > 10:
+            response_data["additional_errors"] = len(result['errors']) - 10
+
+    logger.info(f"Stored {result['inserted_entries']} URL access logs for device {device_id}, "
+                f"{result['skipped_entries']} skipped")
+    return Response(response_data)
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_usage_report(request, device_id):
@@ -501,47 +545,194 @@ def get_screen_time_rules(request, device_id):
 
 
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def device_sync(request, device_id):
+    """
+    Single polling endpoint for Android devices.
+    Pass the cursor from the previous response as ?cursor=; only the sections
+    (blocked_apps, screen_time, url_rules, content_filter) that changed since
+    then are included. Without a valid cursor every section is returned.
+    """
+    try:
+        device = ChildDevice.objects.only('pk', 'device_id', 'parent', 'last_sync', *VERSION_FIELDS).get(
+            device_id=device_id, parent=request.user
+        )
+    except ChildDevice.DoesNotExist:
+        logger.error(f"Device {device_id} not found for user {request.user}")
+        return Response({"error": "Device not found"}, status=404)
+
+    record_heartbeat(device)
+    return Response(build_sync_response(device, request.query_params.get('cursor')))
+
+
+@api_view(['POST'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def check_urls(request):
+    """
+    Allow/block decisions for a batch of URLs visited on a device, e.g. the
+    sub-resources of a page. Evaluated against the device's compiled rules,
+    so a batch costs one device lookup however many URLs it holds.
+    """
+    device_id = request.data.get('device_id')
+    urls = request.data.get('urls')
+    if not isinstance(urls, list) or not all(isinstance(url, str) for url in urls):
+        return Response({"error": "urls should be a list of strings"}, status=400)
+    max_urls = getattr(settings, 'URL_CHECK_MAX_URLS', 500)
+    if len(urls) > max_urls:
+        return Response({"error": f"At most {max_urls} urls per request"}, status=400)
+
+    try:
+        device = ChildDevice.objects.only('pk', 'device_id', 'url_rules_version', 'content_filter_version').get(
+            device_id=device_id, parent=request.user
+        )
+    except ChildDevice.DoesNotExist:
+        return Response({"error": "Device not found"}, status=404)
+
+    return Response({
+        "device_id": device.device_id,
+        "results": classify_urls(device, urls),
+    })
+
+
+@api_view(['GET'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def filter_snapshot(request, device_id):
+    """
+    The device's URL filter rules as a compact binary snapshot (format in
+    api.filter_snapshot). The ETag is the snapshot digest: If-None-Match
+    with it answers 304, and ?since=<digest> of an earlier snapshot answers
+    with a JSON diff when that snapshot is still kept.
+    """
+    try:
+        device = ChildDevice.objects.only('pk', 'url_rules_version', 'content_filter_version').get(
+            device_id=device_id, parent=request.user
+        )
+    except ChildDevice.DoesNotExist:
+        return Response({"error": "Device not found"}, status=404)
+
+    snapshot = current_snapshot(device)
+    etag = quote_etag(snapshot.digest)
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        client_etags = parse_etags(if_none_match)
+        if '*' in client_etags or etag in client_etags or f'W/{etag}' in client_etags:
+            response = HttpResponse(status=304)
+            response['ETag'] = etag
+            response['Cache-Control'] = 'private, no-cache'
+            return response
+
+    since = request.query_params.get('since')
+    diff = snapshot_diff(device, since, snapshot) if since and since != snapshot.digest else None
+    if diff is not None:
+        response = Response(diff)
+    else:
+        response = HttpResponse(bytes(snapshot.data), content_type='application/octet-stream')
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def _authenticate_jwt(request):
+    """Return the user of the request's JWT, or None when it is missing or invalid"""
+    try:
+        result = CachedJWTAuthentication().authenticate(request)
+    except (AuthenticationFailed, InvalidToken, TokenError):
+        return None
+    return result[0] if result else None
+
+
+def _load_sync_device(user, device_id):
+    return ChildDevice.objects.only('pk', 'device_id', *VERSION_FIELDS).filter(
+        device_id=device_id, parent=user
+    ).first()
+
+
+@long_lived
+async def device_sync_wait(request, device_id):
+    """
+    Long-poll variant of device_sync, meant to be served over ASGI.
+    With a valid ?cursor= the request is held for up to ?timeout= seconds
+    (capped by DEVICE_SYNC_WAIT_MAX_SECONDS) until one of the device's
+    sections changes, then answers exactly like device_sync. A timeout
+    returns the same cursor with no changes.
+    """
+    if request.method != 'GET':
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+    user = await sync_to_async(_authenticate_jwt)(request)
+    if user is None:
+        return JsonResponse({"error": "Authentication credentials were not provided or are invalid"}, status=401)
+
+    device = await sync_to_async(_load_sync_device)(user, device_id)
+    if device is None:
+        return JsonResponse({"error": "Device not found"}, status=404)
+
+    cursor = request.GET.get('cursor')
+    known_versions = parse_cursor(device, cursor)
+    current = tuple(getattr(device, field) for field in VERSION_FIELDS)
+    if known_versions is not None and tuple(known_versions[field] for field in VERSION_FIELDS) == current:
+        max_timeout = getattr(settings, 'DEVICE_SYNC_WAIT_MAX_SECONDS', 30)
+        try:
+            timeout = min(float(request.GET.get('timeout', max_timeout)), max_timeout)
+        except ValueError:
+            timeout = max_timeout
+
+        if not await sync_hub.wait(device.pk, current, max(timeout, 0)):
+            return JsonResponse({'cursor': cursor, 'full_sync': False, 'changed': []})
+        device = await sync_to_async(_load_sync_device)(user, device_id)
+        if device is None:
+            return JsonResponse({"error": "Device not found"}, status=404)
+
+    return JsonResponse(await sync_to_async(build_sync_response)(device, cursor))
+
+
+@api_view(['GET'])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def get_blocked_apps(request, device_id):
     """
     API endpoint for Android app to get list of blocked apps for a device.
     Returns package names so the Android app can block them correctly.
+
+    Responses carry an ETag derived from the device's blocked_apps_version;
+    a poll that sends it back in If-None-Match gets an empty 304 while the
+    list is unchanged, without BlockedApp being queried.
     """
-    # Log request information for debugging
-    logger.info(f"get_blocked_apps called for device_id: {device_id}")
-    logger.info(f"Request headers: {request.headers}")
-    logger.info(f"Authenticated user: {request.user}")
-    
-    # Print to console for immediate feedback
-    print(f"get_blocked_apps: Request received for device_id={device_id}")
-    print(f"get_blocked_apps: Authorization header: {request.headers.get('Authorization', 'None')}")
-    
+    logger.debug(f"get_blocked_apps called for device_id: {device_id} by {request.user}")
+
     try:
         # Get device for the authenticated user
-        device = ChildDevice.objects.get(device_id=device_id, parent=request.user)
-        
-        # Get all active blocked apps for this device
-        blocked_apps = BlockedApp.objects.filter(device=device, is_active=True)
-        
-        # Extract package names - prioritize package_name over app_name
-        package_names = []
-        for app in blocked_apps:
-            if app.package_name and app.package_name.strip():
-                # Use package name if available (this is what Android needs)
-                package_names.append(app.package_name.strip())
-            else:
-                # Fallback to app name if no package name available
-                package_names.append(app.app_name)
-        
+        device = ChildDevice.objects.only('pk', 'blocked_apps_version').get(
+            device_id=device_id, parent=request.user
+        )
+
+        etag = quote_etag(f"{device.pk}-{device.blocked_apps_version}")
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match:
+            client_etags = parse_etags(if_none_match)
+            if '*' in client_etags or etag in client_etags or f'W/{etag}' in client_etags:
+                response = Response(status=304)
+                response['ETag'] = etag
+                response['Cache-Control'] = 'private, no-cache'
+                return response
+
+        # Package names of the active blocked apps (what Android needs)
+        package_names = blocked_package_names(device)
+
         logger.info(f"Returning blocked apps for device {device_id}: {package_names}")
-        
-        return Response({
+
+        response = Response({
             'blocked_apps': package_names,
             'device_id': device_id,
             'total_count': len(package_names)
         })
-        
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
     except ChildDevice.DoesNotExist:
         logger.error(f"Device {device_id} not found for user {request.user}")
         return Response({"error": "Device not found"}, status=404)
@@ -577,9 +768,7 @@ def force_sync_blocked_apps(request, device_id):
         blocked_apps.update(last_synced=timezone.now())
         
         logger.info(f"Force sync: Returning {len(package_names)} blocked apps for device {device_id}")
-        
-        # Log to the console for immediate feedback
-        print(f"Force sync: Device {device_id} - Blocked apps: {package_names}")
+        logger.debug(f"Force sync: Device {device_id} - Blocked apps: {package_names}")
 
         return Response({
             'status': 'success',
@@ -613,8 +802,13 @@ def trigger_immediate_sync(request, device_id):
         
         logger.info(f"Triggering immediate sync for device {device_id}, action: {action}, app: {app_name}")
         
-        # For now, just log the trigger since we're using polling
-        # In a real FCM implementation, you would send a push notification here
+        # Wake the device if it is parked on the device-sync long-poll
+        event_bus.publish(
+            'sync_requested',
+            [event_bus.device_topic(device.pk), event_bus.parent_topic(device.parent_id)],
+            device_pk=device.pk,
+            action=action,
+        )
         
         return Response({
             'status': 'success',
@@ -636,29 +830,29 @@ def device_status(request, device_id):
     """
     Handle device status requests - used as keep-alive and status check.
     GET: Returns device status information
-    POST: Updates device status (last seen, etc.)
+    POST: Heartbeat; noted in the write-behind buffer, not written right away
     """
     try:
         # Get device for the authenticated user (parent)
-        device = ChildDevice.objects.get(device_id=device_id, parent=request.user)
+        device = ChildDevice.objects.only('pk', 'device_id', 'nickname', 'parent', 'last_sync').get(
+            device_id=device_id, parent=request.user
+        )
         
         if request.method == 'GET':
             # Return device status information
+            seen_at = last_seen(device)
             return Response({
                 'status': 'success',
                 'device_id': device_id,
-                'device_name': device.device_name,
-                'last_seen': device.last_seen.isoformat() if device.last_seen else None,
-                'is_active': True,
+                'device_name': device.nickname or device.device_id,
+                'last_seen': seen_at.isoformat() if seen_at else None,
+                'presence': device_presence(device),
                 'timestamp': timezone.now().isoformat()
             })
         
         elif request.method == 'POST':
-            # Update device last seen timestamp
-            device.last_seen = timezone.now()
-            device.save()
-            
-            logger.info(f"Updated device status for {device_id}")
+            record_heartbeat(device)
+            logger.debug(f"Heartbeat from device {device_id}")
             
             return Response({
                 'status': 'success',
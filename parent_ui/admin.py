@@ -1,10 +1,13 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from .app_catalog import app_catalog_cache_stats
 from .models import (
     ParentDashboard,
     Notification,
     AppCategory,
     AppIcon,
-    CustomAppMapping
+    CustomAppMapping,
+    ReportJob,
+    OutboxEmail
 )
 
 @admin.register(ParentDashboard)
@@ -51,6 +54,16 @@ class AppIconAdmin(admin.ModelAdmin):
         }),
     )
 
+    def changelist_view(self, request, extra_context=None):
+        stats = app_catalog_cache_stats()
+        self.message_user(
+            request,
+            f"App catalog cache (this process): {stats['size']}/{stats['max_size']} entries, "
+            f"{stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evictions",
+            level=messages.INFO,
+        )
+        return super().changelist_view(request, extra_context=extra_context)
+
 @admin.register(CustomAppMapping)
 class CustomAppMappingAdmin(admin.ModelAdmin):
     list_display = ('parent', 'package_name', 'custom_name')
@@ -59,3 +72,18 @@ class CustomAppMappingAdmin(admin.ModelAdmin):
     
     class Meta:
         unique_together = ('parent', 'package_name')
+
+
+@admin.register(ReportJob)
+class ReportJobAdmin(admin.ModelAdmin):
+    list_display = ('device', 'parent', 'format', 'status', 'attempts', 'created_at', 'finished_at')
+    list_filter = ('status', 'format', 'created_at')
+    search_fields = ('device__device_id', 'device__nickname', 'parent__username')
+    readonly_fields = ('created_at', 'started_at', 'finished_at')
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'to', 'status', 'attempts', 'created_at', 'sent_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('subject', 'last_error')
+    readonly_fields = ('created_at', 'sent_at', 'claimed_at', 'claim_token')
@@ -0,0 +1,150 @@
+"""
+Process-wide cache of the AppIcon catalog.
+
+The catalog (package name -> friendly name, category, risk level) is global
+and changes rarely, but it is read on every dashboard render and export.
+Entries are kept in an LRU with a TTL; packages that are not in the catalog
+are cached too, since most packages a device reports never will be.
+
+Saving or deleting an AppIcon or AppCategory publishes an event on the event
+bus once the change commits, and every process that receives it clears its
+cache. Without database fan-out only the current process hears it and other
+workers pick the change up when their entries expire, so
+APP_CATALOG_CACHE_TTL bounds how stale they can get.
+"""
+from collections import OrderedDict, namedtuple
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from api.event_bus import publish_on_commit, subscribe
+from .models import AppCategory, AppIcon
+
+logger = logging.getLogger(__name__)
+
+APP_CATALOG_TOPIC = 'app_catalog'
+
+AppInfo = namedtuple('AppInfo', ['package_name', 'friendly_name', 'category', 'color_code', 'risk_level'])
+
+# Cached in place of an AppInfo for packages the catalog doesn't know
+_NOT_IN_CATALOG = object()
+
+
+class AppCatalogCache:
+    """Thread-safe LRU mapping package names to AppInfo, with a TTL per entry"""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get_many(self, package_names):
+        """
+        Return {package_name: AppInfo} for the names in the catalog, loading
+        every name that isn't cached with a single query.
+        """
+        found = {}
+        missing = set()
+        now = time.monotonic()
+        with self._lock:
+            for name in set(package_names):
+                entry = self._entries.get(name)
+                if entry is None or entry[0] <= now:
+                    missing.add(name)
+                    continue
+                self._entries.move_to_end(name)
+                self.hits += 1
+                if entry[1] is not _NOT_IN_CATALOG:
+                    found[name] = entry[1]
+            self.misses += len(missing)
+
+        if missing:
+            loaded = self._load(missing)
+            found.update(loaded)
+            expires = time.monotonic() + self.ttl
+            with self._lock:
+                for name in missing:
+                    self._entries[name] = (expires, loaded.get(name, _NOT_IN_CATALOG))
+                    self._entries.move_to_end(name)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return found
+
+    def _load(self, package_names):
+        rows = AppIcon.objects.filter(package_name__in=package_names).values_list(
+            'package_name', 'friendly_name', 'category__name', 'category__color_code', 'risk_level'
+        )
+        return {row[0]: AppInfo(*row) for row in rows}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+_cache = AppCatalogCache(
+    max_size=getattr(settings, 'APP_CATALOG_CACHE_SIZE', 5000),
+    ttl=getattr(settings, 'APP_CATALOG_CACHE_TTL', 300),
+)
+
+
+def get_app_info(package_name):
+    """Return the AppInfo for package_name, or None if it isn't in the catalog"""
+    return _cache.get_many([package_name]).get(package_name)
+
+
+def get_app_infos(package_names):
+    """Return {package_name: AppInfo} for those of package_names in the catalog"""
+    return _cache.get_many(package_names)
+
+
+def clear_app_catalog_cache():
+    _cache.clear()
+
+
+def app_catalog_cache_stats():
+    """Size, hit/miss and eviction counters of this process's catalog cache"""
+    return _cache.stats()
+
+
+@receiver(post_save, sender=AppIcon)
+@receiver(post_delete, sender=AppIcon)
+@receiver(post_save, sender=AppCategory)
+@receiver(post_delete, sender=AppCategory)
+def invalidate_app_catalog(sender, instance, **kwargs):
+    # Catalog writes are rare; dropping everything also covers renamed
+    # packages and category changes that affect many apps
+    publish_on_commit('app_catalog_changed', [APP_CATALOG_TOPIC], model=sender.__name__, pk=instance.pk)
+
+
+def _on_catalog_changed(event):
+    clear_app_catalog_cache()
+    logger.info(f"App catalog cache cleared after {event.data['model']} {event.data['pk']} changed")
+
+
+# Reaches other processes too when the event bus fans out through the database
+subscribe([APP_CATALOG_TOPIC], _on_catalog_changed)
@@ -0,0 +1,125 @@
+"""
+Friendly display names for Android package names.
+
+A name is resolved from, in order: the parent's CustomAppMapping, the AppIcon
+catalog (through the process-wide cache in app_catalog), the built-in
+APP_NAME_MAPPINGS and finally the package name itself. AppNameResolver loads
+the first two in bulk and memoizes every answer, so a page or export that
+shows the same apps many times only queries once.
+"""
+from .app_catalog import get_app_infos
+from .models import CustomAppMapping
+
+# Common app mappings used when neither the parent nor the catalog names an app
+APP_NAME_MAPPINGS = {
+    # Social Media
+    'com.whatsapp': 'WhatsApp',
+    'com.facebook.katana': 'Facebook',
+    'com.instagram.android': 'Instagram',
+    'com.snapchat.android': 'Snapchat',
+    'com.twitter.android': 'Twitter',
+    'com.discord': 'Discord',
+    'org.telegram.messenger': 'Telegram',
+    'com.zhiliaoapp.musically': 'TikTok',
+    'com.reddit.frontpage': 'Reddit',
+    'com.linkedin.android': 'LinkedIn',
+
+    # Messaging
+    'com.google.android.gm': 'Gmail',
+    'com.microsoft.office.outlook': 'Outlook',
+
+    # Games
+    'com.mojang.minecraftpe': 'Minecraft',
+    'com.roblox.client': 'Roblox',
+    'com.supercell.clashroyale': 'Clash Royale',
+    'com.supercell.clashofclans': 'Clash of Clans',
+    'com.king.candycrushsaga': 'Candy Crush Saga',
+
+    # Other
+    'com.android.chrome': 'Chrome',
+    'com.google.android.youtube': 'YouTube',
+    'com.amazon.mShop.android.shopping': 'Amazon',
+    'com.spotify.music': 'Spotify',
+    'com.netflix.mediaclient': 'Netflix'
+}
+
+
+def format_package_name(package_name):
+    """Turn 'com.example.my_app' into 'My App'"""
+    parts = package_name.split('.')
+    if len(parts) > 1:
+        return parts[-1].replace('_', ' ').title()
+    return package_name
+
+
+class AppNameResolver:
+    """
+    Resolves package names for one parent (or for nobody when user is None).
+    Instances are meant to live for a single request or export; see
+    get_app_name_resolver().
+    """
+
+    def __init__(self, user=None):
+        self.user = user
+        self._custom_names = None
+        self._names = {}
+
+    def _load_custom_names(self):
+        if self._custom_names is None:
+            if getattr(self.user, 'pk', None) is None:
+                self._custom_names = {}
+            else:
+                self._custom_names = dict(
+                    CustomAppMapping.objects.filter(parent=self.user).values_list('package_name', 'custom_name')
+                )
+        return self._custom_names
+
+    def prefetch(self, package_names):
+        """Resolve all package_names not seen yet with at most two queries"""
+        missing = {name for name in package_names if name and name not in self._names}
+        if not missing:
+            return self
+
+        custom_names = self._load_custom_names()
+        catalog_lookup = missing - custom_names.keys()
+        catalog_names = {}
+        if catalog_lookup:
+            catalog_names = {
+                name: info.friendly_name for name, info in get_app_infos(catalog_lookup).items()
+            }
+
+        for name in missing:
+            if name in custom_names:
+                self._names[name] = custom_names[name]
+            elif name in catalog_names:
+                self._names[name] = catalog_names[name]
+            else:
+                self._names[name] = APP_NAME_MAPPINGS.get(name) or format_package_name(name)
+        return self
+
+    def resolve(self, package_name):
+        if not package_name:
+            return package_name
+        if package_name not in self._names:
+            self.prefetch([package_name])
+        return self._names[package_name]
+
+
+def get_app_name_resolver(user=None):
+    """
+    Return the resolver for user, creating it on first use.
+    The resolver is kept on the user instance, which every request loads
+    afresh (or copies from the JWT user cache), so request.user shares one
+    resolver between the view and every friendly_app_name call in its
+    template.
+    """
+    if user is None:
+        return AppNameResolver()
+    resolver = getattr(user, '_app_name_resolver', None)
+    if resolver is None:
+        resolver = AppNameResolver(user)
+        try:
+            user._app_name_resolver = resolver
+        except AttributeError:
+            pass
+    return resolver
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class ParentUiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'parent_ui'
+
+    def ready(self):
+        # Connect the signals that keep the app catalog cache fresh and
+        # record dashboard events
+        from . import app_catalog, events  # noqa: F401
@@ -1,4 +1,3 @@
-from django.core.mail import send_mail
 from django.template.loader import render_to_string
 from django.utils.html import strip_tags
 from django.conf import settings
@@ -8,6 +7,8 @@ from datetime import timedelta
 import uuid
 import logging
 
+from .outbox import enqueue_email
+
 logger = logging.getLogger(__name__)
 
 def send_verification_email(user, request):
@@ -35,21 +36,19 @@ def send_verification_email(user, request):
         html_message = render_to_string('parent_ui/emails/verification_email.html', context)
         plain_message = render_to_string('parent_ui/emails/verification_email.txt', context)
         
-        # Send email
-        send_mail(
+        # Queue the email; the outbox worker delivers it
+        enqueue_email(
             subject='Verify Your Email Address - Parental Control System',
-            message=plain_message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[user.email],
-            html_message=html_message,
-            fail_silently=False,
+            body=plain_message,
+            to=[user.email],
+            html_body=html_message,
         )
         
-        logger.info(f"Verification email sent to {user.email}")
+        logger.info(f"Verification email queued for {user.email}")
         return True
         
     except Exception as e:
-        logger.error(f"Failed to send verification email to {user.email}: {str(e)}")
+        logger.error(f"Failed to queue verification email to {user.email}: {str(e)}")
         return False
 
 def verify_email_token(token):
@@ -124,21 +123,19 @@ def send_device_offline_notification(device, days_offline):
         html_message = render_to_string('parent_ui/emails/device_offline_notification.html', context)
         plain_message = render_to_string('parent_ui/emails/device_offline_notification.txt', context)
         
-        # Send email
-        send_mail(
+        # Queue the email; the outbox worker delivers it
+        enqueue_email(
             subject=f'Device Alert: {device.nickname or device.device_id} has been offline for {days_offline} days',
-            message=plain_message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[parent.email],
-            html_message=html_message,
-            fail_silently=False,
+            body=plain_message,
+            to=[parent.email],
+            html_body=html_message,
         )
         
-        logger.info(f"Offline notification email sent to {parent.email} for device {device.device_id}")
+        logger.info(f"Offline notification email queued for {parent.email} for device {device.device_id}")
         return True
         
     except Exception as e:
-        logger.error(f"Failed to send offline notification email for device {device.device_id}: {str(e)}")
+        logger.error(f"Failed to queue offline notification email for device {device.device_id}: {str(e)}")
         return False
 
 def send_test_offline_notification(user, device=None):
@@ -170,19 +167,17 @@ def send_test_offline_notification(user, device=None):
         html_message = render_to_string('parent_ui/emails/device_offline_notification.html', context)
         plain_message = render_to_string('parent_ui/emails/device_offline_notification.txt', context)
         
-        # Send email with test prefix
-        send_mail(
+        # Queue the email with test prefix; the outbox worker delivers it
+        enqueue_email(
             subject=f'[TEST] Device Alert: {device_name} has been offline for 3 days',
-            message=plain_message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[user.email],
-            html_message=html_message,
-            fail_silently=False,
+            body=plain_message,
+            to=[user.email],
+            html_body=html_message,
         )
         
-        logger.info(f"Test offline notification email sent to {user.email}")
+        logger.info(f"Test offline notification email queued for {user.email}")
         return True
         
     except Exception as e:
-        logger.error(f"Failed to send test offline notification email to {user.email}: {str(e)}")
+        logger.error(f"Failed to queue test offline notification email to {user.email}: {str(e)}")
         return False
@@ -0,0 +1,182 @@
+"""
+Events pushed to the parent dashboard over Server-Sent Events.
+
+Producers call record_event(); every event is a DashboardEvent row, so any
+worker process can serve any parent's stream and a reconnecting browser
+resumes from its Last-Event-ID. Each event is also published on the event
+bus with its full payload, and dashboard_event_stream() is an async
+generator that sends what its bus subscription delivers: an idle stream
+only awaits, holding no thread and running no queries. The database is read
+for the Last-Event-ID replay, for bus events that came without a payload
+and every DASHBOARD_SSE_FALLBACK_SECONDS for events the bus did not deliver
+(other processes without database fan-out).
+"""
+from datetime import timedelta
+import json
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from api.event_bus import parent_topic, publish_on_commit, subscribe
+from api.models import BlockedApp
+from .models import DashboardEvent
+
+logger = logging.getLogger(__name__)
+
+# Most events replayed to a stream that reconnects after a long gap
+MAX_REPLAY_EVENTS = 100
+
+# EventSource reconnect delay, in milliseconds
+RETRY_MILLISECONDS = 2000
+
+
+def _bus_payload(event):
+    return {
+        'id': event.pk,
+        'event_type': event.event_type,
+        'data': event.data,
+        'created_at': event.created_at.isoformat(),
+    }
+
+
+def record_event(parent_id, event_type, device=None, **data):
+    if device is not None:
+        data.setdefault('device_id', device.device_id)
+        data.setdefault('device_name', device.nickname or device.device_id)
+    event = DashboardEvent.objects.create(parent_id=parent_id, device=device, event_type=event_type, data=data)
+    # Sent by the parent's open streams once the row is committed
+    publish_on_commit('dashboard_event', [parent_topic(parent_id)], events=[_bus_payload(event)])
+    return event
+
+
+def record_events(events):
+    """
+    Bulk form of record_event(): events is an iterable of
+    (parent_id, event_type, device, data) tuples, written with one INSERT.
+    """
+    rows = []
+    for parent_id, event_type, device, data in events:
+        if device is not None:
+            data.setdefault('device_id', device.device_id)
+            data.setdefault('device_name', device.nickname or device.device_id)
+        rows.append(DashboardEvent(parent_id=parent_id, device=device, event_type=event_type, data=data))
+    DashboardEvent.objects.bulk_create(rows)
+    by_parent = {}
+    for row in rows:
+        by_parent.setdefault(row.parent_id, []).append(row)
+    for parent_id, parent_rows in by_parent.items():
+        if all(row.pk is not None for row in parent_rows):
+            payload = [_bus_payload(row) for row in parent_rows]
+        else:
+            # Backends that don't return bulk-inserted ids (MySQL): the
+            # streams read the new rows themselves
+            payload = None
+        publish_on_commit('dashboard_event', [parent_topic(parent_id)], events=payload)
+    return rows
+
+
+def prune_dashboard_events(older_than=None):
+    """Delete events past DASHBOARD_EVENT_RETENTION_DAYS; returns the number deleted"""
+    if older_than is None:
+        older_than = timezone.now() - timedelta(days=getattr(settings, 'DASHBOARD_EVENT_RETENTION_DAYS', 7))
+    deleted, _ = DashboardEvent.objects.filter(created_at__lt=older_than).delete()
+    return deleted
+
+
+def _latest_event_id(parent_id):
+    return DashboardEvent.objects.filter(parent_id=parent_id).order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def _events_after(parent_id, last_id):
+    return list(
+        DashboardEvent.objects.filter(parent_id=parent_id, id__gt=last_id)
+        .order_by('id')
+        .values('id', 'event_type', 'data', 'created_at')[:MAX_REPLAY_EVENTS]
+    )
+
+
+def format_sse(event):
+    created_at = event['created_at']
+    if not isinstance(created_at, str):
+        created_at = created_at.isoformat()
+    payload = dict(event['data'], timestamp=created_at)
+    return f"id: {event['id']}\nevent: {event['event_type']}\ndata: {json.dumps(payload)}\n\n"
+
+
+async def dashboard_event_stream(parent_id, last_event_id=None):
+    """
+    Yield SSE frames for a parent: events after last_event_id (or only new
+    ones when it is None), a comment line as heartbeat while idle, and close
+    after DASHBOARD_SSE_MAX_SECONDS so the browser reconnects and resumes.
+    """
+    fallback_interval = getattr(settings, 'DASHBOARD_SSE_FALLBACK_SECONDS', 30)
+    heartbeat_interval = getattr(settings, 'DASHBOARD_SSE_HEARTBEAT_SECONDS', 15)
+    deadline = time.monotonic() + getattr(settings, 'DASHBOARD_SSE_MAX_SECONDS', 300)
+
+    # Subscribed before reading, so an event committed meanwhile is not missed
+    with subscribe([parent_topic(parent_id)]) as subscription:
+        if last_event_id is None:
+            last_event_id = await sync_to_async(_latest_event_id)(parent_id)
+            pending = []
+        else:
+            pending = await sync_to_async(_events_after)(parent_id, last_event_id)
+
+        yield f"retry: {RETRY_MILLISECONDS}\n\n"
+        last_sent = time.monotonic()
+        next_read = last_sent + fallback_interval
+        # Ids above last_event_id already sent: the bus may deliver events
+        # out of id order, so last_event_id only moves on after a read
+        sent = set()
+        read_up_to = pending[-1]['id'] if pending else None
+
+        while True:
+            for event in sorted(pending, key=lambda event: event['id']):
+                if event['id'] > last_event_id and event['id'] not in sent:
+                    yield format_sse(event)
+                    sent.add(event['id'])
+                    last_sent = time.monotonic()
+            if read_up_to is not None and read_up_to > last_event_id:
+                last_event_id = read_up_to
+                sent = {event_id for event_id in sent if event_id > last_event_id}
+
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if now - last_sent >= heartbeat_interval:
+                yield ": heartbeat\n\n"
+                last_sent = now
+
+            dropped = subscription.dropped
+            wait = min(deadline, next_read, last_sent + heartbeat_interval) - now
+            pending = []
+            read_up_to = None
+            must_read = False
+            for bus_event in await subscription.get(timeout=max(wait, 0)):
+                if bus_event.data.get('events') is None:
+                    must_read = True
+                else:
+                    pending.extend(bus_event.data['events'])
+            if must_read or subscription.dropped != dropped or time.monotonic() >= next_read:
+                rows = await sync_to_async(_events_after)(parent_id, last_event_id)
+                pending.extend(rows)
+                read_up_to = rows[-1]['id'] if rows else None
+                next_read = time.monotonic() + fallback_interval
+
+
+@receiver(post_save, sender=BlockedApp)
+def record_app_blocked(sender, instance, created, **kwargs):
+    if not created:
+        return
+    device = instance.device
+    record_event(
+        device.parent_id,
+        'app_blocked',
+        device=device,
+        app_name=instance.app_name,
+        package_name=instance.package_name,
+    )
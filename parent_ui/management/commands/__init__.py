@@ -0,0 +1 @@
+# parent_ui/management/commands/__init__.py
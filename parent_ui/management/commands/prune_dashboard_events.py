@@ -0,0 +1,23 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from parent_ui.events import prune_dashboard_events
+
+
+class Command(BaseCommand):
+    help = 'Delete dashboard events older than the retention period'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=None,
+            help='Keep this many days of events (default: DASHBOARD_EVENT_RETENTION_DAYS)'
+        )
+
+    def handle(self, *args, **options):
+        older_than = None
+        if options['days'] is not None:
+            older_than = timezone.now() - timedelta(days=options['days'])
+        deleted = prune_dashboard_events(older_than)
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} dashboard events."))
@@ -0,0 +1,58 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from parent_ui.outbox import breaker, run_outbox
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Send queued emails from the database-backed outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threads',
+            type=int,
+            default=1,
+            help='Number of threads sending batches in parallel, each over its own connection (default: 1)'
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=2.0,
+            help='Seconds to wait between outbox checks when idle (default: 2)'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Drain the outbox once and exit instead of running forever'
+        )
+
+    def handle(self, *args, **options):
+        threads = max(options['threads'], 1)
+        self.stdout.write(f"Email worker started with {threads} threads")
+
+        with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='email-worker') as pool:
+            while True:
+                # Each thread claims its own batches until the outbox is empty
+                sent = sum(pool.map(lambda _: self.drain(), range(threads)))
+                if sent:
+                    self.stdout.write(self.style.SUCCESS(f"Sent {sent} emails"))
+                if options['once']:
+                    break
+                if not breaker.allow():
+                    # The provider is failing; wait until the breaker lets a trial batch through
+                    time.sleep(max(breaker.retry_after(), options['poll_interval']))
+                elif not sent:
+                    time.sleep(options['poll_interval'])
+
+    def drain(self):
+        close_old_connections()
+        try:
+            return run_outbox()
+        except Exception as e:
+            logger.exception(f"Email worker error: {str(e)}")
+            return 0
+        finally:
+            close_old_connections()
@@ -0,0 +1,55 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from parent_ui.reports import run_pending_jobs
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Render queued report exports (PDF) from the database-backed job queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threads',
+            type=int,
+            default=2,
+            help='Number of worker threads rendering jobs in parallel (default: 2)'
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=2.0,
+            help='Seconds to wait between queue checks when idle (default: 2)'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Drain the queue once and exit instead of running forever'
+        )
+
+    def handle(self, *args, **options):
+        threads = max(options['threads'], 1)
+        self.stdout.write(f"Report worker started with {threads} threads")
+
+        with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='report-worker') as pool:
+            while True:
+                # Each thread claims jobs independently until the queue is empty
+                processed = sum(pool.map(lambda _: self.drain(), range(threads)))
+                if processed:
+                    self.stdout.write(self.style.SUCCESS(f"Rendered {processed} report jobs"))
+                if options['once']:
+                    break
+                if not processed:
+                    time.sleep(options['poll_interval'])
+
+    def drain(self):
+        close_old_connections()
+        try:
+            return run_pending_jobs()
+        except Exception as e:
+            logger.exception(f"Report worker error: {str(e)}")
+            return 0
+        finally:
+            close_old_connections()
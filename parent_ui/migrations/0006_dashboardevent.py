@@ -0,0 +1,31 @@
+# Generated by Django 4.2 on 2026-10-18 08:44
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_childdevice_sync_versions'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('parent_ui', '0005_reportjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DashboardEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_type', models.CharField(choices=[('usage_synced', 'Usage synced'), ('device_offline', 'Device offline'), ('app_blocked', 'App blocked')], max_length=20)),
+                ('data', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('device', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='dashboard_events', to='api.childdevice')),
+                ('parent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dashboard_events', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
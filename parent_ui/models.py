@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from api.models import ChildDevice, CustomUser
 
 class ParentDashboard(models.Model):
@@ -64,4 +65,104 @@ class CustomAppMapping(models.Model):
         unique_together = ('parent', 'package_name')
         
     def __str__(self):
-        return f"{self.package_name} -> {self.custom_name} (for {self.parent.username})"
\ No newline at end of file
+        return f"{self.package_name} -> {self.custom_name} (for {self.parent.username})"
+
+class ReportJob(models.Model):
+    """A queued usage report export, rendered by a background worker"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    FORMAT_CHOICES = [
+        ('pdf', 'PDF'),
+    ]
+
+    parent = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='report_jobs')
+    device = models.ForeignKey(ChildDevice, on_delete=models.CASCADE, related_name='report_jobs')
+    format = models.CharField(max_length=10, choices=FORMAT_CHOICES, default='pdf')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    start_date = models.DateTimeField()
+    end_date = models.DateTimeField()
+    timeframe_description = models.CharField(max_length=100)
+    file_path = models.CharField(max_length=500, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.get_format_display()} report for {self.device} ({self.status})"
+
+    @property
+    def filename(self):
+        return f"{self.device.device_id}_usage_report_{self.timeframe_description.replace(' ', '_')}.{self.format}"
+
+
+class DashboardEvent(models.Model):
+    """
+    Something a parent's open dashboards should hear about. The id doubles as
+    the SSE event id, so a reconnecting stream resumes after Last-Event-ID.
+    """
+    EVENT_TYPE_CHOICES = [
+        ('usage_synced', 'Usage synced'),
+        ('device_offline', 'Device offline'),
+        ('app_blocked', 'App blocked'),
+    ]
+
+    parent = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='dashboard_events')
+    device = models.ForeignKey(ChildDevice, on_delete=models.CASCADE, null=True, blank=True, related_name='dashboard_events')
+    event_type = models.CharField(max_length=20, choices=EVENT_TYPE_CHOICES)
+    data = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return f"{self.get_event_type_display()} for {self.parent} at {self.created_at}"
+
+
+class OutboxEmail(models.Model):
+    """
+    A rendered email waiting to be delivered by parent_ui.outbox. Queued in
+    the caller's transaction, so a message exists exactly when the change
+    that caused it was committed.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=254)
+    to = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claim_token = models.UUIDField(null=True, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} to {', '.join(self.to)} ({self.status})"
@@ -0,0 +1,314 @@
+"""
+Database-backed outbox for outgoing email.
+
+Callers render their message and queue it with enqueue_email(), inside
+their own transaction. Delivery happens elsewhere: a small thread pool in
+the web process (EMAIL_OUTBOX_IN_PROCESS) and/or `manage.py run_email_worker`
+processes claim batches of due messages and send each batch over one SMTP
+connection. Claims work like ReportJob claims, with a conditional UPDATE,
+so any number of workers can drain the same outbox.
+
+Failed messages are retried with exponential backoff up to
+EMAIL_OUTBOX_MAX_ATTEMPTS. When the provider itself is failing (the
+connection can't be opened or drops) a per-process circuit breaker stops
+sending for EMAIL_OUTBOX_BREAKER_RESET_SECONDS and the messages go back to
+the queue without using up an attempt.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import logging
+import smtplib
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+_drain_scheduled = False
+
+# Refusals of a single message; anything else SMTP or network related
+# means the provider, not this message, is the problem
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+
+def is_provider_error(error):
+    return isinstance(error, (smtplib.SMTPException, OSError)) and not isinstance(error, MESSAGE_ERRORS)
+
+
+class CircuitBreaker:
+    """
+    Stops delivery after failure_threshold consecutive provider failures.
+    After reset_timeout seconds one trial batch is let through (half-open);
+    it closes the breaker again on success and re-opens it on failure.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return 'closed'
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                return 'half-open'
+            return 'open'
+
+    def allow(self):
+        return self.state != 'open'
+
+    def retry_after(self):
+        """Seconds until the breaker lets a trial batch through"""
+        with self._lock:
+            if self.opened_at is None:
+                return 0
+            return max(self.reset_timeout - (time.monotonic() - self.opened_at), 0)
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info("Email delivery recovered, circuit breaker closed")
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.error(f"Email provider failed {self.failures} times in a row, pausing delivery")
+                self.opened_at = time.monotonic()
+
+
+breaker = CircuitBreaker(
+    failure_threshold=getattr(settings, 'EMAIL_OUTBOX_BREAKER_THRESHOLD', 5),
+    reset_timeout=getattr(settings, 'EMAIL_OUTBOX_BREAKER_RESET_SECONDS', 60),
+)
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # One thread: a single drain at a time keeps one SMTP connection
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='email-outbox')
+        return _executor
+
+
+def enqueue_email(subject, body, to, html_body='', from_email=None):
+    """Queue one message and return the OutboxEmail row"""
+    return enqueue_emails([{
+        'subject': subject,
+        'body': body,
+        'to': to,
+        'html_body': html_body,
+        'from_email': from_email,
+    }])[0]
+
+
+def enqueue_emails(messages):
+    """
+    Queue many messages with one INSERT. messages is an iterable of dicts
+    with subject, body, to and optionally html_body and from_email.
+    """
+    rows = [
+        OutboxEmail(
+            subject=message['subject'][:255],
+            body=message['body'],
+            html_body=message.get('html_body') or '',
+            from_email=message.get('from_email') or settings.DEFAULT_FROM_EMAIL,
+            to=list(message['to']),
+        )
+        for message in messages
+    ]
+    OutboxEmail.objects.bulk_create(rows)
+    if rows and getattr(settings, 'EMAIL_OUTBOX_IN_PROCESS', True):
+        transaction.on_commit(_schedule_drain)
+    return rows
+
+
+def _schedule_drain():
+    global _drain_scheduled
+    with _executor_lock:
+        if _drain_scheduled:
+            return
+        _drain_scheduled = True
+    _get_executor().submit(_drain_in_thread)
+
+
+def _drain_in_thread():
+    global _drain_scheduled
+    # Cleared before draining, so messages queued meanwhile schedule another run
+    with _executor_lock:
+        _drain_scheduled = False
+    close_old_connections()
+    try:
+        run_outbox()
+    except Exception as e:
+        logger.exception(f"Email outbox thread failed: {str(e)}")
+    finally:
+        close_old_connections()
+
+
+def claim_batch(limit):
+    """
+    Claim up to limit due messages (or ones whose sender died mid-batch) and
+    return them.
+    """
+    now = timezone.now()
+    stale_before = now - timedelta(seconds=getattr(settings, 'EMAIL_OUTBOX_CLAIM_TIMEOUT_SECONDS', 300))
+    candidates = OutboxEmail.objects.filter(
+        Q(status='pending', next_attempt_at__lte=now) | Q(status='sending', claimed_at__lt=stale_before)
+    ).order_by('next_attempt_at', 'id').values_list('pk', flat=True)[:limit]
+
+    token = uuid.uuid4()
+    # Re-checking the status in the UPDATE means a message another worker
+    # claimed in the meantime is skipped rather than sent twice
+    OutboxEmail.objects.filter(pk__in=list(candidates)).filter(
+        Q(status='pending', next_attempt_at__lte=now) | Q(status='sending', claimed_at__lt=stale_before)
+    ).update(status='sending', claim_token=token, claimed_at=now, attempts=F('attempts') + 1)
+    return list(OutboxEmail.objects.filter(claim_token=token, status='sending'))
+
+
+def _backoff(attempts):
+    base = getattr(settings, 'EMAIL_OUTBOX_RETRY_BASE_SECONDS', 30)
+    return timedelta(seconds=min(base * 2 ** (attempts - 1), 3600))
+
+
+def _claimed(messages):
+    """The rows of messages still held by this worker's claim"""
+    return OutboxEmail.objects.filter(
+        pk__in=[message.pk for message in messages], claim_token=messages[0].claim_token if messages else None
+    )
+
+
+def _release(messages, delay):
+    """Put claimed but unsent messages back without using up an attempt"""
+    _claimed(messages).update(
+        status='pending',
+        attempts=F('attempts') - 1,
+        next_attempt_at=timezone.now() + delay,
+        claim_token=None,
+    )
+
+
+def _record_failure(message, error):
+    max_attempts = getattr(settings, 'EMAIL_OUTBOX_MAX_ATTEMPTS', 5)
+    if message.attempts >= max_attempts:
+        logger.error(f"Giving up on email {message.pk} to {message.to} after {message.attempts} attempts: {error}")
+        fields = {'status': 'failed'}
+    else:
+        fields = {'status': 'pending', 'next_attempt_at': timezone.now() + _backoff(message.attempts)}
+    _claimed([message]).update(last_error=str(error)[:1000], claim_token=None, **fields)
+
+
+def _mark_sent(message):
+    """Record a delivered message; False when another worker has taken over its claim"""
+    return bool(_claimed([message]).update(
+        status='sent', sent_at=timezone.now(), claim_token=None, last_error=''
+    ))
+
+
+def deliver_batch(messages):
+    """
+    Send claimed messages over one SMTP connection.
+    Returns (sent, failed); messages left unsent by a provider failure are
+    released back to the queue.
+
+    Each message is marked sent as soon as it is delivered, so a crash
+    mid-batch doesn't send it again, and the claim on the rest of the batch
+    is renewed as the batch goes on, so a slow batch isn't taken for an
+    abandoned one and re-sent by another worker. Every update is guarded by
+    the claim token; once another worker holds the claim this one stops.
+    """
+    # Renewed well within the timeout after which another worker may take over
+    renew_every = getattr(settings, 'EMAIL_OUTBOX_CLAIM_TIMEOUT_SECONDS', 300) / 3
+    renewed_at = time.monotonic()
+
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as e:
+        logger.error(f"Could not connect to the email provider: {str(e)}")
+        breaker.record_failure()
+        _release(messages, timedelta(seconds=breaker.retry_after()))
+        return 0, 0
+
+    sent = 0
+    failed = 0
+    try:
+        for index, message in enumerate(messages):
+            if time.monotonic() - renewed_at >= renew_every:
+                if not _claimed(messages[index:]).update(claimed_at=timezone.now()):
+                    logger.warning(f"Email batch claim {message.claim_token} was taken over; stopping")
+                    break
+                renewed_at = time.monotonic()
+
+            email = EmailMultiAlternatives(
+                subject=message.subject,
+                body=message.body,
+                from_email=message.from_email,
+                to=message.to,
+                connection=connection,
+            )
+            if message.html_body:
+                email.attach_alternative(message.html_body, 'text/html')
+            try:
+                email.send(fail_silently=False)
+            except Exception as e:
+                _record_failure(message, e)
+                if is_provider_error(e):
+                    logger.error(f"Email provider failed while sending: {str(e)}")
+                    breaker.record_failure()
+                    _release(messages[index + 1:], timedelta(seconds=breaker.retry_after()))
+                    break
+                # Rejected recipient or message; retried on its own schedule
+                logger.warning(f"Failed to send email {message.pk} to {message.to}: {str(e)}")
+                failed += 1
+            else:
+                breaker.record_success()
+                sent += 1
+                if not _mark_sent(message):
+                    logger.warning(f"Email {message.pk} was sent after its claim was taken over")
+    finally:
+        try:
+            connection.close()
+        except Exception:
+            pass
+    logger.info(f"Delivered {sent} emails, {failed} failed")
+    return sent, failed
+
+
+def run_outbox(limit=None):
+    """Deliver due messages in batches until none are left; returns the number sent"""
+    batch_size = getattr(settings, 'EMAIL_OUTBOX_BATCH_SIZE', 100)
+    total_sent = 0
+    while breaker.allow() and (limit is None or total_sent < limit):
+        messages = claim_batch(batch_size if limit is None else min(batch_size, limit - total_sent))
+        if not messages:
+            break
+        sent, _ = deliver_batch(messages)
+        total_sent += sent
+    return total_sent
+
+
+def prune_outbox(older_than=None):
+    """Delete sent messages past EMAIL_OUTBOX_RETENTION_DAYS; returns the number deleted"""
+    if older_than is None:
+        older_than = timezone.now() - timedelta(days=getattr(settings, 'EMAIL_OUTBOX_RETENTION_DAYS', 7))
+    deleted, _ = OutboxEmail.objects.filter(status='sent', sent_at__lt=older_than).delete()
+    return deleted
@@ -0,0 +1,219 @@
+"""
+Background rendering of usage report exports.
+
+Exports are queued as ReportJob rows in the database, so no external broker
+is needed. Jobs are claimed with a conditional UPDATE, which lets the web
+process's small thread pool and any number of `manage.py run_report_worker`
+processes drain the same queue without rendering a job twice.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from io import BytesIO
+from pathlib import Path
+import logging
+import threading
+import uuid
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from reportlab.pdfgen import canvas
+
+from api.models import AppUsageLog
+from api.rollups import usage_by_app
+from .app_names import get_app_name_resolver
+from .models import ReportJob
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def render_pdf_report(device, start_date, end_date, timeframe_description):
+    """Render the usage report PDF for a device and return its bytes"""
+    logs = AppUsageLog.objects.filter(
+        device=device,
+        start_time__gte=start_date,
+        start_time__lte=end_date
+    )
+    apps = usage_by_app(device, start_date, end_date)
+    app_names = get_app_name_resolver(device.parent).prefetch(app['app_name'] for app in apps)
+
+    buffer = BytesIO()
+    p = canvas.Canvas(buffer)
+
+    # PDF content
+    p.setFont("Helvetica-Bold", 16)
+    p.drawString(100, 800, f"Device Usage Report: {device.nickname or device.device_id}")
+    p.setFont("Helvetica", 12)
+    p.drawString(100, 780, f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M')}")
+    p.drawString(100, 760, f"Timeframe: {timeframe_description}")
+
+    # Table headers
+    p.drawString(100, 730, "App Name")
+    p.drawString(300, 730, "Start Time")
+    p.drawString(400, 730, "Duration (mins)")
+
+    # Table rows
+    y = 710
+    recent_logs = logs.order_by('-start_time').values_list('app_name', 'start_time', 'duration')[:50]  # Limit to 50 most recent logs
+    for app_name, start_time, duration in recent_logs:
+        friendly_name = app_names.resolve(app_name)
+        p.drawString(100, y, friendly_name)
+        p.drawString(300, y, start_time.strftime('%Y-%m-%d %H:%M'))
+        p.drawString(400, y, f"{round(duration/60, 1)}")
+        y -= 20
+        if y < 50:  # Prevent running off the page
+            p.showPage()
+            y = 750
+
+    # Summary
+    p.showPage()
+    p.setFont("Helvetica-Bold", 14)
+    p.drawString(100, 800, f"Usage Summary ({timeframe_description})")
+
+    total_usage = sum(app['total_duration'] for app in apps)
+    session_count = sum(app['session_count'] for app in apps)
+    p.setFont("Helvetica", 12)
+    p.drawString(100, 770, f"Total screen time: {round(total_usage/3600, 2)} hours")
+    p.drawString(100, 750, f"Number of app sessions: {session_count}")
+
+    # App usage breakdown
+    p.drawString(100, 720, "Top 10 Apps by Usage:")
+    y = 700
+    for app in apps[:10]:  # Top 10 apps
+        hours = app['total_duration'] / 3600
+        friendly_name = app_names.resolve(app['app_name'])
+        p.drawString(100, y, f"• {friendly_name}: {round(hours, 2)} hours")
+        y -= 20
+
+    p.save()
+    return buffer.getvalue()
+
+
+RENDERERS = {
+    'pdf': render_pdf_report,
+}
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'REPORT_WORKER_THREADS', 2),
+                thread_name_prefix='report-worker'
+            )
+        return _executor
+
+
+def enqueue_report(parent, device, start_date, end_date, timeframe_description, format='pdf'):
+    """
+    Queue a report export and return the ReportJob.
+    When REPORT_JOBS_IN_PROCESS is enabled the job is handed to the local
+    thread pool as soon as the surrounding transaction commits.
+    """
+    job = ReportJob.objects.create(
+        parent=parent,
+        device=device,
+        format=format,
+        start_date=start_date,
+        end_date=end_date,
+        timeframe_description=timeframe_description,
+    )
+    logger.info(f"Queued {format} report job {job.pk} for device {device.device_id}")
+
+    if getattr(settings, 'REPORT_JOBS_IN_PROCESS', True):
+        transaction.on_commit(lambda: _get_executor().submit(_run_in_thread, job.pk))
+    return job
+
+
+def claim_job(job_id=None):
+    """
+    Atomically claim a pending job (or a running one whose worker died) and
+    return it, or None when there is nothing to do.
+    """
+    now = timezone.now()
+    stale_before = now - timedelta(seconds=getattr(settings, 'REPORT_JOB_TIMEOUT_SECONDS', 600))
+    max_attempts = getattr(settings, 'REPORT_JOB_MAX_ATTEMPTS', 3)
+
+    # A worker died on the job's last attempt; nothing will retry it
+    ReportJob.objects.filter(
+        status='running', started_at__lt=stale_before, attempts__gte=max_attempts
+    ).update(status='failed', error="Report worker stopped while rendering", finished_at=now)
+
+    candidates = ReportJob.objects.filter(
+        Q(status='pending') | Q(status='running', started_at__lt=stale_before),
+        attempts__lt=max_attempts,
+    ).order_by('created_at')
+    if job_id is not None:
+        candidates = candidates.filter(pk=job_id)
+
+    for job in candidates.only('pk', 'status', 'started_at')[:10]:
+        claimed = ReportJob.objects.filter(
+            pk=job.pk, status=job.status, started_at=job.started_at
+        ).update(status='running', started_at=now, attempts=F('attempts') + 1)
+        if claimed:
+            return ReportJob.objects.select_related('device', 'device__parent').get(pk=job.pk)
+    return None
+
+
+def process_job(job):
+    """Render a claimed job to disk and record the outcome"""
+    try:
+        content = RENDERERS[job.format](job.device, job.start_date, job.end_date, job.timeframe_description)
+
+        reports_root = Path(getattr(settings, 'REPORTS_ROOT', settings.BASE_DIR / 'generated_reports'))
+        reports_root.mkdir(parents=True, exist_ok=True)
+        path = reports_root / f"{job.pk}_{uuid.uuid4().hex}.{job.format}"
+        path.write_bytes(content)
+
+        ReportJob.objects.filter(pk=job.pk).update(
+            status='done', file_path=str(path), error='', finished_at=timezone.now()
+        )
+        logger.info(f"Report job {job.pk} rendered to {path}")
+    except Exception as e:
+        logger.exception(f"Report job {job.pk} failed: {str(e)}")
+        ReportJob.objects.filter(pk=job.pk).update(
+            status='failed', error=str(e), finished_at=timezone.now()
+        )
+
+
+def run_pending_jobs(limit=None):
+    """Drain the queue; returns the number of jobs processed"""
+    processed = 0
+    while limit is None or processed < limit:
+        job = claim_job()
+        if job is None:
+            break
+        process_job(job)
+        processed += 1
+    return processed
+
+
+def prune_report_jobs(older_than=None):
+    """Delete finished jobs past REPORT_RETENTION_DAYS and their files; returns the number deleted"""
+    if older_than is None:
+        older_than = timezone.now() - timedelta(days=getattr(settings, 'REPORT_RETENTION_DAYS', 7))
+    jobs = ReportJob.objects.filter(status__in=['done', 'failed'], finished_at__lt=older_than)
+    for file_path in jobs.exclude(file_path='').values_list('file_path', flat=True):
+        try:
+            Path(file_path).unlink(missing_ok=True)
+        except OSError as e:
+            logger.error(f"Could not delete report file {file_path}: {str(e)}")
+    deleted, _ = jobs.delete()
+    return deleted
+
+
+def _run_in_thread(job_id):
+    close_old_connections()
+    try:
+        job = claim_job(job_id)
+        if job is not None:
+            process_job(job)
+    except Exception as e:
+        logger.exception(f"Report worker thread failed on job {job_id}: {str(e)}")
+    finally:
+        close_old_connections()
@@ -46,50 +46,39 @@ async function fetchWithAuth(url, options = {}) {
     }
 }
 
-// Setup event polling only if authenticated
-function setupEventPolling() {
-    if (!isAuthenticated()) {
-        return; // Don't setup polling if not authenticated
-    }
+// Dashboard event messages shown as toasts
+const DASHBOARD_EVENT_MESSAGES = {
+    usage_synced: data => `${data.device_name} synced ${data.sessions} new app sessions`,
+    device_offline: data => `${data.device_name} has been offline for ${data.time_offline}`,
+    app_blocked: data => `${data.app_name} was blocked on ${data.device_name}`,
+};
 
-    function pollEvents() {
-        const token = getAccessToken();
-        if (!token) return;
-
-        fetchWithAuth(`/events/?token=${token}`)
-            .then(response => {
-                if (!response) return;
-                if (response.ok) {
-                    return response.text().then(text => {
-                        console.log('Raw response:', text);  // 👈 This is what the server sent back
-                        try {
-                            return JSON.parse(text);
-                        } catch (e) {
-                            console.error('Failed to parse JSON:', e);
-                            throw e;
-                        }
-                    });
-                }
-                throw new Error('Network response was not ok');
-            })        
-            .then(data => {
-                if (data) {
-                    // Handle the update data here
-                    console.log('Received update:', data);
-                    // Update your UI components as needed
-                }
-                // Schedule next poll
-                setTimeout(pollEvents, 5000);
-            })
-            .catch(error => {
-                console.error('Polling error:', error);
-                // Retry after a delay
-                setTimeout(pollEvents, 10000);
-            });
+// Subscribe to the server-sent dashboard events. EventSource reconnects on
+// its own and sends Last-Event-ID, so no event is missed across reconnects.
+function setupEventStream() {
+    if (!window.EventSource) {
+        return;
     }
 
-    // Start polling
-    pollEvents();
+    const token = getAccessToken();
+    const url = token ? `/events/?token=${encodeURIComponent(token)}` : '/events/';
+    const source = new EventSource(url);
+
+    Object.keys(DASHBOARD_EVENT_MESSAGES).forEach(eventType => {
+        source.addEventListener(eventType, event => {
+            const data = JSON.parse(event.data);
+            document.dispatchEvent(new CustomEvent('dashboard:' + eventType, { detail: data }));
+            showToast(DASHBOARD_EVENT_MESSAGES[eventType](data), eventType === 'device_offline' ? 'warning' : 'info');
+        });
+    });
+
+    source.onerror = () => {
+        // EventSource retries dropped connections itself; a rejected one
+        // (e.g. expired credentials) is closed for good
+        if (source.readyState === EventSource.CLOSED) {
+            console.error('Dashboard event stream closed');
+        }
+    };
 }
 
 // Enhanced sidebar toggle functionality with desktop and mobile support
@@ -617,9 +606,9 @@ document.addEventListener('DOMContentLoaded', () => {
     // Initialize touch improvements for mobile
     initializeTouchImprovements();
     
-    // Setup event polling if authenticated
+    // Subscribe to dashboard events if authenticated
     if (isAuthenticated()) {
-        setupEventPolling();
+        setupEventStream();
     }
 });
 
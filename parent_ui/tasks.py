@@ -74,6 +74,16 @@ def trigger_immediate_sync(device_id):
     try:
         logger.info(f"Triggering immediate sync for device: {device_id}")
         
+        # Wake the device if it is parked on the device-sync long-poll
+        from api import event_bus
+        from api.models import ChildDevice
+        for device_pk, parent_id in ChildDevice.objects.filter(device_id=device_id).values_list('pk', 'parent_id'):
+            event_bus.publish(
+                'sync_requested',
+                [event_bus.device_topic(device_pk), event_bus.parent_topic(parent_id)],
+                device_pk=device_pk,
+            )
+        
         # In a real implementation with push notifications:
         # if hasattr(settings, 'FCM_SERVER_KEY'):
         #     from pyfcm import FCMNotification
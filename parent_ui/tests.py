@@ -1,3 +1,242 @@
-from django.test import TestCase
+import asyncio
+from datetime import timedelta
+import smtplib
+import threading
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from api.event_bus import parent_topic, publish
+from api.models import AppUsageLog, ChildDevice
+from api.tests import asgi_get, make_parent
+from . import events, outbox, views
+from .events import dashboard_event_stream, record_event
+from .models import DashboardEvent, OutboxEmail
+
+
+@override_settings(DASHBOARD_SSE_FALLBACK_SECONDS=60, DASHBOARD_SSE_HEARTBEAT_SECONDS=60)
+class DashboardEventStreamTests(TransactionTestCase):
+    def setUp(self):
+        self.user = make_parent()
+        self.device = ChildDevice.objects.create(parent=self.user, device_id='dev1')
+
+    def test_new_events_come_from_the_bus_without_queries(self):
+        async def scenario():
+            stream = dashboard_event_stream(self.user.pk)
+            self.assertTrue((await stream.__anext__()).startswith('retry:'))
+            with mock.patch.object(events, '_events_after', wraps=events._events_after) as events_after:
+                # Nothing happens while idle
+                idle = asyncio.ensure_future(stream.__anext__())
+                await asyncio.sleep(0.5)
+                self.assertFalse(idle.done())
+
+                event = await sync_to_async(record_event)(self.user.pk, 'device_offline', device=self.device)
+                frame = await asyncio.wait_for(idle, 5)
+                self.assertEqual(events_after.call_count, 0)
+            await stream.aclose()
+            return event, frame
+
+        event, frame = asyncio.run(scenario())
+        self.assertIn(f'id: {event.pk}\n', frame)
+        self.assertIn('event: device_offline\n', frame)
+        self.assertIn('"device_id": "dev1"', frame)
+
+    def test_replays_events_after_last_event_id(self):
+        first = record_event(self.user.pk, 'usage_synced', device=self.device)
+        second = record_event(self.user.pk, 'app_blocked', device=self.device, app_name='Game')
+
+        async def scenario():
+            stream = dashboard_event_stream(self.user.pk, first.pk)
+            await stream.__anext__()
+            frame = await asyncio.wait_for(stream.__anext__(), 5)
+            await stream.aclose()
+            return frame
+
+        frame = asyncio.run(scenario())
+        self.assertTrue(frame.startswith(f'id: {second.pk}\nevent: app_blocked\n'))
+
+    def test_bus_wake_without_payload_reads_the_database(self):
+        async def scenario():
+            stream = dashboard_event_stream(self.user.pk)
+            await stream.__anext__()
+            pending = asyncio.ensure_future(stream.__anext__())
+            await asyncio.sleep(0.1)
+            # What record_events() publishes on backends without bulk-insert ids
+            event = await sync_to_async(DashboardEvent.objects.create)(
+                parent=self.user, device=self.device, event_type='usage_synced', data={}
+            )
+            publish('dashboard_event', [parent_topic(self.user.pk)], events=None)
+            frame = await asyncio.wait_for(pending, 5)
+            await stream.aclose()
+            return event, frame
+
+        event, frame = asyncio.run(scenario())
+        self.assertTrue(frame.startswith(f'id: {event.pk}\n'))
+
+    @override_settings(DASHBOARD_SSE_MAX_SECONDS=2)
+    def test_open_streams_hold_no_threads(self):
+        token = str(RefreshToken.for_user(self.user).access_token)
+
+        async def scenario():
+            await asgi_get('/events/', f'token={token}')
+            baseline = threading.active_count()
+            tasks = [asyncio.create_task(asgi_get('/events/', f'token={token}')) for _ in range(20)]
+            await asyncio.sleep(1)
+            open_streams = threading.active_count()
+            results = await asyncio.wait_for(asyncio.gather(*tasks), 10)
+            return baseline, open_streams, results
+
+        baseline, open_streams, results = asyncio.run(scenario())
+        self.assertLessEqual(open_streams, baseline + 1)
+        self.assertEqual({status for status, _ in results}, {200})
+
+
+class CsvExportTests(TestCase):
+    def test_detail_rows_are_paged_without_gaps_or_repeats(self):
+        device = ChildDevice.objects.create(parent=make_parent(), device_id='dev1')
+        start = timezone.now().replace(microsecond=0) - timedelta(days=1)
+        logs = []
+        for minute in range(7):
+            # Several sessions share a start time, so pages split inside a tie
+            for app in ('Chrome', 'Maps', 'YouTube'):
+                begin = start + timedelta(minutes=minute)
+                logs.append(AppUsageLog(
+                    device=device, app_name=app, start_time=begin, end_time=begin + timedelta(seconds=60), duration=60
+                ))
+        AppUsageLog.objects.bulk_create(logs)
+        queryset = AppUsageLog.objects.filter(device=device)
+
+        with mock.patch.object(views, 'CSV_EXPORT_CHUNK_SIZE', 4):
+            response = views.generate_csv_report(device, queryset, [], 'test')
+            lines = b''.join(response.streaming_content).decode().splitlines()
+
+        details = lines[lines.index('App Name,Start Time,End Time,Duration (minutes)') + 1:]
+        expected = [
+            f"{app_name},{start_time:%Y-%m-%d %H:%M:%S}"
+            for app_name, start_time in queryset.order_by('-start_time', '-id').values_list('app_name', 'start_time')
+        ]
+        self.assertEqual([','.join(line.split(',')[:2]) for line in details], expected)
+
+
+class OutboxDeliveryTests(TestCase):
+    def setUp(self):
+        outbox.breaker.record_success()
+        self.messages = [
+            outbox.enqueue_email(f'Subject {i}', 'Body', [f'parent{i}@example.com']) for i in range(3)
+        ]
+
+    def statuses(self):
+        return list(OutboxEmail.objects.order_by('pk').values_list('status', flat=True))
+
+    def test_each_message_is_marked_sent_as_it_goes(self):
+        sends = []
+
+        def send(email, fail_silently=False):
+            sends.append(email.subject)
+            if len(sends) == 2:
+                raise SystemExit  # The worker dies mid-batch
+            return 1
+
+        batch = outbox.claim_batch(10)
+        with mock.patch('parent_ui.outbox.EmailMultiAlternatives.send', send), self.assertRaises(SystemExit):
+            outbox.deliver_batch(batch)
+        # Only the delivered message is done; the rest are reclaimed once stale
+        self.assertEqual(self.statuses(), ['sent', 'sending', 'sending'])
+
+    def test_taken_over_claim_is_left_alone(self):
+        batch = outbox.claim_batch(10)
+        # Another worker re-claimed the batch as stale
+        OutboxEmail.objects.update(claim_token=None, status='sending')
+        with mock.patch('parent_ui.outbox.EmailMultiAlternatives.send', return_value=1):
+            outbox.deliver_batch(batch[:1])
+        self.assertEqual(self.statuses(), ['sending', 'sending', 'sending'])
+
+    @override_settings(EMAIL_OUTBOX_CLAIM_TIMEOUT_SECONDS=0)
+    def test_claim_is_renewed_during_a_batch(self):
+        batch = outbox.claim_batch(10)
+        claimed_at = OutboxEmail.objects.get(pk=batch[-1].pk).claimed_at
+        with mock.patch('parent_ui.outbox.EmailMultiAlternatives.send', return_value=1):
+            sent, failed = outbox.deliver_batch(batch)
+        self.assertEqual((sent, failed), (3, 0))
+        self.assertEqual(self.statuses(), ['sent', 'sent', 'sent'])
+        self.assertGreater(OutboxEmail.objects.get(pk=batch[-1].pk).claimed_at, claimed_at)
+
+
+@override_settings(EMAIL_OUTBOX_RETRY_BASE_SECONDS=30, EMAIL_OUTBOX_MAX_ATTEMPTS=3)
+class OutboxRetryTests(TestCase):
+    def setUp(self):
+        outbox.breaker.record_success()
+        self.addCleanup(outbox.breaker.record_success)
+
+    def deliver(self, side_effect):
+        with mock.patch('parent_ui.outbox.EmailMultiAlternatives.send', side_effect=side_effect):
+            return outbox.deliver_batch(outbox.claim_batch(10))
+
+    def make_due(self):
+        OutboxEmail.objects.update(next_attempt_at=timezone.now())
+
+    def test_refused_message_backs_off_then_fails(self):
+        message = outbox.enqueue_email('Subject', 'Body', ['parent@example.com'])
+        refused = smtplib.SMTPRecipientsRefused({'parent@example.com': (550, b'No such user')})
+
+        for attempt, delay in ((1, 30), (2, 60)):
+            before = timezone.now()
+            self.assertEqual(self.deliver(refused), (0, 1))
+            message.refresh_from_db()
+            self.assertEqual((message.status, message.attempts), ('pending', attempt))
+            self.assertAlmostEqual((message.next_attempt_at - before).total_seconds(), delay, delta=5)
+            # Not due yet
+            self.assertEqual(outbox.claim_batch(10), [])
+            self.make_due()
+
+        self.deliver(refused)
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts), ('failed', 3))
+        self.assertIn('No such user', message.last_error)
+        self.make_due()
+        self.assertEqual(outbox.claim_batch(10), [])
+
+    def test_backoff_is_capped(self):
+        self.assertEqual(outbox._backoff(1), timedelta(seconds=30))
+        self.assertEqual(outbox._backoff(4), timedelta(seconds=240))
+        self.assertEqual(outbox._backoff(20), timedelta(hours=1))
+
+    def test_provider_failure_releases_the_rest_without_an_attempt(self):
+        for i in range(3):
+            outbox.enqueue_email(f'Subject {i}', 'Body', [f'parent{i}@example.com'])
+        sent, failed = self.deliver([1, smtplib.SMTPServerDisconnected('Connection lost')])
+        self.assertEqual((sent, failed), (1, 0))
+        rows = list(OutboxEmail.objects.order_by('pk').values_list('status', 'attempts'))
+        # The message being sent used an attempt; the unsent one did not
+        self.assertEqual(rows, [('sent', 1), ('pending', 1), ('pending', 0)])
+
+    def test_breaker_opens_and_recovers(self):
+        breaker = outbox.CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'closed')
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+        self.assertFalse(breaker.allow())
+        self.assertGreater(breaker.retry_after(), 0)
+
+        with mock.patch('parent_ui.outbox.time.monotonic', return_value=breaker.opened_at + 60):
+            self.assertEqual(breaker.state, 'half-open')
+            self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual((breaker.state, breaker.retry_after()), ('closed', 0))
+
+    def test_open_breaker_stops_delivery(self):
+        outbox.enqueue_email('Subject', 'Body', ['parent@example.com'])
+        with mock.patch('parent_ui.outbox.get_connection') as get_connection, \
+                mock.patch.object(outbox.breaker, 'failure_threshold', 1):
+            get_connection.return_value.open.side_effect = OSError('Connection refused')
+            self.assertEqual(outbox.run_outbox(), 0)
+            self.assertEqual(outbox.breaker.state, 'open')
+            # Released without using up an attempt, and not retried while open
+            self.assertEqual(OutboxEmail.objects.get().attempts, 0)
+            self.make_due()
+            self.assertEqual(outbox.run_outbox(), 0)
+            self.assertEqual(get_connection.return_value.open.call_count, 1)
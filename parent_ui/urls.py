@@ -7,6 +7,11 @@ from . import views_content_filtering
 urlpatterns = [
     path('device/<str:device_id>/', views.manage_device, name='manage_device'),
     path('device/<str:device_id>/screen-time/', views.update_screen_time, name='update_screen_time'),
+    path('device/<str:device_id>/browsing/', views.browsing_report, name='browsing_report'),
+
+    # Background report exports
+    path('reports/<int:job_id>/', views.report_job_status, name='report_job_status'),
+    path('reports/<int:job_id>/download/', views.report_job_download, name='report_job_download'),
 
     # New app blocking interface
     path('device/<str:device_id>/app-blocking/', views_app_blocking.app_blocking_view, name='app_blocking'),
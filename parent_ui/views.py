@@ -1,28 +1,38 @@
 from datetime import timedelta
 import json
 import logging
-import time
 import requests
 import csv
 
+from asgiref.sync import sync_to_async
+
 from django.contrib.auth import login, update_session_auth_hash, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.views import LoginView, LogoutView
 from django.contrib import messages
 from django.core import serializers
-from django.http import HttpResponseForbidden, JsonResponse, StreamingHttpResponse, HttpResponse
+from django.http import HttpResponseForbidden, HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse, HttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
+from django.urls import reverse
 from django.utils import timezone
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_GET, require_http_methods
 from django.views.generic import TemplateView
-from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from rest_framework_simplejwt.tokens import RefreshToken
 
+from api.asgi import long_lived
+from api.authentication import CachedJWTAuthentication
 from api.models import BlockedApp, ChildDevice, CustomUser, ScreenTimeRule, AppUsageLog
+from api.presence import annotate_presence
+from api.rollups import browsing_by_day, top_domains, usage_by_app as usage_by_app_rollup, usage_by_day
 from parental_control_system import settings
+from .app_names import get_app_name_resolver
+from .events import dashboard_event_stream
 from .forms import BlockAppForm, DeviceForm, ParentRegistrationForm, ScreenTimeRuleForm, AccountSettingsForm, ChangePasswordForm
+from .models import ReportJob
+from .reports import enqueue_report
 from .tasks import send_blocked_app_notification
 
 logger = logging.getLogger(__name__)
@@ -35,7 +45,7 @@ class ParentDashboardView(TemplateView):
         context = super().get_context_data(**kwargs)
         user = self.request.user
         if user.is_authenticated:
-            context['devices'] = ChildDevice.objects.filter(parent=user)
+            context['devices'] = annotate_presence(ChildDevice.objects.filter(parent=user))
         else:
             context['devices'] = []
         
@@ -45,21 +55,9 @@ class ParentDashboardView(TemplateView):
         return context
 
 
-def event_stream(request):
-    def event_generator():
-        while True:
-            # Check for new data
-            time.sleep(5)
-            yield f"data: {json.dumps({'update': timezone.now()})}\n\n"
-
-    return StreamingHttpResponse(event_generator(), content_type='text/event-stream')
-
-
 # ...existing code...
-from django.db.models import Sum
-from django.http import HttpResponse
-from reportlab.pdfgen import canvas
-from io import BytesIO
+from django.db.models import Q, Sum
+from django.http import FileResponse, Http404, HttpResponse
 from datetime import datetime
 
 @login_required
@@ -124,17 +122,15 @@ def manage_device(request, device_id):
         start_time__lte=end_date
     )
     
-    # Prepare data for charts
-    usage_by_app = logs.values('app_name').annotate(
-        total_duration=Sum('duration')
-    ).order_by('-total_duration')
+    # Prepare data for charts from the pre-aggregated rollups
+    usage_by_app = usage_by_app_rollup(device, start_date, end_date)
     
     # Daily usage data
-    daily_usage = logs.extra(
-        {'date': "date(start_time)"}
-    ).values('date').annotate(
-        total_duration=Sum('duration')
-    ).order_by('date')
+    daily_usage = usage_by_day(device, start_date, end_date)
+
+    # Resolve every app name the page shows in one go; the template's
+    # friendly_app_name filter then reads from this request's resolver
+    get_app_name_resolver(request.user).prefetch(app['app_name'] for app in usage_by_app)
     
     if request.method == 'POST':
         form = DeviceForm(request.POST, instance=device)
@@ -154,8 +150,12 @@ def manage_device(request, device_id):
 
     # Check if download was requested (PDF or CSV)
     download_format = request.GET.get('download')
-    if download_format in ['pdf', 'csv']:
-        return generate_report(device, logs, download_format, timeframe_description)
+    if download_format == 'pdf':
+        # PDFs are rendered by the background report workers
+        job = enqueue_report(request.user, device, start_date, end_date, timeframe_description)
+        return redirect('report_job_status', job_id=job.pk)
+    if download_format == 'csv':
+        return generate_csv_report(device, logs, usage_by_app, timeframe_description)
 
     return render(request, 'parent_ui/manage_device.html', context={
         'form': form,
@@ -172,129 +172,162 @@ def manage_device(request, device_id):
         'timeframe_description': timeframe_description,
     })
 
-def generate_report(device, logs, format_type, timeframe_description):
-    if format_type == 'pdf':
-        return generate_pdf_report(device, logs, timeframe_description)
-    elif format_type == 'csv':
-        return generate_csv_report(device, logs, timeframe_description)
+# Rows fetched per query (one keyset page) when streaming a CSV export
+CSV_EXPORT_CHUNK_SIZE = 2000
 
-def generate_pdf_report(device, logs, timeframe_description):
-    from .templatetags.custom_filters import friendly_app_name
-    
-    buffer = BytesIO()
-    p = canvas.Canvas(buffer)
-    
-    # PDF content
-    p.setFont("Helvetica-Bold", 16)
-    p.drawString(100, 800, f"Device Usage Report: {device.nickname or device.device_id}")
-    p.setFont("Helvetica", 12)
-    p.drawString(100, 780, f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M')}")
-    p.drawString(100, 760, f"Timeframe: {timeframe_description}")
-    
-    # Table headers
-    p.drawString(100, 730, "App Name")
-    p.drawString(300, 730, "Start Time")
-    p.drawString(400, 730, "Duration (mins)")
-    
-    # Table rows
-    y = 710
-    for log in logs.order_by('-start_time')[:50]:  # Limit to 50 most recent logs
-        friendly_name = friendly_app_name(log.app_name, device.parent)
-        p.drawString(100, y, friendly_name)
-        p.drawString(300, y, log.start_time.strftime('%Y-%m-%d %H:%M'))
-        p.drawString(400, y, f"{round(log.duration/60, 1)}")
-        y -= 20
-        if y < 50:  # Prevent running off the page
-            p.showPage()
-            y = 750
-    
-    # Summary
-    p.showPage()
-    p.setFont("Helvetica-Bold", 14)
-    p.drawString(100, 800, f"Usage Summary ({timeframe_description})")
-    
-    total_usage = sum(log.duration for log in logs)
-    p.setFont("Helvetica", 12)
-    p.drawString(100, 770, f"Total screen time: {round(total_usage/3600, 2)} hours")
-    p.drawString(100, 750, f"Number of app sessions: {logs.count()}")
-    
-    # App usage breakdown
-    usage_by_app = logs.values('app_name').annotate(
-        total_duration=Sum('duration')
-    ).order_by('-total_duration')[:10]  # Top 10 apps
-    
-    p.drawString(100, 720, "Top 10 Apps by Usage:")
-    y = 700
-    for app in usage_by_app:
-        hours = app['total_duration'] / 3600
-        friendly_name = friendly_app_name(app['app_name'], device.parent)
-        p.drawString(100, y, f"• {friendly_name}: {round(hours, 2)} hours")
-        y -= 20
-    
-    p.save()
-    buffer.seek(0)
-    
-    response = HttpResponse(buffer, content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="{device.device_id}_usage_report_{timeframe_description.replace(" ", "_")}.pdf"'
-    return response
 
-def generate_csv_report(device, logs, timeframe_description):
-    import csv
-    from django.http import HttpResponse
-    from .templatetags.custom_filters import friendly_app_name
-    
-    response = HttpResponse(content_type='text/csv')
+class Echo:
+    """Pseudo-buffer for csv.writer: write() hands the row back instead of storing it"""
+    def write(self, value):
+        return value
+
+
+def generate_csv_report(device, logs, usage_by_app, timeframe_description):
+    """
+    Stream the usage report as CSV.
+    Totals come from the rollup-based usage_by_app and detail rows are read
+    a page at a time, keyed on (start_time, id) rather than by offset, so
+    memory use doesn't grow with the export size on any database backend
+    (MySQL drivers buffer a whole result set, .iterator() or not).
+    """
+    app_names = get_app_name_resolver(device.parent).prefetch(app['app_name'] for app in usage_by_app)
+
+    def rows():
+        # Header information
+        yield ['Device Usage Report']
+        yield ['Device', device.nickname or device.device_id]
+        yield ['Generated on', datetime.now().strftime('%Y-%m-%d %H:%M')]
+        yield ['Timeframe', timeframe_description]
+        yield []  # Empty row
+
+        # Summary
+        total_usage = sum(app['total_duration'] for app in usage_by_app)
+        session_count = sum(app['session_count'] for app in usage_by_app)
+        yield ['Summary']
+        yield ['Total screen time (hours)', round(total_usage/3600, 2)]
+        yield ['Number of app sessions', session_count]
+        yield []  # Empty row
+
+        # App usage breakdown
+        yield ['App Usage Summary']
+        yield ['App Name', 'Total Duration (hours)', 'Total Duration (minutes)']
+        for app in usage_by_app:
+            hours = app['total_duration'] / 3600
+            minutes = app['total_duration'] / 60
+            yield [app_names.resolve(app['app_name']), round(hours, 2), round(minutes, 1)]
+
+        yield []  # Empty row
+
+        # Detailed usage logs
+        yield ['Detailed Usage Logs']
+        yield ['App Name', 'Start Time', 'End Time', 'Duration (minutes)']
+
+        details = logs.order_by('-start_time', '-id').values_list('id', 'app_name', 'start_time', 'end_time', 'duration')
+        page = details[:CSV_EXPORT_CHUNK_SIZE]
+        while True:
+            chunk = list(page)
+            for _, app_name, start_time, end_time, duration in chunk:
+                yield [
+                    app_names.resolve(app_name),
+                    start_time.strftime('%Y-%m-%d %H:%M:%S'),
+                    end_time.strftime('%Y-%m-%d %H:%M:%S') if end_time else 'N/A',
+                    round(duration / 60, 1)
+                ]
+            if len(chunk) < CSV_EXPORT_CHUNK_SIZE:
+                break
+            last_id, _, last_start, _, _ = chunk[-1]
+            page = details.filter(
+                Q(start_time__lt=last_start) | Q(start_time=last_start, id__lt=last_id)
+            )[:CSV_EXPORT_CHUNK_SIZE]
+
+    writer = csv.writer(Echo())
+    response = StreamingHttpResponse(
+        (writer.writerow(row) for row in rows()),
+        content_type='text/csv'
+    )
     response['Content-Disposition'] = f'attachment; filename="{device.device_id}_usage_report_{timeframe_description.replace(" ", "_")}.csv"'
-    
-    writer = csv.writer(response)
-    
-    # Header information
-    writer.writerow(['Device Usage Report'])
-    writer.writerow(['Device', device.nickname or device.device_id])
-    writer.writerow(['Generated on', datetime.now().strftime('%Y-%m-%d %H:%M')])
-    writer.writerow(['Timeframe', timeframe_description])
-    writer.writerow([])  # Empty row
-    
-    # Summary
-    total_usage = sum(log.duration for log in logs)
-    writer.writerow(['Summary'])
-    writer.writerow(['Total screen time (hours)', round(total_usage/3600, 2)])
-    writer.writerow(['Number of app sessions', logs.count()])
-    writer.writerow([])  # Empty row
-    
-    # App usage breakdown
-    usage_by_app = logs.values('app_name').annotate(
-        total_duration=Sum('duration')
-    ).order_by('-total_duration')
-    
-    writer.writerow(['App Usage Summary'])
-    writer.writerow(['App Name', 'Total Duration (hours)', 'Total Duration (minutes)'])
-    for app in usage_by_app:
-        hours = app['total_duration'] / 3600
-        minutes = app['total_duration'] / 60
-        friendly_name = friendly_app_name(app['app_name'], device.parent)
-        writer.writerow([friendly_name, round(hours, 2), round(minutes, 1)])
-    
-    writer.writerow([])  # Empty row
-    
-    # Detailed usage logs
-    writer.writerow(['Detailed Usage Logs'])
-    writer.writerow(['App Name', 'Start Time', 'End Time', 'Duration (minutes)'])
-    
-    for log in logs.order_by('-start_time'):
-        duration_minutes = log.duration / 60
-        end_time = log.end_time.strftime('%Y-%m-%d %H:%M:%S') if log.end_time else 'N/A'
-        friendly_name = friendly_app_name(log.app_name, device.parent)
-        writer.writerow([
-            friendly_name,
-            log.start_time.strftime('%Y-%m-%d %H:%M:%S'),
-            end_time,
-            round(duration_minutes, 1)
-        ])
-    
     return response
 
 
+@login_required
+def report_job_status(request, job_id):
+    """
+    Progress page for a queued report export.
+    Returns JSON when polled with ?format=json, otherwise a page that polls
+    until the report is ready and then starts the download.
+    """
+    job = get_object_or_404(ReportJob.objects.select_related('device'), pk=job_id, parent=request.user)
+
+    if request.GET.get('format') == 'json':
+        data = {
+            'job_id': job.pk,
+            'status': job.status,
+            'created_at': job.created_at.isoformat(),
+            'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        }
+        if job.status == 'done':
+            data['download_url'] = reverse('report_job_download', kwargs={'job_id': job.pk})
+        elif job.status == 'failed':
+            data['error'] = 'Report generation failed. Please try again.'
+        return JsonResponse(data)
+
+    return render(request, 'parent_ui/report_job.html', {'job': job, 'device': job.device})
+
+
+@login_required
+def report_job_download(request, job_id):
+    """Serve a finished report export from disk"""
+    job = get_object_or_404(ReportJob.objects.select_related('device'), pk=job_id, parent=request.user)
+    if job.status != 'done' or not job.file_path:
+        return redirect('report_job_status', job_id=job.pk)
+    try:
+        report_file = open(job.file_path, 'rb')
+    except FileNotFoundError:
+        raise Http404("Report file is no longer available")
+    return FileResponse(report_file, as_attachment=True, filename=job.filename)
+
+
+# Windows offered on the browsing report, in days
+BROWSING_REPORT_WINDOWS = (7, 30, 365)
+
+
+@login_required
+def browsing_report(request, device_id):
+    """
+    Top visited and top blocked domains of a device over the last ?days=
+    (7, 30 or 365), read only from the domain x day rollups.
+    Returns JSON with ?format=json.
+    """
+    device = get_object_or_404(ChildDevice, device_id=device_id, parent=request.user)
+    days = request.GET.get('days', '30')
+    days = int(days) if days.isdigit() and int(days) in BROWSING_REPORT_WINDOWS else 30
+    end_date = timezone.localdate()
+    start_date = end_date - timedelta(days=days - 1)
+
+    top = top_domains(device, start_date, end_date, limit=20)
+    top_blocked = top_domains(device, start_date, end_date, limit=20, blocked=True)
+    daily = browsing_by_day(device, start_date, end_date)
+
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'device': device.device_id,
+            'from': start_date.isoformat(),
+            'to': end_date.isoformat(),
+            'top_domains': top,
+            'top_blocked_domains': top_blocked,
+            'daily': daily,
+        })
+
+    return render(request, 'parent_ui/browsing_report.html', {
+        'device': device,
+        'days': days,
+        'windows': BROWSING_REPORT_WINDOWS,
+        'top_domains': top,
+        'top_blocked_domains': top_blocked,
+        'daily': daily,
+    })
+
+
 import logging
 import requests
 from django.shortcuts import get_object_or_404, redirect
@@ -505,36 +538,47 @@ class ParentLoginView(LoginView):
         return '/'  # Redirect to dashboard
 
 
-@require_GET
-def sse_events(request):
+def _sse_user(request):
+    """The session user, or the user of a ?token= access token for EventSource clients"""
+    if request.user.is_authenticated:
+        return request.user
     token = request.GET.get('token')
     if not token:
-        return HttpResponseForbidden("Missing token")
-
+        return None
     try:
-        access_token = AccessToken(token)
-        user_id = access_token['user_id']
-        user = CustomUser.objects.get(id=user_id)
-        request.user = user
+        return CachedJWTAuthentication().authenticate_token(token)[0]
     except Exception as e:
-        return HttpResponseForbidden(f"Invalid token: {str(e)}")
+        logger.warning(f"Rejected dashboard event stream token: {str(e)}")
+        return None
 
-    def generate_response():
-        # Get current updates
-        current_time = timezone.now().isoformat()
-        data = {
-            'timestamp': current_time,
-            'data': {'update': current_time}
-        }
-        return f"data: {json.dumps(data)}\n\n"
+
+@long_lived
+async def sse_events(request):
+    """
+    Server-Sent Events stream of the parent's dashboard events
+    (usage_synced, device_offline, app_blocked), with heartbeats and
+    resumption from the Last-Event-ID header.
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+
+    user = await sync_to_async(_sse_user)(request)
+    if user is None:
+        return HttpResponseForbidden("Missing or invalid credentials")
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
 
     response = StreamingHttpResponse(
-        streaming_content=(generate_response(),),
+        dashboard_event_stream(user.pk, last_event_id),
         content_type='text/event-stream'
     )
-
-    # Only set safe headers
     response['Cache-Control'] = 'no-cache'
+    # Stop nginx-style proxies from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
     return response
 
 
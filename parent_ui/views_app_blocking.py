@@ -5,7 +5,9 @@ from django.contrib import messages
 from django.http import JsonResponse
 from django.views.decorators.http import require_POST
 from django.utils import timezone
-from api.models import ChildDevice, BlockedApp, AppUsageLog
+from api.models import ChildDevice, BlockedApp
+from api.rollups import usage_by_app
+from .app_names import get_app_name_resolver
 from .forms import BlockAppForm
 from .tasks import send_blocked_app_notification
 import logging
@@ -122,36 +124,21 @@ def app_blocking_view(request, device_id):
         timeframe = 'week'
         timeframe_description = "Last 7 Days"
     
-    # Get recently used apps on the device for easy blocking within the timeframe
-    recent_apps_data = AppUsageLog.objects.filter(
-        device=device,
-        start_time__gte=start_date,
-        start_time__lte=end_date
-    )
-    
-    # Get distinct app names
-    recent_apps = recent_apps_data.values('app_name').distinct()
-    
-    # Calculate total usage time for each app
-    app_usage_totals = {}
-    for log in recent_apps_data:
-        app_name = log.app_name
-        # Calculate duration in minutes
-        if log.end_time:
-            duration = (log.end_time - log.start_time).total_seconds() / 60
-        else:
-            # If end_time is None, use current time
-            duration = (timezone.now() - log.start_time).total_seconds() / 60
-        
-        if app_name in app_usage_totals:
-            app_usage_totals[app_name] += duration
-        else:
-            app_usage_totals[app_name] = duration
+    # Get recently used apps on the device for easy blocking within the timeframe,
+    # with total usage time (in minutes) read from the daily rollups
+    recent_apps = usage_by_app(device, start_date, end_date)
+    app_usage_totals = {
+        app['app_name']: app['total_duration'] / 60 for app in recent_apps
+    }
     
     # Prepare app data for the template with blocked status
     app_data = []
     blocked_package_names = set([app.package_name for app in blocked_apps if app.package_name])
     blocked_app_names = set([app.app_name for app in blocked_apps])
+    # Resolve the display names the template shows for both lists at once
+    get_app_name_resolver(request.user).prefetch(
+        [app['app_name'] for app in recent_apps] + list(blocked_app_names)
+    )
     
     # Check if any apps were blocked during the selected timeframe
     recently_blocked_apps = BlockedApp.objects.filter(
@@ -2,6 +2,8 @@
 ASGI config for parental_control_system project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Long-lived views (device-sync long-polls, dashboard event streams) are
+served without holding a thread each; see api/asgi.py.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
@@ -9,8 +11,12 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'parental_control_system.settings')
 
-application = get_asgi_application()
+django.setup(set_prefix=False)
+
+from api.asgi import ASGIHandler  # noqa: E402  (needs the app registry)
+
+application = ASGIHandler()
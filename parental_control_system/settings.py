@@ -66,14 +66,13 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',  # WhiteNoise must be after SecurityMiddleware
+    'api.middleware.AsyncWhiteNoiseMiddleware',  # WhiteNoise must be after SecurityMiddleware; async-capable for ASGI
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',  # Add CORS middleware for API requests
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'api.middleware.JWTAuthMiddleware',
-    'api.middleware.JWTMiddleware',
     # 'parent_ui.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
@@ -166,7 +165,7 @@ CORS_ALLOWED_ORIGINS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.CachedJWTAuthentication',
     )
 }
 
@@ -327,4 +326,116 @@ EMAIL_VERIFICATION_TOKEN_EXPIRES_HOURS = 24
 
 
 # settings.py
-API_BASE_URL = 'http://localhost:8080/api/'  # Adjust to your actual API base URL
\ No newline at end of file
+API_BASE_URL = 'http://localhost:8080/api/'  # Adjust to your actual API base URL
+
+# Usage ingestion
+# Number of AppUsageLog rows written per INSERT when a device uploads a backlog
+USAGE_INGEST_BATCH_SIZE = int(os.getenv('USAGE_INGEST_BATCH_SIZE', '500'))
+# Same for URLAccessLog rows, and the largest browsing batch one request may carry
+URL_LOG_INGEST_BATCH_SIZE = int(os.getenv('URL_LOG_INGEST_BATCH_SIZE', '1000'))
+URL_LOG_MAX_ENTRIES = 5000
+
+
+# App catalog cache
+# Per-process LRU of AppIcon rows; other processes see admin edits once
+# their entries are older than the TTL (seconds)
+APP_CATALOG_CACHE_SIZE = int(os.getenv('APP_CATALOG_CACHE_SIZE', '5000'))
+APP_CATALOG_CACHE_TTL = int(os.getenv('APP_CATALOG_CACHE_TTL', '300'))
+
+
+# Compiled URL filter rules, kept per process for this many devices and
+# rebuilt when a device's url_rules_version changes
+URL_MATCHER_CACHE_SIZE = int(os.getenv('URL_MATCHER_CACHE_SIZE', '1000'))
+URL_CHECK_MAX_URLS = 500  # Largest batch accepted by /api/check-urls/
+FILTER_SNAPSHOT_HISTORY = 5  # Snapshots kept per device to serve diffs from
+FILTER_SNAPSHOT_BLOOM_FP_RATE = 0.01  # False positive rate of the snapshot's Bloom filter
+
+
+# Device heartbeats and presence
+# Last-seen times are buffered per process and written every
+# HEARTBEAT_FLUSH_SECONDS, one UPDATE per HEARTBEAT_FLUSH_BATCH_SIZE devices.
+# Devices seen within PRESENCE_ONLINE_SECONDS are online, within
+# PRESENCE_IDLE_SECONDS idle, otherwise offline
+HEARTBEAT_FLUSH_SECONDS = float(os.getenv('HEARTBEAT_FLUSH_SECONDS', '5'))
+HEARTBEAT_FLUSH_BATCH_SIZE = 500
+PRESENCE_ONLINE_SECONDS = 120
+PRESENCE_IDLE_SECONDS = 900
+
+# Offline device check
+# Devices claimed, emailed and recorded per batch by check_offline_devices
+OFFLINE_CHECK_CHUNK_SIZE = int(os.getenv('OFFLINE_CHECK_CHUNK_SIZE', '1000'))
+# Threads rendering a batch's emails. Batches are claimed with SKIP LOCKED,
+# so several checkers can run at once without emailing a parent twice
+OFFLINE_CHECK_THREADS = int(os.getenv('OFFLINE_CHECK_THREADS', '4'))
+# How often run_scheduler checks, and how long a device may be silent first
+OFFLINE_CHECK_INTERVAL_SECONDS = int(os.getenv('OFFLINE_CHECK_INTERVAL_SECONDS', '3600'))
+OFFLINE_CHECK_DAYS = int(os.getenv('OFFLINE_CHECK_DAYS', '2'))
+
+
+# Event bus
+# 'local' delivers change events inside the publishing process only;
+# 'database' also relays them through the BusMessage table so every worker
+# process (long-polls, dashboard streams, caches) hears about every change
+EVENT_BUS_FANOUT = os.getenv('EVENT_BUS_FANOUT', 'local')
+EVENT_BUS_RELAY_INTERVAL = float(os.getenv('EVENT_BUS_RELAY_INTERVAL', '1.0'))
+EVENT_BUS_QUEUE_SIZE = 100  # Events buffered per subscriber before the oldest are dropped
+
+
+# Device sync long-poll
+# Longest time a device may park on api/device-sync/<id>/wait/, and how often
+# parked devices' versions are re-read to catch changes made by other workers
+DEVICE_SYNC_WAIT_MAX_SECONDS = int(os.getenv('DEVICE_SYNC_WAIT_MAX_SECONDS', '30'))
+DEVICE_SYNC_POLL_INTERVAL = float(os.getenv('DEVICE_SYNC_POLL_INTERVAL', '1.0'))
+
+
+# Dashboard event stream (parent_ui/events/)
+# Streams close after DASHBOARD_SSE_MAX_SECONDS and the browser resumes them
+# from Last-Event-ID; events older than the retention period are pruned
+# Streams are fed by the event bus; the database is only re-read this often
+# for events published by processes the bus doesn't reach
+DASHBOARD_SSE_FALLBACK_SECONDS = int(os.getenv('DASHBOARD_SSE_FALLBACK_SECONDS', '30'))
+DASHBOARD_SSE_HEARTBEAT_SECONDS = 15
+DASHBOARD_SSE_MAX_SECONDS = 300
+DASHBOARD_EVENT_RETENTION_DAYS = 7
+
+
+# Background report exports
+# Rendered files are written here and served back by job id
+REPORTS_ROOT = Path(os.getenv('REPORTS_ROOT', BASE_DIR / 'generated_reports'))
+# Render jobs in a thread pool inside the web process; set to False when
+# running dedicated `manage.py run_report_worker` processes instead
+REPORT_JOBS_IN_PROCESS = os.getenv('REPORT_JOBS_IN_PROCESS', 'True').lower() == 'true'
+REPORT_WORKER_THREADS = int(os.getenv('REPORT_WORKER_THREADS', '2'))
+REPORT_JOB_TIMEOUT_SECONDS = 600  # A running job older than this is considered abandoned
+REPORT_JOB_MAX_ATTEMPTS = 3
+REPORT_RETENTION_DAYS = 7  # Finished jobs and their files are pruned after this
+
+# Email outbox
+# Outgoing email is queued in the OutboxEmail table and sent in batches by a
+# background thread in the web process; set to False when running dedicated
+# `manage.py run_email_worker` processes instead
+EMAIL_OUTBOX_IN_PROCESS = os.getenv('EMAIL_OUTBOX_IN_PROCESS', 'True').lower() == 'true'
+EMAIL_OUTBOX_BATCH_SIZE = int(os.getenv('EMAIL_OUTBOX_BATCH_SIZE', '100'))  # Messages per SMTP connection
+EMAIL_OUTBOX_MAX_ATTEMPTS = 5
+EMAIL_OUTBOX_RETRY_BASE_SECONDS = 30  # Doubles with every failed attempt, up to an hour
+EMAIL_OUTBOX_CLAIM_TIMEOUT_SECONDS = 300  # A batch still sending after this is considered abandoned
+# Consecutive provider failures that pause delivery, and for how long
+EMAIL_OUTBOX_BREAKER_THRESHOLD = 5
+EMAIL_OUTBOX_BREAKER_RESET_SECONDS = 60
+EMAIL_OUTBOX_RETENTION_DAYS = 7  # Sent messages are pruned after this
+
+# Periodic job scheduler (`manage.py run_scheduler`)
+# A scheduler holds a job's lease while running it; if it dies the lease
+# expires and another scheduler instance takes the job over
+SCHEDULER_LEASE_SECONDS = 60
+SCHEDULER_EMAIL_INTERVAL_SECONDS = 30
+SCHEDULER_REPORT_INTERVAL_SECONDS = 60
+SCHEDULER_PRUNE_INTERVAL_SECONDS = 86400
+SCHEDULER_RUN_RETENTION_DAYS = 14  # JobRun history is pruned after this
+
+# JWT authentication caches (api.authentication)
+# Verified tokens are kept until they expire; users for JWT_USER_CACHE_TTL
+# seconds, or until they are saved
+JWT_TOKEN_CACHE_SIZE = int(os.getenv('JWT_TOKEN_CACHE_SIZE', '1000'))
+JWT_USER_CACHE_SIZE = int(os.getenv('JWT_USER_CACHE_SIZE', '1000'))
+JWT_USER_CACHE_TTL = 60
@@ -0,0 +1,11 @@
+#!/bin/bash
+
+# Start command for Render. Served over ASGI so device-sync long-polls and
+# dashboard event streams don't each hold a thread; see run_server.sh.
+
+python manage.py migrate --noinput
+
+exec gunicorn parental_control_system.asgi:application \
+    --worker-class uvicorn.workers.UvicornWorker \
+    --workers "${WEB_CONCURRENCY:-2}" \
+    --bind "0.0.0.0:${PORT:-10000}"
@@ -2,6 +2,7 @@
 
 # Script to run the offline device check management command
 # This script should be added to crontab to run automatically
+# (or run `python manage.py run_scheduler`, which runs the check without cron)
 
 # Change to the project directory
 cd /home/saidi/Projects/FINAL_PROJECT/NEW_FOLDER/FYP/parental_control_system
@@ -0,0 +1,13 @@
+#!/bin/bash
+
+# Serve the app over ASGI with uvicorn workers. Device-sync long-polls and
+# the dashboard's event stream are async views: under ASGI a parked request
+# is a held connection on the event loop rather than a busy worker thread.
+# (Under gunicorn's default sync workers each one would tie up a worker.)
+
+cd "$(dirname "$0")"
+
+exec gunicorn parental_control_system.asgi:application \
+    --worker-class uvicorn.workers.UvicornWorker \
+    --workers "${WEB_CONCURRENCY:-2}" \
+    --bind "0.0.0.0:${PORT:-8000}"